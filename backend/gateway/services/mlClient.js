@@ -6,6 +6,8 @@
  * Features:
  * - Retry logic (3 attempts)
  * - Timeout handling (10s per request)
+ * - Image and multi-modal analysis submitted as ML jobs and polled, so slow
+ *   analyses are neither cut off by the timeout nor recomputed on retry
  * - Graceful fallback on failure
  */
 
@@ -14,6 +16,8 @@ const axios = require('axios');
 const ML_SERVICE_URL = process.env.ML_SERVICE_URL || 'http://localhost:5000';
 const ML_SERVICE_TIMEOUT = parseInt(process.env.ML_SERVICE_TIMEOUT || '10000', 10);
 const ML_SERVICE_RETRIES = parseInt(process.env.ML_SERVICE_RETRIES || '3', 10);
+const ML_JOB_WAIT_TIMEOUT = parseInt(process.env.ML_JOB_WAIT_TIMEOUT || '60000', 10);
+const ML_JOB_POLL_INTERVAL = parseInt(process.env.ML_JOB_POLL_INTERVAL || '500', 10);
 
 /**
  * Create axios instance with default config
@@ -80,6 +84,36 @@ function getFallbackResponse() {
   };
 }
 
+/**
+ * Wait for a submitted ML job to finish
+ * @param {Object} job - Job returned by a /ml/jobs submission
+ * @returns {Promise<Object>} - The job's analysis result
+ */
+async function waitForJob(job) {
+  if (!job || !job.job_id) {
+    // Submission failed after all retries: retryRequest returned the fallback
+    return job || getFallbackResponse();
+  }
+
+  const deadline = Date.now() + ML_JOB_WAIT_TIMEOUT;
+  let current = job;
+  while (current.status === 'queued' || current.status === 'running') {
+    if (Date.now() >= deadline) {
+      throw new Error(`ML job ${job.job_id} did not finish within ${ML_JOB_WAIT_TIMEOUT}ms`);
+    }
+    await new Promise((resolve) => setTimeout(resolve, ML_JOB_POLL_INTERVAL));
+    current = await retryRequest(() => mlServiceClient.get(`/ml/jobs/${job.job_id}`));
+    if (!current.job_id) {
+      return current;
+    }
+  }
+
+  if (current.status !== 'done') {
+    throw new Error(current.error || `ML job ${job.job_id} ${current.status}`);
+  }
+  return current.result;
+}
+
 /**
  * Analyze text using ML service
  * @param {string} text - Text to analyze
@@ -107,17 +141,18 @@ async function analyzeImage(imagePath) {
     const fs = require('fs');
     const FormData = require('form-data');
 
-    const form = new FormData();
-    form.append('image', fs.createReadStream(imagePath));
-
-    return await retryRequest(() =>
-      axios.post(`${ML_SERVICE_URL}/ml/analyze/image`, form, {
+    // Submitted as a job: a retried submission returns the same job
+    const job = await retryRequest(() => {
+      const form = new FormData();
+      form.append('image', fs.createReadStream(imagePath));
+      return axios.post(`${ML_SERVICE_URL}/ml/jobs/image`, form, {
         headers: {
           ...form.getHeaders(),
         },
-        timeout: ML_SERVICE_TIMEOUT * 2, // Images may take longer
-      })
-    );
+        timeout: ML_SERVICE_TIMEOUT,
+      });
+    });
+    return await waitForJob(job);
   } catch (error) {
     console.error('Error calling ML service for image analysis:', error.message);
     return getFallbackResponse();
@@ -131,9 +166,20 @@ async function analyzeImage(imagePath) {
  */
 async function analyzeMulti(payload) {
   try {
-    return await retryRequest(() =>
-      mlServiceClient.post('/ml/analyze/multi', payload)
+    if (!payload.image_path) {
+      return await retryRequest(() =>
+        mlServiceClient.post('/ml/analyze/multi', payload)
+      );
+    }
+
+    // Image downloads and OCR may outlast the timeout: run as a job
+    const job = await retryRequest(() =>
+      mlServiceClient.post('/ml/jobs/multi', {
+        text: payload.text,
+        image_path: payload.image_path,
+      })
     );
+    return await waitForJob(job);
   } catch (error) {
     console.error('Error calling ML service for multi-modal analysis:', error.message);
     return getFallbackResponse();
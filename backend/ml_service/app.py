@@ -8,23 +8,89 @@ TODO: Replace stubs with real ML models:
 - Multi-modal: Combine text and image models
 """
 
-from flask import Flask
+from flask import Flask, Request, Response, g, request
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
+import time
 
-from routes.analyze import analyze_bp
+from models.ruleset import install_reload_signal
+from routes.analyze import analyze_bp, request_byte_limit, upload_too_large_response
+from services import jobs, warmup
+from utils import metrics
+
+class BoundedRequest(Request):
+    """Request whose body size is capped per route, also for chunked uploads"""
+
+    @property
+    def max_content_length(self):
+        return request_byte_limit(self.path)
+
+    def get_data(self, cache: bool = True, as_text: bool = False, parse_form_data: bool = False):
+        data = super().get_data(cache=cache, parse_form_data=parse_form_data)
+        limit = self.max_content_length
+        # Werkzeug stops reading a chunked body at the limit without failing,
+        # which would hand the route a truncated JSON body
+        if (limit is not None and self.content_length is None and len(data) >= limit
+                and self.environ['wsgi.input'].read(1)):
+            raise RequestEntityTooLarge()
+        return data.decode(errors='replace') if as_text else data
 
 app = Flask(__name__)
+app.request_class = BoundedRequest
 CORS(app)  # Allow CORS for gateway communication
 
 # Register blueprints
 app.register_blueprint(analyze_bp, url_prefix='/ml')
 
+@app.before_request
+def start_request_metrics():
+    """Track in-flight requests and start per-request stage timings"""
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    metrics.begin_request(metrics.pipeline_from_path(request.path))
+    metrics.REQUESTS_IN_FLIGHT.inc(route=g.metrics_route)
+
+@app.before_request
+def reject_oversized_body():
+    """Answer 413 from Content-Length alone, before any of the body is read"""
+    limit = request_byte_limit(request.path)
+    if limit is not None and request.content_length is not None and request.content_length > limit:
+        return upload_too_large_response()
+
+@app.after_request
+def finish_request_metrics(response):
+    """Record request latency and optionally add a Server-Timing header"""
+    if 'metrics_started' in g:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_started,
+                                        route=g.metrics_route, status=response.status_code)
+        if metrics.SERVER_TIMING_ENABLED:
+            header = metrics.server_timing_header()
+            if header:
+                response.headers['Server-Timing'] = header
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc):
+    if 'metrics_route' in g:
+        metrics.REQUESTS_IN_FLIGHT.dec(route=g.metrics_route)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics endpoint"""
+    return Response(metrics.render_metrics(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return {'status': 'ok', 'service': 'ml_service'}
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness check: 503 until warm-up has finished"""
+    state = warmup.readiness()
+    return state, 200 if warmup.is_ready() else 503
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint"""
@@ -33,13 +99,44 @@ def root():
         'version': '1.0.0',
         'endpoints': {
             'health': '/health',
+            'ready': '/ready',
+            'metrics': '/metrics',
             'analyze_text': '/ml/analyze/text',
+            'analyze_text_batch': '/ml/analyze/text/batch',
             'analyze_image': '/ml/analyze/image',
+            'analyze_image_batch': '/ml/analyze/image/batch',
+            'analyze_video': '/ml/analyze/video',
             'analyze_multi': '/ml/analyze/multi',
+            'analyze_stream': '/ml/analyze/stream',
+            'jobs_image': '/ml/jobs/image',
+            'jobs_multi': '/ml/jobs/multi',
+            'job_status': '/ml/jobs/<job_id>',
+            'cache_stats': '/ml/cache/stats',
+            'rules': '/ml/rules',
+            'rules_reload': '/ml/rules/reload',
         }
     }
 
+def start_background_services():
+    """
+    Start this process's background work
+
+    Runs warm-up in the background (see /ready), installs the SIGHUP rules
+    reload and starts the job workers. Called once per server process rather
+    than at import, so importing the app (tests, scripts) starts no threads,
+    installs no signal handler and opens no job store.
+    `python app.py` calls it; a WSGI server loading `app:app` should call it
+    once per worker process, e.g. from gunicorn's post_fork hook.
+    """
+    # Preload libraries, indexes and rules in the background; see /ready
+    warmup.start_warmup()
+    # `kill -HUP <pid>` recompiles rules/ruleset.json without a restart
+    install_reload_signal()
+    # Drain the durable job queue, resuming jobs queued before a restart
+    jobs.start_job_workers()
+
 if __name__ == '__main__':
+    start_background_services()
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('DEBUG', 'false').lower() == 'true'
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,534 @@
+"""
+ASGI entry point for the ML Service
+Serves the same /ml/analyze/* routes and /health as app.py on an async stack
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+CPU-bound analysers run on a dedicated thread pool so the event loop only
+handles I/O; multipart uploads are parsed as they stream in. Requests
+beyond ML_MAX_CONCURRENCY in flight are rejected with 429 instead of
+queuing without bound, keeping tail latency stable under load.
+
+Configuration (environment variables):
+- ML_ASGI_WORKERS: threads for CPU-bound analysis (default: 2 x CPU count)
+- ML_MAX_CONCURRENCY: in-flight analysis requests before 429 (default: 64)
+"""
+
+import asyncio
+import contextvars
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Dict
+
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from models.ruleset import RulesetError, get_ruleset, install_reload_signal, reload_ruleset, ruleset_summary
+from routes.analyze import IMAGE_BATCH_MAX_SIZE, TEXT_BATCH_MAX_SIZE, request_byte_limit
+from services import analysis, jobs, streaming, warmup
+from utils import metrics
+from utils.image_fetch import ImageFetchError
+from utils.image_io import ImagePolicyError
+from utils.job_store import JobQueueFullError
+from utils.ocr_pool import OCRPoolError
+from utils.result_cache import get_result_cache
+from utils.single_flight import CoalescingTimeoutError
+
+MAX_CONCURRENCY = int(os.environ.get('ML_MAX_CONCURRENCY', '64'))
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ML_ASGI_WORKERS', str(2 * (os.cpu_count() or 1)))),
+    thread_name_prefix='ml-asgi',
+)
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a CPU-bound or blocking call on the analysis thread pool"""
+    loop = asyncio.get_running_loop()
+    # Carry the request's metrics context into the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, partial(context.run, fn, *args, **kwargs))
+
+def error_response(error: str, message: str, status_code: int, headers=None) -> JSONResponse:
+    return JSONResponse({'error': error, 'message': message}, status_code=status_code, headers=headers)
+
+async def read_json(request: Request):
+    """Parse a JSON body, returning None when it is missing or malformed"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+class ConcurrencyLimitMiddleware:
+    """
+    Reject requests beyond a fixed number in flight with 429
+
+    Runs on the event loop, so the counter needs no lock. Paths in
+    `exempt_paths` (health probes) are never limited.
+    """
+
+    def __init__(self, app, limit: int, exempt_paths=('/health', '/ready', '/', '/metrics')):
+        self.app = app
+        self.limit = limit
+        self.exempt_paths = set(exempt_paths)
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        if self.in_flight >= self.limit:
+            response = error_response(
+                'Too many requests',
+                f'Server is at its limit of {self.limit} concurrent requests',
+                429, headers={'Retry-After': '1'},
+            )
+            await response(scope, receive, send)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+class BodyLimitMiddleware:
+    """
+    Reject request bodies over the per-route byte limit with 413
+
+    Limits come from routes/analyze.request_byte_limit, shared with the
+    Flask app. A declared Content-Length over the limit is rejected before the body is
+    read; a chunked body is cut off as soon as it crosses the limit: the 413
+    is sent, the endpoint sees a client disconnect and its own response is
+    dropped.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = request_byte_limit(scope['path']) if scope['type'] == 'http' else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        response = error_response('Upload too large', f'Request body exceeds {limit} bytes', 413)
+        declared = dict(scope.get('headers', ())).get(b'content-length')
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            await response(scope, receive, send)
+            return
+
+        state = {'received': 0, 'rejected': False, 'started': False}
+
+        async def limited_receive():
+            if state['rejected']:
+                return {'type': 'http.disconnect'}
+            message = await receive()
+            if message['type'] == 'http.request':
+                state['received'] += len(message.get('body', b''))
+                if state['received'] > limit and not state['started']:
+                    state['rejected'] = True
+                    await response(scope, receive, send)
+                    return {'type': 'http.disconnect'}
+            return message
+
+        async def guarded_send(message):
+            if message['type'] == 'http.response.start':
+                state['started'] = True
+            if not state['rejected']:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+class MetricsMiddleware:
+    """
+    Track in-flight requests and latency, and add Server-Timing headers
+
+    Mirrors the before/after request hooks of the Flask app.
+    """
+
+    def __init__(self, app, known_paths):
+        self.app = app
+        self.known_paths = set(known_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        # Unknown paths share one label to keep metric cardinality bounded
+        route = scope['path'] if scope['path'] in self.known_paths else 'unmatched'
+        started = time.perf_counter()
+        status = {'code': 500}
+        metrics.begin_request(metrics.pipeline_from_path(scope['path']))
+        metrics.REQUESTS_IN_FLIGHT.inc(route=route)
+
+        async def send_with_metrics(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                if metrics.SERVER_TIMING_ENABLED:
+                    header = metrics.server_timing_header()
+                    if header:
+                        message['headers'] = list(message.get('headers', [])) + [
+                            (b'server-timing', header.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec(route=route)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                            route=route, status=status['code'])
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streaming response produced while the request body is still being read
+
+    StreamingResponse normally watches `receive` for a client disconnect,
+    which would swallow request body chunks the endpoint has not read yet.
+    Here only the endpoint reads `receive`; a disconnect surfaces from
+    Request.stream() as ClientDisconnect.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+async def health(request: Request):
+    """Health check endpoint"""
+    return JSONResponse({'status': 'ok', 'service': 'ml_service'})
+
+async def ready(request: Request):
+    """Readiness check: 503 until warm-up has finished"""
+    return JSONResponse(warmup.readiness(), status_code=200 if warmup.is_ready() else 503)
+
+async def root(request: Request):
+    """Root endpoint"""
+    return JSONResponse({
+        'service': 'ML Service for Misinformation Detection',
+        'version': '1.0.0',
+        'endpoints': {
+            'health': '/health',
+            'ready': '/ready',
+            'metrics': '/metrics',
+            'analyze_text': '/ml/analyze/text',
+            'analyze_text_batch': '/ml/analyze/text/batch',
+            'analyze_image': '/ml/analyze/image',
+            'analyze_image_batch': '/ml/analyze/image/batch',
+            'analyze_video': '/ml/analyze/video',
+            'analyze_multi': '/ml/analyze/multi',
+            'analyze_stream': '/ml/analyze/stream',
+            'jobs_image': '/ml/jobs/image',
+            'jobs_multi': '/ml/jobs/multi',
+            'job_status': '/ml/jobs/<job_id>',
+            'cache_stats': '/ml/cache/stats',
+            'rules': '/ml/rules',
+            'rules_reload': '/ml/rules/reload',
+        }
+    })
+
+async def analyze_text(request: Request):
+    """Analyze text content (see routes/analyze.py for the contract)"""
+    try:
+        data = await read_json(request)
+
+        if not isinstance(data, dict) or 'text' not in data:
+            return error_response('Invalid input', 'Text is required', 400)
+
+        text = data['text']
+
+        if not isinstance(text, str) or len(text.strip()) == 0:
+            return error_response('Invalid input', 'Text must be a non-empty string', 400)
+
+        result = await run_blocking(analysis.analyze_text, text)
+        return JSONResponse(result)
+
+    except CoalescingTimeoutError as e:
+        return error_response('Analysis timed out', str(e), e.status_code)
+    except Exception as e:
+        return error_response('Internal server error', str(e), 500)
+
+async def analyze_text_batch(request: Request):
+    """Analyze a batch of texts (see routes/analyze.py for the contract)"""
+    try:
+        data = await read_json(request)
+
+        if not isinstance(data, dict) or not isinstance(data.get('texts'), list):
+            return error_response('Invalid input', 'texts must be an array of strings', 400)
+
+        texts = data['texts']
+
+        if len(texts) > TEXT_BATCH_MAX_SIZE:
+            return error_response(
+                'Batch too large',
+                f'At most {TEXT_BATCH_MAX_SIZE} texts are accepted per batch',
+                413,
+            )
+
+        result = await run_blocking(analysis.analyze_text_batch, texts)
+        return JSONResponse(result)
+
+    except Exception as e:
+        return error_response('Internal server error', str(e), 500)
+
+async def analyze_image(request: Request):
+    """Analyze an uploaded image (multipart/form-data with 'image' file)"""
+    try:
+        # Parts are parsed as the body streams in; large files spool to disk
+        async with request.form(max_files=1) as form:
+            file = form.get('image')
+
+            if file is None or not hasattr(file, 'read'):
+                return error_response('Invalid input', 'Image file is required', 400)
+
+            if not file.filename:
+                return error_response('Invalid input', 'No file selected', 400)
+
+            with metrics.track_stage('upload_read'):
+                image_bytes = await file.read()
+
+        result = await run_blocking(analysis.analyze_image_bytes, image_bytes)
+        return JSONResponse(result)
+
+    except OCRPoolError as e:
+        return error_response('OCR unavailable', str(e), e.status_code, headers={'Retry-After': '1'})
+    except ImagePolicyError as e:
+        return error_response('Image too large', str(e), e.status_code)
+    except CoalescingTimeoutError as e:
+        return error_response('Analysis timed out', str(e), e.status_code)
+    except Exception as e:
+        return error_response('Internal server error', str(e), 500)
+
+async def analyze_image_batch(request: Request):
+    """Analyze several uploaded images (see routes/analyze.py for the contract)"""
+    try:
+        # The parser stops at the first file over the limit, before reading the rest
+        async with request.form(max_files=IMAGE_BATCH_MAX_SIZE) as form:
+            files = [file for file in form.getlist('images') if hasattr(file, 'read')]
+
+            if not files:
+                return error_response('Invalid input', 'At least one image file is required', 400)
+
+            with metrics.track_stage('upload_read'):
+                images = [await file.read() for file in files]
+
+        result = await run_blocking(analysis.analyze_image_batch, images)
+        return JSONResponse(result)
+
+    except HTTPException as e:
+        # Raised by the multipart parser, e.g. on the file over the limit
+        if e.detail.startswith('Too many files'):
+            return error_response(
+                'Batch too large',
+                f'At most {IMAGE_BATCH_MAX_SIZE} images are accepted per batch',
+                413,
+            )
+        return error_response('Invalid input', e.detail, e.status_code)
+    except Exception as e:
+        return error_response('Internal server error', str(e), 500)
+
+def analyze_video_upload(upload, suffix: str) -> Dict:
+    """Copy a spooled upload to a file for the decoder, then analyze it"""
+    fd, path = tempfile.mkstemp(prefix='ml-video-', suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(upload, f, 1024 * 1024)
+        return analysis.analyze_video_file(path)
+    finally:
+        os.unlink(path)
+
+async def analyze_video(request: Request):
+    """Analyze an uploaded video or animation (see routes/analyze.py for the contract)"""
+    try:
+        async with request.form(max_files=1) as form:
+            file = form.get('video')
+
+            if file is None or not hasattr(file, 'read') or not file.filename:
+                return error_response('Invalid input', 'Video file is required', 400)
+
+            result = await run_blocking(analyze_video_upload, file.file, os.path.splitext(file.filename)[1])
+        return JSONResponse(result)
+
+    except OCRPoolError as e:
+        return error_response('OCR unavailable', str(e), e.status_code, headers={'Retry-After': '1'})
+    except ImagePolicyError as e:
+        return error_response('Image too large', str(e), e.status_code)
+    except ValueError as e:
+        return error_response('Invalid input', str(e), 400)
+    except CoalescingTimeoutError as e:
+        return error_response('Analysis timed out', str(e), e.status_code)
+    except Exception as e:
+        return error_response('Internal server error', str(e), 500)
+
+async def analyze_multi(request: Request):
+    """Analyze multi-modal content (see routes/analyze.py for the contract)"""
+    try:
+        data = await read_json(request) or {}
+
+        text = data.get('text', '')
+        image_path = data.get('image_path')
+
+        image_bytes = await run_blocking(analysis.read_image_source, image_path) if image_path else None
+        results = await run_blocking(analysis.analyze_multi, text, image_bytes)
+        return JSONResponse(results)
+
+    except ImagePolicyError as e:
+        return error_response('Image too large', str(e), e.status_code)
+    except ImageFetchError as e:
+        return error_response('Image fetch failed', str(e), e.status_code)
+    except Exception as e:
+        return error_response('Internal server error', str(e), 500)
+
+async def analyze_stream(request: Request):
+    """Score NDJSON records as they stream in (see routes/analyze.py for the contract)"""
+
+    async def results():
+        pending = deque()
+        try:
+            async for line in streaming.aiter_lines(request.stream()):
+                pending.append(asyncio.ensure_future(run_blocking(streaming.analyze_record, line)))
+                # Emit finished results right away; stop reading while the window is full
+                while pending and (pending[0].done() or len(pending) >= streaming.STREAM_WINDOW):
+                    yield streaming.encode_record(await pending.popleft())
+            while pending:
+                yield streaming.encode_record(await pending.popleft())
+        finally:
+            # Client went away: drop records that have not started yet
+            for task in pending:
+                task.cancel()
+
+    return DuplexStreamingResponse(results(), media_type=streaming.CONTENT_TYPE)
+
+def job_response(job, created) -> JSONResponse:
+    """202 while a job is pending, 200 once a deduplicated job has finished"""
+    job = dict(job, deduplicated=not created)
+    return JSONResponse(job, status_code=202 if job['status'] in ('queued', 'running') else 200,
+                        headers={'Location': f"/ml/jobs/{job['job_id']}"})
+
+async def submit_image_job(request: Request):
+    """Queue image analysis (see routes/analyze.py for the contract)"""
+    try:
+        async with request.form(max_files=1) as form:
+            file = form.get('image')
+
+            if file is None or not hasattr(file, 'read') or not file.filename:
+                return error_response('Invalid input', 'Image file is required', 400)
+
+            priority, callback_url = jobs.parse_job_options(form.get('priority'), form.get('callback_url'))
+
+            with metrics.track_stage('upload_read'):
+                image_bytes = await file.read()
+
+        return job_response(*await run_blocking(jobs.submit_image_job, image_bytes, priority, callback_url))
+
+    except ValueError as e:
+        return error_response('Invalid input', str(e), 400)
+    except JobQueueFullError as e:
+        return error_response('Queue full', str(e), e.status_code, headers={'Retry-After': '5'})
+    except Exception as e:
+        return error_response('Internal server error', str(e), 500)
+
+async def submit_multi_job(request: Request):
+    """Queue multi-modal analysis (see routes/analyze.py for the contract)"""
+    try:
+        data = await read_json(request) or {}
+
+        text = data.get('text') or ''
+        image_path = data.get('image_path') or None
+        if not isinstance(text, str) or (not text.strip() and not image_path):
+            return error_response('Invalid input', 'Text or image_path is required', 400)
+
+        priority, callback_url = jobs.parse_job_options(data.get('priority'), data.get('callback_url'))
+        return job_response(*await run_blocking(jobs.submit_multi_job, text, image_path, priority, callback_url))
+
+    except ValueError as e:
+        return error_response('Invalid input', str(e), 400)
+    except JobQueueFullError as e:
+        return error_response('Queue full', str(e), e.status_code, headers={'Retry-After': '5'})
+    except Exception as e:
+        return error_response('Internal server error', str(e), 500)
+
+async def get_job(request: Request):
+    """Status of a submitted job (see routes/analyze.py for the contract)"""
+    job_id = request.path_params['job_id']
+    job = await run_blocking(jobs.get_job, job_id)
+    if job is None:
+        return error_response('Not found', f'No job {job_id} (unknown or expired)', 404)
+    return JSONResponse(job)
+
+async def metrics_endpoint(request: Request):
+    """Prometheus metrics endpoint"""
+    return Response(metrics.render_metrics(), headers={'content-type': metrics.CONTENT_TYPE})
+
+async def cache_stats(request: Request):
+    """Result cache statistics"""
+    cache = get_result_cache()
+    if cache is None:
+        return JSONResponse({'enabled': False})
+    return JSONResponse(cache.stats())
+
+async def rules(request: Request):
+    """Active scoring ruleset (see routes/analyze.py for the contract)"""
+    try:
+        return JSONResponse(ruleset_summary(await run_blocking(get_ruleset)))
+    except RulesetError as e:
+        return error_response('Invalid ruleset', str(e), 500)
+
+async def reload_rules(request: Request):
+    """Recompile and swap in the ruleset (see routes/analyze.py for the contract)"""
+    try:
+        previous, ruleset = await run_blocking(reload_ruleset)
+    except RulesetError as e:
+        return error_response('Invalid ruleset', str(e), 422)
+
+    result = ruleset_summary(ruleset)
+    result['previous_version'] = previous.version if previous else None
+    result['changed'] = previous is None or previous.fingerprint != ruleset.fingerprint
+    return JSONResponse(result)
+
+routes = [
+    Route('/health', health, methods=['GET']),
+    Route('/ready', ready, methods=['GET']),
+    Route('/', root, methods=['GET']),
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Route('/ml/analyze/text', analyze_text, methods=['POST']),
+    Route('/ml/analyze/text/batch', analyze_text_batch, methods=['POST']),
+    Route('/ml/analyze/image', analyze_image, methods=['POST']),
+    Route('/ml/analyze/image/batch', analyze_image_batch, methods=['POST']),
+    Route('/ml/analyze/video', analyze_video, methods=['POST']),
+    Route('/ml/analyze/multi', analyze_multi, methods=['POST']),
+    Route('/ml/analyze/stream', analyze_stream, methods=['POST']),
+    Route('/ml/jobs/image', submit_image_job, methods=['POST']),
+    Route('/ml/jobs/multi', submit_multi_job, methods=['POST']),
+    Route('/ml/jobs/{job_id}', get_job, methods=['GET']),
+    Route('/ml/cache/stats', cache_stats, methods=['GET']),
+    Route('/ml/rules', rules, methods=['GET']),
+    Route('/ml/rules/reload', reload_rules, methods=['POST']),
+]
+
+@asynccontextmanager
+async def lifespan(app):
+    # Warm up in the background so /health answers while /ready waits
+    warmup.start_warmup()
+    # `kill -HUP <pid>` recompiles rules/ruleset.json without a restart
+    install_reload_signal()
+    # Resume jobs queued before a restart
+    jobs.start_job_workers()
+    yield
+
+starlette_app = Starlette(routes=routes, lifespan=lifespan)
+app = MetricsMiddleware(
+    ConcurrencyLimitMiddleware(BodyLimitMiddleware(starlette_app), MAX_CONCURRENCY),
+    known_paths=[route.path for route in routes],
+)
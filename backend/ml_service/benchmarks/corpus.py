@@ -0,0 +1,113 @@
+"""
+Benchmark Corpus
+Deterministic synthetic inputs for the ML service benchmarks
+
+Every item is generated from a fixed seed, so two runs (on any machine or
+commit) measure exactly the same inputs.
+"""
+
+import random
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+SEED = 20240601
+
+# Filler vocabulary mixed with the words the text rules look for
+_FILLER = (
+    'the a of and to in is that it for on with as was by report officials said '
+    'city council health new data week people study research local according '
+    'percent year government public water school market energy vaccine'
+).split()
+_TRIGGERS = [
+    'miracle', 'cure', 'shocking', "you won't believe", 'doctors hate', 'secret',
+    'never', 'always', 'all', 'everyone', 'nobody', 'impossible', 'urgent',
+    'act now', 'breaking', 'guaranteed', 'amazing', 'terrible', 'none',
+]
+
+# (label, width, height)
+IMAGE_SIZES = [
+    ('small_320x240', 320, 240),
+    ('hd_1280x720', 1280, 720),
+    ('fhd_1920x1080', 1920, 1080),
+    ('12mp_4000x3000', 4000, 3000),
+]
+
+def _sentence(rng: random.Random, words: int, trigger_rate: float) -> str:
+    tokens = [rng.choice(_TRIGGERS) if rng.random() < trigger_rate else rng.choice(_FILLER)
+              for _ in range(words)]
+    return ' '.join(tokens).capitalize() + '.'
+
+def make_text(rng: random.Random, target_chars: int, trigger_rate: float = 0.03) -> str:
+    """Paragraphs of pseudo-prose of roughly target_chars characters"""
+    parts: List[str] = []
+    size = 0
+    while size < target_chars:
+        sentence = _sentence(rng, rng.randint(8, 24), trigger_rate)
+        parts.append(sentence + ('\n' if rng.random() < 0.15 else ' '))
+        size += len(sentence) + 1
+    return ''.join(parts)[:target_chars]
+
+def text_corpus() -> Dict[str, List[str]]:
+    """
+    Text inputs by size class
+
+    Returns:
+        {"short_post": [...], "article_5kb": [...], "article_50kb": [...], "page_100kb": [...]}
+    """
+    rng = random.Random(SEED)
+    return {
+        'short_post': [make_text(rng, rng.randint(80, 280), 0.08) for _ in range(200)],
+        'article_5kb': [make_text(rng, 5_000) for _ in range(20)],
+        'article_50kb': [make_text(rng, 50_000) for _ in range(5)],
+        'page_100kb': [make_text(rng, 100_000) for _ in range(3)],
+    }
+
+def make_image(width: int, height: int, with_text: bool, seed: int) -> np.ndarray:
+    """Photo-like BGR image: gradient, shapes and sensor noise, optionally captioned"""
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    base = rng.integers(40, 200, 3)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    for channel in range(3):
+        img[:, :, channel] = base[channel] + 50 * (x * (channel + 1) - y)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+
+    for _ in range(25):
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cx, cy = int(rng.integers(0, width)), int(rng.integers(0, height))
+        radius = int(rng.integers(max(4, width // 40), max(8, width // 6)))
+        if rng.random() < 0.5:
+            cv2.circle(img, (cx, cy), radius, color, -1)
+        else:
+            cv2.rectangle(img, (cx, cy), (cx + radius, cy + radius // 2), color, -1)
+
+    if with_text:
+        scale = max(0.5, width / 800)
+        thickness = max(1, int(scale * 2))
+        for line in range(4):
+            cv2.putText(img, 'BREAKING: miracle cure found', (width // 20, (line + 1) * height // 6),
+                        cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), thickness + 2)
+            cv2.putText(img, 'BREAKING: miracle cure found', (width // 20, (line + 1) * height // 6),
+                        cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 0, 0), thickness)
+
+    noise = rng.normal(0, 4, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+def image_corpus(sizes=IMAGE_SIZES) -> List[Tuple[str, bytes]]:
+    """
+    JPEG-encoded images, with and without overlaid text, for each size
+
+    Returns:
+        List of (label, jpeg_bytes), e.g. ("hd_1280x720_text", b"...")
+    """
+    images = []
+    for index, (label, width, height) in enumerate(sizes):
+        for with_text in (False, True):
+            pixels = make_image(width, height, with_text, SEED + 2 * index + int(with_text))
+            ok, encoded = cv2.imencode('.jpg', pixels, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            assert ok
+            images.append((f'{label}_{"text" if with_text else "plain"}', encoded.tobytes()))
+    return images
@@ -0,0 +1,308 @@
+"""
+Benchmark Runner
+Micro and end-to-end benchmarks for the ML service hot paths
+
+Usage (from backend/ml_service):
+    python -m benchmarks.run                       # full suite
+    python -m benchmarks.run --quick               # smaller images, fewer repeats
+    python -m benchmarks.run --compare old.json    # also compare against an earlier run
+
+Results are written as JSON to benchmarks/results/<commit>.json (or
+--output). With --compare, cases whose median got slower than
+--threshold (default 10%) are listed and the exit code is 1, so the
+runner can gate CI. The result cache is disabled during the run so every
+iteration measures real work.
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks.corpus import IMAGE_SIZES, image_corpus, text_corpus  # noqa: E402
+from models.image_model import analyze_image_content, extract_image_features  # noqa: E402
+from models.ruleset import get_ruleset  # noqa: E402
+from models.text_model import KeywordMatcher, analyze_text_content  # noqa: E402
+from utils.image_io import DecodedImage  # noqa: E402
+from utils.claim_index import get_claim_index  # noqa: E402
+from utils.near_duplicate import NearDuplicateIndex  # noqa: E402
+from utils.ocr_stub import extract_text_from_image, extract_text_with_gate  # noqa: E402
+from utils.text_detect import find_text_regions  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 1) -> Dict:
+    """
+    Time repeated calls of fn
+
+    Returns:
+        {"runs", "min_ms", "median_ms", "p95_ms", "mean_ms", "ops_per_sec"}
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+def summarize(samples: List[float]) -> Dict:
+    ordered = sorted(samples)
+    median = statistics.median(ordered)
+    return {
+        'runs': len(ordered),
+        'min_ms': round(ordered[0] * 1000, 4),
+        'median_ms': round(median * 1000, 4),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 4),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 4),
+        'ops_per_sec': round(1 / median, 2) if median > 0 else None,
+    }
+
+def cycle(items):
+    """Callable factory that walks through items round-robin"""
+    state = {'i': 0}
+
+    def next_item():
+        item = items[state['i'] % len(items)]
+        state['i'] += 1
+        return item
+    return next_item
+
+def single_pass_keyword_counter(matcher: KeywordMatcher) -> Callable[[str], Dict[str, int]]:
+    """
+    KeywordMatcher.count as one combined-regex pass over the text
+
+    The reference the keyword matcher is measured against. A lookahead at
+    every position reports the longest keyword starting there; keywords
+    that are prefixes of it are credited too, so overlapping and nested
+    keywords count exactly as with substring search.
+    """
+    families = dict(matcher.vocabulary)
+    keywords = sorted(families, key=len, reverse=True)
+    implied = {keyword: [other for other in keywords if keyword.startswith(other)] for keyword in keywords}
+    pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in keywords) + '))')
+
+    def count(text_lower: str) -> Dict[str, int]:
+        found = set()
+        for match in pattern.finditer(text_lower):
+            found.update(implied[match.group(1)])
+        counts = dict.fromkeys(matcher.families, 0)
+        for keyword in found:
+            for family in families[keyword]:
+                counts[family] += 1
+        return counts
+    return count
+
+def micro_benchmarks(texts, images, repeat: int) -> Dict[str, Dict]:
+    results = {}
+
+    for size_class, items in texts.items():
+        pick = cycle(items)
+        results[f'micro.analyze_text_content.{size_class}'] = measure(
+            lambda: analyze_text_content(pick()), repeat)
+
+    # Keyword counting: per-keyword substring search vs one combined-regex pass
+    matcher = get_ruleset().keyword_matcher
+    single_pass = single_pass_keyword_counter(matcher)
+    for size_class, items in texts.items():
+        pick = cycle([text.lower() for text in items])
+        results[f'micro.keyword_matcher.{size_class}'] = measure(lambda: matcher.count(pick()), repeat)
+        results[f'micro.keyword_matcher.single_pass_regex.{size_class}'] = measure(
+            lambda: single_pass(pick()), repeat)
+
+    # Near-duplicate lookup against an index holding every corpus text
+    index = NearDuplicateIndex()
+    corpus = [text for items in texts.values() for text in items]
+    for text in corpus:
+        index.add(index.signature(text), 'bench', {'text': text[:16]})
+    pick = cycle(corpus)
+    results['micro.near_duplicate_lookup'] = measure(
+        lambda: index.query(index.signature(pick() + ' !!'), 'bench'), repeat)
+
+    claim_index = get_claim_index()
+    pick = cycle(texts['short_post'])
+    results['micro.claim_search'] = measure(lambda: claim_index.search(pick()), repeat)
+
+    for label, data in images:
+        decoded = DecodedImage.from_bytes(data)
+        results[f'micro.decode.{label}'] = measure(lambda: DecodedImage.from_bytes(data), repeat)
+        results[f'micro.extract_image_features.{label}'] = measure(
+            lambda: extract_image_features(decoded.bgr), repeat)
+        results[f'micro.analyze_image_content.{label}'] = measure(
+            lambda: analyze_image_content(DecodedImage.from_bytes(data)), repeat)
+        results[f'micro.extract_text_from_image.{label}'] = measure(
+            lambda: extract_text_from_image(decoded), max(1, repeat // 3))
+        results[f'micro.find_text_regions.{label}'] = measure(lambda: find_text_regions(decoded), repeat)
+        results[f'micro.extract_text_with_gate.{label}'] = measure(
+            lambda: extract_text_with_gate(decoded), max(1, repeat // 3))
+
+    return results
+
+def e2e_benchmarks(texts, images, repeat: int, concurrency_levels) -> Dict[str, Dict]:
+    from app import app
+    from services import warmup
+
+    # Measure steady state, not the background warm-up
+    warmup.start_warmup()
+    warmup.wait_until_ready()
+    app.config['TESTING'] = True
+    client = app.test_client()
+    results = {}
+
+    short_posts = cycle(texts['short_post'])
+    articles = cycle(texts['article_5kb'])
+    results['e2e.text.short_post'] = measure(
+        lambda: client.post('/ml/analyze/text', json={'text': short_posts()}), repeat)
+    results['e2e.text.article_5kb'] = measure(
+        lambda: client.post('/ml/analyze/text', json={'text': articles()}), repeat)
+    batch = texts['short_post'][:100]
+    results['e2e.text_batch.100_short_posts'] = measure(
+        lambda: client.post('/ml/analyze/text/batch', json={'texts': batch}), max(1, repeat // 2))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, data in images:
+            results[f'e2e.image.{label}'] = measure(
+                lambda: client.post('/ml/analyze/image',
+                                    data={'image': (io.BytesIO(data), f'{label}.jpg')},
+                                    content_type='multipart/form-data'),
+                max(1, repeat // 3))
+
+            path = os.path.join(tmp_dir, f'{label}.jpg')
+            with open(path, 'wb') as f:
+                f.write(data)
+            results[f'e2e.multi.{label}'] = measure(
+                lambda: client.post('/ml/analyze/multi', json={'text': short_posts(), 'image_path': path}),
+                max(1, repeat // 3))
+
+    for workers in concurrency_levels:
+        results[f'e2e.text.concurrency_{workers}'] = concurrent_load(
+            app, lambda c: c.post('/ml/analyze/text', json={'text': short_posts()}),
+            workers, requests_per_worker=max(5, repeat))
+
+    return results
+
+def concurrent_load(app, send: Callable, workers: int, requests_per_worker: int) -> Dict:
+    """Latency and aggregate throughput with `workers` concurrent clients"""
+    samples: List[float] = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        local = []
+        for _ in range(requests_per_worker):
+            started = time.perf_counter()
+            send(client)
+            local.append(time.perf_counter() - started)
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stats = summarize(samples)
+    stats['throughput_rps'] = round(len(samples) / elapsed, 2)
+    stats['workers'] = workers
+    return stats
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(__file__), text=True).strip()
+    except Exception:
+        return 'unknown'
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Compare median latencies against a baseline run
+
+    Returns:
+        Human-readable lines for cases slower than the threshold
+    """
+    regressions = []
+    for name, stats in sorted(current['results'].items()):
+        base = baseline.get('results', {}).get(name)
+        if not base or not base.get('median_ms'):
+            continue
+        ratio = stats['median_ms'] / base['median_ms']
+        marker = 'REGRESSION' if ratio > 1 + threshold else ''
+        print(f'{name:70s} {base["median_ms"]:10.3f} -> {stats["median_ms"]:10.3f} ms  x{ratio:5.2f} {marker}')
+        if marker:
+            regressions.append(f'{name}: {base["median_ms"]} -> {stats["median_ms"]} ms (x{ratio:.2f})')
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='ML service benchmarks')
+    parser.add_argument('--quick', action='store_true', help='skip 12 MP images and use fewer repeats')
+    parser.add_argument('--repeat', type=int, default=None, help='timed iterations per case')
+    parser.add_argument('--only', choices=['micro', 'e2e'], default=None, help='run one suite')
+    parser.add_argument('--output', default=None, help='result file (default: results/<commit>.json)')
+    parser.add_argument('--compare', default=None, help='baseline result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed median slowdown (0.10 = 10%%)')
+    args = parser.parse_args(argv)
+
+    # Measure real work, never cached results
+    os.environ['ML_CACHE_BACKEND'] = 'off'
+    os.environ['ML_NEARDUP'] = 'false'
+
+    repeat = args.repeat or (5 if args.quick else 20)
+    sizes = IMAGE_SIZES[:-1] if args.quick else IMAGE_SIZES
+    texts = text_corpus()
+    images = image_corpus(sizes)
+    concurrency_levels = (1, 4) if args.quick else (1, 4, 16)
+
+    results: Dict[str, Dict] = {}
+    if args.only in (None, 'micro'):
+        results.update(micro_benchmarks(texts, images, repeat))
+    if args.only in (None, 'e2e'):
+        results.update(e2e_benchmarks(texts, images, repeat, concurrency_levels))
+
+    commit = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'quick': args.quick,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f'Wrote {len(results)} benchmark results to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) above {args.threshold:.0%}:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,19 +11,44 @@ TODO: Replace with real ML models:
 4. Load pre-trained models and use for analysis
 """
 
+from __future__ import annotations
+
 import os
-import cv2
-import numpy as np
-from PIL import Image
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
+
+from models.ruleset import Ruleset, get_ruleset
+from utils.image_io import DecodedImage, load_image
+from utils.lazy_import import lazy_import
+from utils.metrics import track_stage
+
+# Loaded on first use, so text-only workers never import them
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Bump whenever scoring heuristics change, so cached results produced by
+# older versions are not reused (thresholds live in the ruleset, whose
+# fingerprint is part of the cache key as well)
+MODEL_VERSION = '1.5.0'
 
-def analyze_image_content(image_path: str, ocr_text: Optional[str] = None) -> Dict:
+# Images whose longest side exceeds ML_ANALYSIS_MAX_SIDE (0 = never) have
+# their pixel statistics estimated from an evenly spaced grid of
+# full-resolution tiles totalling roughly MAX_SIDE px on the longest side.
+# Sampling at native resolution keeps blur/edge statistics comparable with
+# a full-image pass, which a downscaled copy would not (downscaling sharpens
+# blur and multiplies edge density).
+ANALYSIS_MAX_SIDE = int(os.environ.get('ML_ANALYSIS_MAX_SIDE', '1024'))
+ANALYSIS_TILE_GRID = 8
+
+def analyze_image_content(image: Union[str, DecodedImage, None], ocr_text: Optional[str] = None,
+                          ruleset: Optional[Ruleset] = None, metadata: bool = True) -> Dict:
     """
     Analyze image content for misinformation indicators
     
     Args:
-        image_path: Path to image file
+        image: Path to image file, or an image already decoded by the caller
         ocr_text: Optional OCR-extracted text from image
+        ruleset: Rules to score with (default: the active ruleset)
+        metadata: Check EXIF metadata; off for video frames, which have none
         
     Returns:
         Dictionary with analysis results:
@@ -32,54 +57,71 @@ def analyze_image_content(image_path: str, ocr_text: Optional[str] = None) -> Di
             "manipulation_prob": float (0-1),
             "match_sources": List[Dict],
             "ocr_text": str,
-            "reasons": List[str]
+            "reasons": List[str],
+            "ruleset_version": str
         }
     """
-    score = 50  # Base score
+    # Pinned for the whole call, so a concurrent reload cannot mix rule versions
+    ruleset = ruleset or get_ruleset()
+    rules = ruleset.image
+    
+    score = rules['base_score']  # Base score
     reasons = []
     manipulation_prob = 0.0
     match_sources = []
     
     try:
-        # Load image
-        img = cv2.imread(image_path)
-        if img is None:
+        # Load image (decoded once and shared by every stage below)
+        decoded = load_image(image)
+        if decoded is None:
             return {
                 'visual_analysis_score': 0,
                 'manipulation_prob': 1.0,
                 'match_sources': [],
                 'ocr_text': ocr_text or '',
                 'reasons': ['Failed to load image'],
+                'ruleset_version': ruleset.version,
             }
+        img = decoded.bgr
+        
+        # Grayscale, Laplacian, edge and saturation statistics in one pass
+        with track_stage('features'):
+            features = extract_image_features(img)
         
         # 1. Check image quality and blurriness
-        blur_score = detect_blur(img)
-        if blur_score < 100:  # Low variance indicates blur
-            score -= 10
+        with track_stage('blur'):
+            blur_score = detect_blur(img, features)
+        if blur_score < rules['blur_laplacian_var_below']:  # Low variance indicates blur
+            score -= rules['blur_penalty']
             reasons.append('Image appears blurry or low quality')
-            manipulation_prob += 0.1
+            manipulation_prob += rules['blur_manipulation_prob']
         
         # 2. Check for manipulation indicators (simplified)
         # TODO: Replace with real deepfake/manipulation detection model
         # Using simple heuristics for now
-        manipulation_indicators = detect_manipulation_indicators(img)
+        with track_stage('manipulation'):
+            manipulation_indicators = detect_manipulation_indicators(img, features, rules)
         if manipulation_indicators > 0:
-            manipulation_prob += 0.2 * manipulation_indicators
-            score -= manipulation_indicators * 15
+            manipulation_prob += rules['manipulation_indicator_prob'] * manipulation_indicators
+            score -= manipulation_indicators * rules['manipulation_indicator_penalty']
             reasons.append(f'Detected {manipulation_indicators} potential manipulation indicator(s)')
         
         # 3. Check metadata (if available)
-        metadata_issues = check_metadata(image_path)
+        metadata_issues = False
+        if metadata:
+            with track_stage('metadata'):
+                metadata_issues = check_metadata(decoded)
         if metadata_issues:
-            score -= 10
+            score -= rules['metadata_penalty']
             reasons.append('Metadata inconsistencies detected')
-            manipulation_prob += 0.15
+            manipulation_prob += rules['metadata_manipulation_prob']
         
         # 4. Reverse image search (mock using image hashing)
         # TODO: Replace with real reverse image search API
-        match_sources = perform_reverse_search(image_path)
+        with track_stage('reverse_search'):
+            match_sources = perform_reverse_search(decoded, int(rules['reverse_match_max_distance']))
         if len(match_sources) > 0:
-            score += 10  # Boost for verified sources
+            score += rules['reverse_match_bonus']  # Boost for verified sources
             reasons.append(f'Found {len(match_sources)} matching source(s)')
         else:
             reasons.append('No matching sources found')
@@ -94,6 +136,7 @@ def analyze_image_content(image_path: str, ocr_text: Optional[str] = None) -> Di
             'match_sources': match_sources,
             'ocr_text': ocr_text or '',
             'reasons': reasons[:5],  # Top 5 reasons
+            'ruleset_version': ruleset.version,
         }
         
     except Exception as e:
@@ -103,53 +146,120 @@ def analyze_image_content(image_path: str, ocr_text: Optional[str] = None) -> Di
             'match_sources': [],
             'ocr_text': ocr_text or '',
             'reasons': [f'Error analyzing image: {str(e)}'],
+            'ruleset_version': ruleset.version,
+        }
+
+def extract_image_features(img: np.ndarray, max_side: Optional[int] = None) -> Dict[str, float]:
+    """
+    Compute every pixel statistic used by the image scorers
+    
+    The grayscale image is computed once per region and shared by the
+    Laplacian and Canny steps. Large images are sampled as a grid of
+    full-resolution tiles (see ANALYSIS_MAX_SIDE); smaller ones are
+    analysed whole, giving exactly the full-image values.
+    
+    Args:
+        img: BGR image
+        max_side: Analysis budget as a longest side in px (default: ANALYSIS_MAX_SIDE)
+        
+    Returns:
+        {
+            "laplacian_var": float,
+            "edge_density": float,
+            "saturation_std": float,
+            "sampled": bool
+        }
+    """
+    max_side = ANALYSIS_MAX_SIDE if max_side is None else max_side
+    height, width = img.shape[:2]
+    
+    if not max_side or max(height, width) <= max_side:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        edges = cv2.Canny(gray, 50, 150)
+        saturation = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)[:, :, 1]
+        return {
+            'laplacian_var': float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+            'edge_density': float(np.count_nonzero(edges) / edges.size),
+            'saturation_std': float(np.std(saturation)),
+            'sampled': False,
         }
+    
+    grid = ANALYSIS_TILE_GRID
+    scale = max_side / max(height, width)
+    tile_h = min(height, max(16, int(height * scale / grid)))
+    tile_w = min(width, max(16, int(width * scale / grid)))
+    rows = np.linspace(0, height - tile_h, grid).astype(int)
+    cols = np.linspace(0, width - tile_w, grid).astype(int)
+    
+    # Running sums so the tiles combine into whole-sample statistics
+    count = edge_count = 0
+    lap_sum = lap_sq = sat_sum = sat_sq = 0.0
+    for y in rows:
+        for x in cols:
+            tile = img[y:y + tile_h, x:x + tile_w]
+            gray = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
+            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
+            saturation = cv2.cvtColor(tile, cv2.COLOR_BGR2HSV)[:, :, 1].astype(np.float64)
+            count += gray.size
+            edge_count += np.count_nonzero(cv2.Canny(gray, 50, 150))
+            lap_sum += laplacian.sum()
+            lap_sq += np.square(laplacian).sum()
+            sat_sum += saturation.sum()
+            sat_sq += np.square(saturation).sum()
+    
+    lap_mean = lap_sum / count
+    sat_mean = sat_sum / count
+    return {
+        'laplacian_var': float(max(0.0, lap_sq / count - lap_mean * lap_mean)),
+        'edge_density': float(edge_count / count),
+        'saturation_std': float(np.sqrt(max(0.0, sat_sq / count - sat_mean * sat_mean))),
+        'sampled': True,
+    }
 
-def detect_blur(img: np.ndarray) -> float:
+def detect_blur(img: np.ndarray, features: Optional[Dict[str, float]] = None) -> float:
     """
     Detect blur using Laplacian variance
     Higher variance = sharper image
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return laplacian_var
+    features = features or extract_image_features(img)
+    return features['laplacian_var']
 
-def detect_manipulation_indicators(img: np.ndarray) -> int:
+def detect_manipulation_indicators(img: np.ndarray, features: Optional[Dict[str, float]] = None,
+                                   rules: Optional[Dict] = None) -> int:
     """
     Simple heuristics for manipulation detection
     TODO: Replace with real deepfake/manipulation detection model
     
+    Thresholds come from the ruleset's image section (default: active ruleset).
+    
     Returns count of detected indicators
     """
+    features = features or extract_image_features(img)
+    rules = rules or get_ruleset().image
     indicators = 0
     
     # Check for compression artifacts (simplified)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 50, 150)
-    edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1])
+    edge_density = features['edge_density']
     
     # Unusual edge patterns might indicate manipulation
-    if edge_density < 0.05 or edge_density > 0.5:
+    if edge_density < rules['edge_density_min'] or edge_density > rules['edge_density_max']:
         indicators += 1
     
     # Check for color inconsistencies (simplified)
     # In production, use more sophisticated methods
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    saturation = hsv[:, :, 1]
-    if np.std(saturation) < 10:  # Very uniform saturation might indicate manipulation
+    if features['saturation_std'] < rules['saturation_std_below']:  # Very uniform saturation might indicate manipulation
         indicators += 1
     
     return indicators
 
-def check_metadata(image_path: str) -> bool:
+def check_metadata(image: Union[str, DecodedImage]) -> bool:
     """
     Check image metadata for inconsistencies
     Returns True if issues found
     """
     try:
-        from PIL.ExifTags import TAGS
-        img = Image.open(image_path)
-        exif = img._getexif()
+        decoded = load_image(image)
+        exif = decoded.exif()
         
         if exif is None:
             return True  # Missing EXIF data might be suspicious
@@ -161,50 +271,35 @@ def check_metadata(image_path: str) -> bool:
     except Exception:
         return True  # Error reading metadata
 
-def perform_reverse_search(image_path: str) -> List[Dict]:
+def perform_reverse_search(image: Union[str, DecodedImage], max_distance: int = 9) -> List[Dict]:
     """
     Perform reverse image search using image hashing
-    Compares against sample images in samples/ directory
+    Looks up the image's average hash in the persistent index of sample
+    images in samples/ (see utils/hash_index.py)
+    
+    Returns up to 3 matches within Hamming distance max_distance, closest first
     
     TODO: Replace with real reverse image search API
     """
     try:
-        import imagehash
+        from utils.hash_index import get_hash_index
         
-        # Calculate hash of input image
-        img = Image.open(image_path)
-        input_hash = imagehash.average_hash(img)
+        # Calculate hash of input image (cached on the decoded image)
+        input_hash = load_image(image).average_hash
         
-        # Compare with sample images
-        samples_dir = os.path.join(os.path.dirname(__file__), '..', 'samples')
+        # If similar (hamming distance <= max_distance), consider it a match
         matches = []
+        for filename, hamming_distance in get_hash_index().query(input_hash, max_distance=max_distance, top_k=3):
+            matches.append({
+                'source': f'Sample Image: {filename}',
+                'url': f'/samples/{filename}',
+                'match_confidence': 1.0 - (hamming_distance / 64.0),
+            })
         
-        if os.path.exists(samples_dir):
-            for filename in os.listdir(samples_dir):
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    sample_path = os.path.join(samples_dir, filename)
-                    try:
-                        sample_img = Image.open(sample_path)
-                        sample_hash = imagehash.average_hash(sample_img)
-                        
-                        # Calculate hamming distance
-                        hamming_distance = input_hash - sample_hash
-                        
-                        # If similar (hamming distance < 10), consider it a match
-                        if hamming_distance < 10:
-                            matches.append({
-                                'source': f'Sample Image: {filename}',
-                                'url': f'/samples/{filename}',
-                                'match_confidence': 1.0 - (hamming_distance / 64.0),
-                            })
-                    except Exception:
-                        continue
-        
-        return matches[:3]  # Return top 3 matches
+        return matches
         
     except ImportError:
         # imagehash not available, return empty
         return []
     except Exception:
         return []
-
@@ -0,0 +1,198 @@
+"""
+Scoring Ruleset
+Versioned, hot-reloadable rules shared by the text and image scorers
+
+Keyword families, penalties, contradiction pairs and image thresholds are
+read from a JSON file (rules/ruleset.json) and compiled once per load into
+the matchers the scorers use. The active ruleset is a single reference that
+reload_ruleset() replaces atomically after the new file compiled cleanly:
+requests already running keep the ruleset they started with, new requests
+see the new one, and an invalid file leaves the current rules in place.
+
+Reloads are triggered by POST /ml/rules/reload or by SIGHUP. Every analysis
+result carries the `ruleset_version` it was scored with, and cache keys
+include the ruleset fingerprint so results from older rules are not reused.
+
+Configuration (environment variables):
+- ML_RULES_PATH: ruleset file (default: rules/ruleset.json)
+"""
+
+import hashlib
+import json
+import os
+import signal
+import threading
+from typing import Dict, Optional, Tuple
+
+RULESET_FORMAT_VERSION = 1
+
+TEXT_PENALTIES = ('clickbait_per_keyword', 'extreme_min_keywords', 'extreme',
+                  'emotional_per_keyword', 'medical_without_evidence', 'contradiction')
+TEXT_FAMILIES = ('clickbait', 'extreme', 'emotional', 'medical', 'evidence', 'positive', 'negative')
+IMAGE_THRESHOLDS = ('base_score', 'blur_laplacian_var_below', 'blur_penalty', 'blur_manipulation_prob',
+                    'edge_density_min', 'edge_density_max', 'saturation_std_below',
+                    'manipulation_indicator_penalty', 'manipulation_indicator_prob',
+                    'metadata_penalty', 'metadata_manipulation_prob',
+                    'reverse_match_bonus', 'reverse_match_max_distance')
+
+class RulesetError(ValueError):
+    """The ruleset file is missing, malformed or incomplete"""
+
+class Ruleset:
+    """
+    A compiled, immutable set of scoring rules
+
+    Attributes:
+        version: Version declared by the rules file (reported in responses)
+        fingerprint: Version plus a digest of the rules (used in cache keys)
+        text_base_score, penalties: Text scoring parameters
+        keyword_matcher: KeywordMatcher over every keyword family
+        contradiction_detector: ContradictionDetector over the configured pairs
+        image: Image thresholds and penalties by name
+    """
+
+    def __init__(self, data: Dict):
+        from models.text_model import ContradictionDetector, KeywordMatcher
+
+        if not isinstance(data, dict) or data.get('format') != RULESET_FORMAT_VERSION:
+            raise RulesetError(f'Expected a ruleset object with "format": {RULESET_FORMAT_VERSION}')
+        version = data.get('version')
+        if not isinstance(version, str) or not version:
+            raise RulesetError('"version" must be a non-empty string')
+
+        text = _section(data, 'text')
+        families = _section(text, 'keyword_families')
+        missing = [family for family in TEXT_FAMILIES if family not in families]
+        if missing:
+            raise RulesetError(f'Missing keyword families: {", ".join(missing)}')
+        for family, keywords in families.items():
+            if not isinstance(keywords, list) or not all(isinstance(k, str) and k for k in keywords):
+                raise RulesetError(f'Keyword family "{family}" must be a list of non-empty strings')
+
+        pairs = text.get('contradiction_pairs', [])
+        if not isinstance(pairs, list) or not all(
+            isinstance(pair, list) and len(pair) == 3 and all(isinstance(p, str) and p for p in pair)
+            for pair in pairs
+        ):
+            raise RulesetError('"contradiction_pairs" must be a list of [first, second, description]')
+
+        self.version = version
+        self.fingerprint = f'{version}+{_digest(data)}'
+        self.text_base_score = _number(text, 'base_score')
+        self.penalties = {name: _number(_section(text, 'penalties'), name) for name in TEXT_PENALTIES}
+        self.keyword_matcher = KeywordMatcher(families)
+        self.contradiction_detector = ContradictionDetector(
+            [(first, second, description) for first, second, description in pairs])
+        image = _section(data, 'image')
+        self.image = {name: _number(image, name) for name in IMAGE_THRESHOLDS}
+
+    def __repr__(self):
+        return f'<Ruleset {self.fingerprint}>'
+
+def _section(data: Dict, name: str) -> Dict:
+    section = data.get(name)
+    if not isinstance(section, dict):
+        raise RulesetError(f'"{name}" must be an object')
+    return section
+
+def _number(data: Dict, name: str):
+    value = data.get(name)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise RulesetError(f'"{name}" must be a number')
+    return value
+
+def _digest(data: Dict) -> str:
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:12]
+
+def default_rules_path() -> str:
+    return os.environ.get(
+        'ML_RULES_PATH',
+        os.path.join(os.path.dirname(__file__), '..', 'rules', 'ruleset.json'),
+    )
+
+def load_ruleset(path: Optional[str] = None) -> Ruleset:
+    """
+    Read and compile a ruleset file
+
+    Raises:
+        RulesetError: the file cannot be read or fails validation
+    """
+    path = path or default_rules_path()
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise RulesetError(f'Cannot read ruleset {path}: {e}')
+    return Ruleset(data)
+
+_active: Optional[Ruleset] = None
+_reload_lock = threading.Lock()
+
+def get_ruleset() -> Ruleset:
+    """Get the active ruleset, loading the configured file on first use"""
+    ruleset = _active
+    if ruleset is None:
+        with _reload_lock:
+            if _active is None:
+                _swap(load_ruleset())
+            ruleset = _active
+    return ruleset
+
+def _swap(ruleset: Ruleset):
+    global _active
+    _active = ruleset
+
+def reload_ruleset(path: Optional[str] = None) -> Tuple[Optional[Ruleset], Ruleset]:
+    """
+    Compile the ruleset file and make it the active ruleset
+
+    The new rules are compiled before the swap, so a bad file leaves the
+    current ruleset untouched.
+
+    Returns:
+        (previous ruleset or None, new ruleset)
+
+    Raises:
+        RulesetError: the file cannot be read or fails validation
+    """
+    with _reload_lock:
+        ruleset = load_ruleset(path)
+        previous = _active
+        _swap(ruleset)
+    return previous, ruleset
+
+def _reload_in_background(signum, frame):
+    # Compile off the signal handler so it never waits on the reload lock
+    def reload():
+        try:
+            previous, ruleset = reload_ruleset()
+            print(f'Ruleset reloaded: {previous.version if previous else None} -> {ruleset.version}')
+        except RulesetError as e:
+            print(f'Warning: ruleset reload failed, keeping current rules: {e}')
+
+    threading.Thread(target=reload, name='ml-rules-reload', daemon=True).start()
+
+def install_reload_signal() -> bool:
+    """
+    Reload the ruleset on SIGHUP
+
+    Returns:
+        False when signals cannot be installed (not the main thread, or no SIGHUP)
+    """
+    if not hasattr(signal, 'SIGHUP'):
+        return False
+    try:
+        signal.signal(signal.SIGHUP, _reload_in_background)
+    except ValueError:
+        return False
+    return True
+
+def ruleset_summary(ruleset: Ruleset) -> Dict:
+    """Version details reported by the rules endpoints"""
+    return {
+        'ruleset_version': ruleset.version,
+        'fingerprint': ruleset.fingerprint,
+        'keyword_families': len(ruleset.keyword_matcher.families),
+        'contradiction_pairs': len(ruleset.contradiction_detector.pairs),
+    }
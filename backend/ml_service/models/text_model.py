@@ -12,14 +12,137 @@ TODO: Replace with real ML model:
 """
 
 import re
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
-def analyze_text_content(text: str) -> Dict:
+from models.ruleset import Ruleset, get_ruleset
+
+# Keyword families, penalties and contradiction pairs are data: they are
+# read from the versioned ruleset file and compiled into the matchers below
+# (see models/ruleset.py and rules/ruleset.json).
+
+class KeywordMatcher:
+    """
+    Precompiled keyword matcher shared by every rule family
+    
+    The vocabulary of all families is merged and deduplicated once, so a
+    keyword that belongs to several families (e.g. 'cure') is searched for a
+    single time and credited to each of them. Each distinct keyword is one
+    C-level substring search that stops at its first occurrence; the
+    micro.keyword_matcher benchmarks time this against a single-pass
+    combined regex over the same vocabulary.
+    """
+    
+    def __init__(self, families: Dict[str, List[str]]):
+        self.families = tuple(families)
+        index: Dict[str, List[str]] = {}
+        for family, keywords in families.items():
+            for keyword in keywords:
+                index.setdefault(keyword.lower(), []).append(family)
+        self._vocabulary: Tuple[Tuple[str, Tuple[str, ...]], ...] = tuple(
+            (keyword, tuple(members)) for keyword, members in index.items()
+        )
+    
+    @property
+    def vocabulary(self) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+        """Distinct lowercased keywords, each with the families it belongs to"""
+        return self._vocabulary
+    
+    def count(self, text_lower: str) -> Dict[str, int]:
+        """
+        Count distinct keywords present in text, per family
+        
+        Args:
+            text_lower: Lowercased text to scan
+            
+        Returns:
+            Dictionary mapping family name to number of matched keywords
+        """
+        counts = dict.fromkeys(self.families, 0)
+        for keyword, members in self._vocabulary:
+            if keyword in text_lower:
+                for family in members:
+                    counts[family] += 1
+        return counts
+
+class ContradictionDetector:
+    """
+    Linear-time detector for ordered anchor-word pairs
+    
+    Pairs are flagged as contradictory when the first anchor is followed by
+    the second on the same line (the semantics of `first.*second` regexes,
+    which do not cross newlines).
+    
+    One scan over the text records, per line, where each anchor first ends
+    and last starts. A pair (first, second) holds on a line when the first
+    occurrence of `first` ends at or before the last occurrence of `second`,
+    which is exactly when `re.search('first.*second', line)` would match,
+    without the backtracking cost of `.*` on long inputs.
+    """
+    
+    def __init__(self, pairs: List[Tuple[str, str, str]]):
+        self.pairs = [(first.lower(), second.lower(), description)
+                      for first, second, description in pairs]
+        anchors = sorted({word for pair in self.pairs for word in pair[:2]},
+                         key=len, reverse=True)
+        # An anchor matching at a position implies every anchor that is a
+        # prefix of it matches there too; the lookahead reports the longest.
+        self._implied = {
+            anchor: tuple(other for other in anchors if anchor.startswith(other))
+            for anchor in anchors
+        }
+        alternation = '|'.join(re.escape(anchor) for anchor in anchors)
+        self._pattern = re.compile(f'(?=({alternation}|\n))') if anchors else None
+    
+    def detect(self, text_lower: str) -> List[str]:
+        """
+        Find contradictory anchor pairs in text
+        
+        Args:
+            text_lower: Lowercased text to scan
+            
+        Returns:
+            Descriptions of matched pairs, in configured order
+        """
+        if self._pattern is None:
+            return []
+        
+        matched = [False] * len(self.pairs)
+        first_end: Dict[str, int] = {}
+        last_start: Dict[str, int] = {}
+        
+        def close_line():
+            for i, (first, second, _) in enumerate(self.pairs):
+                if not matched[i] and first in first_end and second in last_start:
+                    matched[i] = first_end[first] <= last_start[second]
+            first_end.clear()
+            last_start.clear()
+        
+        for match in self._pattern.finditer(text_lower):
+            token = match.group(1)
+            if token == '\n':
+                if first_end:
+                    close_line()
+                    if all(matched):
+                        break
+                continue
+            start = match.start()
+            for anchor in self._implied[token]:
+                if anchor not in first_end:
+                    first_end[anchor] = start + len(anchor)
+                last_start[anchor] = start
+        else:
+            close_line()
+        
+        return [description for (_, _, description), hit
+                in zip(self.pairs, matched) if hit]
+
+def analyze_text_content(text: str, ruleset: Optional[Ruleset] = None) -> Dict:
     """
     Analyze text content for misinformation indicators
     
     Args:
         text: Text content to analyze
+        ruleset: Rules to score with (default: the active ruleset)
         
     Returns:
         Dictionary with analysis results:
@@ -29,55 +152,55 @@ def analyze_text_content(text: str) -> Dict:
             "claims": List[str],
             "contradictions": List[str],
             "summary": str,
-            "reasons": List[str]
+            "reasons": List[str],
+            "ruleset_version": str
         }
     """
     # Rule-based heuristics (stub implementation)
     # TODO: Replace with real ML model
     
-    score = 50  # Base score
+    # Pinned for the whole call, so a concurrent reload cannot mix rule versions
+    ruleset = ruleset or get_ruleset()
+    penalties = ruleset.penalties
+    
+    score = ruleset.text_base_score  # Base score
     reasons = []
     claims = []
     contradictions = []
     
     text_lower = text.lower()
     
+    # Count every keyword family in one scan of the shared matcher
+    counts = ruleset.keyword_matcher.count(text_lower)
+    
     # Check for clickbait indicators
-    clickbait_keywords = ['miracle', 'cure', 'shocking', 'you won\'t believe', 'doctors hate', 'secret']
-    clickbait_count = sum(1 for keyword in clickbait_keywords if keyword in text_lower)
+    clickbait_count = counts['clickbait']
     if clickbait_count > 0:
-        score -= clickbait_count * 10
+        score -= clickbait_count * penalties['clickbait_per_keyword']
         reasons.append(f'Detected {clickbait_count} clickbait indicator(s)')
         claims.append('Contains clickbait language')
     
     # Check for extreme claims
-    extreme_keywords = ['never', 'always', 'all', 'everyone', 'nobody', 'impossible']
-    extreme_count = sum(1 for keyword in extreme_keywords if keyword in text_lower)
-    if extreme_count > 2:
-        score -= 15
+    if counts['extreme'] >= penalties['extreme_min_keywords']:
+        score -= penalties['extreme']
         reasons.append('Contains extreme/absolute claims')
         claims.append('Uses absolute language')
     
     # Check for emotional manipulation
-    emotional_keywords = ['urgent', 'act now', 'limited time', 'exclusive', 'breaking']
-    emotional_count = sum(1 for keyword in emotional_keywords if keyword in text_lower)
+    emotional_count = counts['emotional']
     if emotional_count > 0:
-        score -= emotional_count * 5
+        score -= emotional_count * penalties['emotional_per_keyword']
         reasons.append('Contains emotional manipulation language')
     
     # Check for medical claims without evidence
-    medical_keywords = ['cure', 'treat', 'heal', 'prevent', 'guaranteed']
-    medical_count = sum(1 for keyword in medical_keywords if keyword in text_lower)
-    if medical_count > 0 and 'study' not in text_lower and 'research' not in text_lower:
-        score -= 20
+    if counts['medical'] > 0 and counts['evidence'] == 0:
+        score -= penalties['medical_without_evidence']
         reasons.append('Medical claims without cited research')
         claims.append('Unsubstantiated medical claims')
     
     # Check sentiment (simple rule-based)
-    positive_words = ['good', 'great', 'excellent', 'amazing', 'wonderful']
-    negative_words = ['bad', 'terrible', 'awful', 'horrible', 'worst']
-    positive_count = sum(1 for word in positive_words if word in text_lower)
-    negative_count = sum(1 for word in negative_words if word in text_lower)
+    positive_count = counts['positive']
+    negative_count = counts['negative']
     
     if positive_count > negative_count:
         sentiment = 'positive'
@@ -86,16 +209,10 @@ def analyze_text_content(text: str) -> Dict:
     else:
         sentiment = 'neutral'
     
-    # Check for contradictions (simple pattern matching)
-    contradiction_patterns = [
-        (r'never.*always', 'Contradictory statements'),
-        (r'all.*none', 'Contradictory statements'),
-    ]
-    
-    for pattern, description in contradiction_patterns:
-        if re.search(pattern, text_lower):
-            contradictions.append(description)
-            score -= 10
+    # Check for contradictions (ordered anchor pairs, single scan)
+    for description in ruleset.contradiction_detector.detect(text_lower):
+        contradictions.append(description)
+        score -= penalties['contradiction']
     
     # Clamp score between 0 and 100
     score = max(0, min(100, score))
@@ -122,5 +239,6 @@ def analyze_text_content(text: str) -> Dict:
         'contradictions': contradictions,
         'summary': summary,
         'reasons': reasons[:5],  # Top 5 reasons
+        'ruleset_version': ruleset.version,
     }
 
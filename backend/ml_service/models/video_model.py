@@ -0,0 +1,80 @@
+"""
+Video Analysis Model
+Combines per-keyframe image analyses into one result for a clip
+
+Keyframes come from utils/frame_io.py (adaptively sampled, near-duplicates
+removed) and are each scored by analyze_image_content. A single manipulated
+frame is enough to make a clip suspicious, so the clip reports the highest
+manipulation probability of its frames next to their mean visual score,
+and keeps the per-frame scores for inspection.
+
+TODO: Replace with a temporal model (e.g. frame-consistency or deepfake
+video detection) once one is available.
+"""
+
+from collections import Counter
+from typing import Dict, List
+
+MAX_REASONS = 5
+MAX_MATCH_SOURCES = 5
+
+def aggregate_frame_results(frames: List[Dict], frame_stats: Dict, ruleset_version: str) -> Dict:
+    """
+    Aggregate keyframe analyses into a clip-level result
+
+    Args:
+        frames: Per keyframe, in order, an analyze_image_content result with
+            added "index", "timestamp" and "ocr_mode"
+        frame_stats: Decoding and sampling counters (see FrameSampler.stats)
+        ruleset_version: Version of the rules the frames were scored with
+
+    Returns:
+        {
+            "visual_analysis_score": int (0-100, mean over keyframes),
+            "manipulation_prob": float (0-1, highest keyframe),
+            "match_sources": List[Dict] (best match per source),
+            "ocr_text": str (distinct keyframe texts, in order),
+            "reasons": List[str] (most frequent first, with frame counts),
+            "frames": [{"index", "timestamp", "visual_analysis_score",
+                        "manipulation_prob", "ocr_mode"}],
+            "frame_stats": {...},
+            "ruleset_version": str
+        }
+    """
+    if not frames:
+        raise ValueError('No frames could be decoded')
+
+    sources = {}
+    for frame in frames:
+        for match in frame.get('match_sources', []):
+            best = sources.get(match['source'])
+            if best is None or match['match_confidence'] > best['match_confidence']:
+                sources[match['source']] = match
+    match_sources = sorted(sources.values(), key=lambda match: -match['match_confidence'])
+
+    texts = []
+    for frame in frames:
+        text = (frame.get('ocr_text') or '').strip()
+        if text and text not in texts:
+            texts.append(text)
+
+    reason_counts = Counter(reason for frame in frames for reason in frame.get('reasons', []))
+    reasons = [reason if len(frames) == 1 else f'{reason} ({count} of {len(frames)} frames)'
+               for reason, count in reason_counts.most_common(MAX_REASONS)]
+
+    return {
+        'visual_analysis_score': round(sum(frame['visual_analysis_score'] for frame in frames) / len(frames)),
+        'manipulation_prob': max(frame['manipulation_prob'] for frame in frames),
+        'match_sources': match_sources[:MAX_MATCH_SOURCES],
+        'ocr_text': '\n'.join(texts),
+        'reasons': reasons,
+        'frames': [{
+            'index': frame['index'],
+            'timestamp': frame['timestamp'],
+            'visual_analysis_score': frame['visual_analysis_score'],
+            'manipulation_prob': frame['manipulation_prob'],
+            'ocr_mode': frame.get('ocr_mode'),
+        } for frame in frames],
+        'frame_stats': dict(frame_stats),
+        'ruleset_version': ruleset_version,
+    }
@@ -3,16 +3,56 @@ Analysis Routes for ML Service
 Handles text, image, and multi-modal analysis requests
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from typing import Optional
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import tempfile
 
-from models.text_model import analyze_text_content
-from models.image_model import analyze_image_content
-from utils.ocr_stub import extract_text_from_image
+from models.ruleset import RulesetError, get_ruleset, reload_ruleset, ruleset_summary
+from services import analysis, jobs, streaming
+from utils.metrics import track_stage
+from utils.image_fetch import ImageFetchError
+from utils.image_io import ImagePolicyError
+from utils.job_store import JobQueueFullError
+from utils.ocr_pool import OCRPoolError
+from utils.result_cache import get_result_cache
+from utils.single_flight import CoalescingTimeoutError
 
 analyze_bp = Blueprint('analyze', __name__)
 
+# Maximum number of texts accepted by /analyze/text/batch
+TEXT_BATCH_MAX_SIZE = int(os.environ.get('ML_TEXT_BATCH_MAX_SIZE', '1000'))
+
+# Maximum number of images accepted by /analyze/image/batch
+IMAGE_BATCH_MAX_SIZE = int(os.environ.get('ML_IMAGE_BATCH_MAX_SIZE', '32'))
+
+# Largest request body (one uploaded image, or any JSON request)
+UPLOAD_MAX_BYTES = int(os.environ.get('ML_UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Largest whole request accepted by /analyze/image/batch
+IMAGE_BATCH_MAX_BYTES = int(os.environ.get('ML_IMAGE_BATCH_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Largest uploaded video or animation accepted by /analyze/video
+VIDEO_MAX_BYTES = int(os.environ.get('ML_VIDEO_MAX_BYTES', str(100 * 1024 * 1024)))
+
+def request_byte_limit(path: str) -> Optional[int]:
+    """Largest accepted request body for a path, or None for no limit"""
+    if path == '/ml/analyze/stream':
+        # Bulk NDJSON is read line by line, each line capped by ML_STREAM_MAX_LINE_BYTES
+        return None
+    if path == '/ml/analyze/image/batch':
+        return IMAGE_BATCH_MAX_BYTES
+    if path == '/ml/analyze/video':
+        return VIDEO_MAX_BYTES
+    return UPLOAD_MAX_BYTES
+
+def upload_too_large_response():
+    return jsonify({
+        'error': 'Upload too large',
+        'message': f'Request body exceeds {request_byte_limit(request.path)} bytes'
+    }), 413
+
 @analyze_bp.route('/analyze/text', methods=['POST'])
 def analyze_text():
     """
@@ -30,7 +70,8 @@ def analyze_text():
             "claims": [...],
             "contradictions": [...],
             "summary": "...",
-            "reasons": [...]
+            "reasons": [...],
+            "fact_check_matches": [{"id": ..., "claim": ..., "rating": ..., "url": ..., "score": 0.61}]
         }
     """
     try:
@@ -50,11 +91,67 @@ def analyze_text():
                 'message': 'Text must be a non-empty string'
             }), 400
         
-        # Perform analysis
-        result = analyze_text_content(text)
+        # Perform analysis (repeated content is served from the cache)
+        result = analysis.analyze_text(text)
         
         return jsonify(result), 200
         
+    except CoalescingTimeoutError as e:
+        # An identical request is still being analysed
+        return jsonify({
+            'error': 'Analysis timed out',
+            'message': str(e)
+        }), e.status_code
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+@analyze_bp.route('/analyze/text/batch', methods=['POST'])
+def analyze_text_batch():
+    """
+    Analyze a batch of texts in one request
+    
+    Request body:
+        {
+            "texts": ["first text", "second text", ...]
+        }
+    
+    Returns:
+        {
+            "results": [{...analysis...}, {"error": "...", "message": "..."}, ...],
+            "count": 2,
+            "errors": 1
+        }
+    
+    Results are returned in input order. Invalid items produce a per-item
+    error entry instead of failing the whole batch.
+    """
+    try:
+        data = request.get_json(silent=True)
+        
+        if not data or not isinstance(data.get('texts'), list):
+            return jsonify({
+                'error': 'Invalid input',
+                'message': 'texts must be an array of strings'
+            }), 400
+        
+        texts = data['texts']
+        
+        if len(texts) > TEXT_BATCH_MAX_SIZE:
+            return jsonify({
+                'error': 'Batch too large',
+                'message': f'At most {TEXT_BATCH_MAX_SIZE} texts are accepted per batch'
+            }), 413
+        
+        # Per-item errors are reported in place; order follows the input
+        return jsonify(analysis.analyze_text_batch(texts)), 200
+        
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -92,30 +189,153 @@ def analyze_image():
                 'message': 'No file selected'
             }), 400
         
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-            file.save(tmp_file.name)
-            image_path = tmp_file.name
-        
-        try:
-            # Extract OCR text
-            ocr_text = extract_text_from_image(image_path)
-            
-            # Perform image analysis
-            result = analyze_image_content(image_path, ocr_text)
-            
-            return jsonify(result), 200
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(image_path):
-                os.unlink(image_path)
+        # Extract OCR text and analyze (repeated images are served from the cache)
+        with track_stage('upload_read'):
+            image_bytes = file.read()
+        result = analysis.analyze_image_bytes(image_bytes)
+        
+        return jsonify(result), 200
+        
+    except OCRPoolError as e:
+        # OCR workers saturated or timed out: ask the caller to back off
+        return jsonify({
+            'error': 'OCR unavailable',
+            'message': str(e)
+        }), e.status_code, {'Retry-After': '1'}
+    except CoalescingTimeoutError as e:
+        # An identical request is still being analysed
+        return jsonify({
+            'error': 'Analysis timed out',
+            'message': str(e)
+        }), e.status_code
+    except ImagePolicyError as e:
+        return jsonify({
+            'error': 'Image too large',
+            'message': str(e)
+        }), e.status_code
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+@analyze_bp.route('/analyze/image/batch', methods=['POST'])
+def analyze_image_batch():
+    """
+    Analyze several images in one request
+    
+    Request: multipart/form-data with one or more 'images' files
+    
+    Returns:
+        {
+            "results": [{...analysis...}, {"error": "...", "message": "..."}, ...],
+            "count": 3,
+            "errors": 1,
+            "near_duplicates": [{"first": 0, "second": 2, "distance": 1}]
+        }
+    
+    Results follow the order of the files. Files that cannot be analysed
+    produce a per-item error entry instead of failing the whole batch.
+    """
+    try:
+        files = request.files.getlist('images')
+        
+        if not files:
+            return jsonify({
+                'error': 'Invalid input',
+                'message': 'At least one image file is required'
+            }), 400
+        
+        if len(files) > IMAGE_BATCH_MAX_SIZE:
+            return jsonify({
+                'error': 'Batch too large',
+                'message': f'At most {IMAGE_BATCH_MAX_SIZE} images are accepted per batch'
+            }), 413
+        
+        with track_stage('upload_read'):
+            images = [file.read() for file in files]
         
+        # Images are analysed concurrently; order follows the request
+        return jsonify(analysis.analyze_image_batch(images)), 200
+        
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+@analyze_bp.route('/analyze/video', methods=['POST'])
+def analyze_video():
+    """
+    Analyze a short video or animated image (GIF, WebP, APNG)
+    
+    Request: multipart/form-data with 'video' file
+    
+    Returns:
+        {
+            "visual_analysis_score": 72,
+            "manipulation_prob": 0.2,
+            "match_sources": [...],
+            "ocr_text": "...",
+            "reasons": [...],
+            "frames": [{"index": 0, "timestamp": 0.0, "visual_analysis_score": 75, ...}],
+            "frame_stats": {"frames_decoded": 300, "keyframes": 4, ...}
+        }
+    
+    Only distinct keyframes are analysed; see utils/frame_io.py.
+    """
+    path = None
+    try:
+        if 'video' not in request.files or not request.files['video'].filename:
+            return jsonify({
+                'error': 'Invalid input',
+                'message': 'Video file is required'
+            }), 400
+        
+        # The decoder needs a file; the upload is copied there in chunks
+        file = request.files['video']
+        fd, path = tempfile.mkstemp(prefix='ml-video-', suffix=os.path.splitext(file.filename)[1])
+        with track_stage('upload_read'):
+            with os.fdopen(fd, 'wb') as f:
+                file.save(f)
+        
+        return jsonify(analysis.analyze_video_file(path)), 200
+        
+    except OCRPoolError as e:
+        return jsonify({
+            'error': 'OCR unavailable',
+            'message': str(e)
+        }), e.status_code, {'Retry-After': '1'}
+    except ImagePolicyError as e:
+        return jsonify({
+            'error': 'Image too large',
+            'message': str(e)
+        }), e.status_code
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid input',
+            'message': str(e)
+        }), 400
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
+    except CoalescingTimeoutError as e:
+        # An identical upload is still being analysed
+        return jsonify({
+            'error': 'Analysis timed out',
+            'message': str(e)
+        }), e.status_code
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
             'message': str(e)
         }), 500
+    finally:
+        if path is not None:
+            os.unlink(path)
 
 @analyze_bp.route('/analyze/multi', methods=['POST'])
 def analyze_multi():
@@ -139,76 +359,253 @@ def analyze_multi():
         image_path = data.get('image_path')
         url_meta = data.get('url_meta', {})
         
-        results = {
-            'text_analysis_score': None,
-            'visual_analysis_score': None,
-            'sentiment': 'unknown',
-            'claims': [],
-            'contradictions': [],
-            'summary': '',
-            'reasons': [],
-            'manipulation_prob': None,
-            'match_sources': [],
-            'ocr_text': None,
+        # Remote images are downloaded through the pooled, cached fetcher
+        image_bytes = analysis.read_image_source(image_path) if image_path else None
+        
+        # Text, OCR and image branches run concurrently with per-branch timeouts
+        results = analysis.analyze_multi(text, image_bytes)
+        
+        return jsonify(results), 200
+        
+    except ImagePolicyError as e:
+        return jsonify({
+            'error': 'Image too large',
+            'message': str(e)
+        }), e.status_code
+    except ImageFetchError as e:
+        return jsonify({
+            'error': 'Image fetch failed',
+            'message': str(e)
+        }), e.status_code
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+@analyze_bp.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """
+    Score newline-delimited JSON records as they stream in
+    
+    Request body (application/x-ndjson), one record per line:
+        {"id": "post-1", "text": "..."}
+        {"id": "post-2", "image": "<base64>"}
+        {"id": "post-3", "text": "...", "image_path": "..."}
+    
+    Returns (application/x-ndjson), one line per input record in order:
+        {"id": "post-1", "result": {...analysis...}}
+        {"id": "post-2", "error": "...", "message": "..."}
+    
+    Neither the request nor the response is buffered; invalid or failing
+    records produce an error line instead of ending the stream.
+    """
+    lines = streaming.iter_lines(request.stream.readline)
+    return Response(
+        stream_with_context(streaming.analyze_stream(lines)),
+        content_type=streaming.CONTENT_TYPE,
+    )
+
+def _job_response(job, created):
+    """202 while a job is pending, 200 once a deduplicated job has finished"""
+    job = dict(job, deduplicated=not created)
+    status = 202 if job['status'] in ('queued', 'running') else 200
+    return jsonify(job), status, {'Location': f"/ml/jobs/{job['job_id']}"}
+
+@analyze_bp.route('/jobs/image', methods=['POST'])
+def submit_image_job():
+    """
+    Queue image analysis and return at once
+    
+    Request: multipart/form-data with 'image' file, optional 'priority'
+    (0-9, higher runs first) and 'callback_url'
+    
+    Returns (202, Location: /ml/jobs/<job_id>):
+        {
+            "job_id": "...",
+            "kind": "image",
+            "status": "queued",
+            "priority": 0,
+            "deduplicated": false,
+            ...
         }
+    
+    Submitting an image whose job is pending or finished returns that job.
+    """
+    try:
+        if 'image' not in request.files or not request.files['image'].filename:
+            return jsonify({
+                'error': 'Invalid input',
+                'message': 'Image file is required'
+            }), 400
         
-        # Analyze text if provided
-        if text and len(text.strip()) > 0:
-            text_result = analyze_text_content(text)
-            results['text_analysis_score'] = text_result.get('text_analysis_score')
-            results['sentiment'] = text_result.get('sentiment', 'unknown')
-            results['claims'] = text_result.get('claims', [])
-            results['contradictions'] = text_result.get('contradictions', [])
-            results['summary'] = text_result.get('summary', '')
-            results['reasons'].extend(text_result.get('reasons', []))
-        
-        # Analyze image if provided
-        if image_path:
-            # For URL-based images, download first (simplified)
-            # TODO: Implement proper image download from URL
-            ocr_text = None
-            if os.path.exists(image_path):
-                ocr_text = extract_text_from_image(image_path)
-                image_result = analyze_image_content(image_path, ocr_text)
-                results['visual_analysis_score'] = image_result.get('visual_analysis_score')
-                results['manipulation_prob'] = image_result.get('manipulation_prob')
-                results['match_sources'] = image_result.get('match_sources', [])
-                results['ocr_text'] = ocr_text
-                results['reasons'].extend(image_result.get('reasons', []))
-        
-        # Calculate combined credibility score
-        credibility_score = calculate_credibility_score(results)
-        results['credibility_score'] = credibility_score
-        
-        # Build explainability object
-        results['explainability'] = {
-            'top_reasons': results['reasons'][:3],
-            'text_contribution': results['text_analysis_score'] if results['text_analysis_score'] else 0,
-            'visual_contribution': results['visual_analysis_score'] if results['visual_analysis_score'] else 0,
+        priority, callback_url = jobs.parse_job_options(
+            request.form.get('priority'), request.form.get('callback_url'))
+        
+        with track_stage('upload_read'):
+            image_bytes = request.files['image'].read()
+        return _job_response(*jobs.submit_image_job(image_bytes, priority, callback_url))
+        
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid input',
+            'message': str(e)
+        }), 400
+    except JobQueueFullError as e:
+        return jsonify({
+            'error': 'Queue full',
+            'message': str(e)
+        }), e.status_code, {'Retry-After': '5'}
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+@analyze_bp.route('/jobs/multi', methods=['POST'])
+def submit_multi_job():
+    """
+    Queue multi-modal analysis and return at once
+    
+    Request body:
+        {
+            "text": "optional text",
+            "image_path": "optional image path or URL",
+            "priority": 0,
+            "callback_url": "optional http(s) URL"
         }
+    
+    Returns:
+        Job as for /jobs/image; the image is fetched by the job worker
+    """
+    try:
+        data = request.get_json(silent=True) or {}
         
-        return jsonify(results), 200
+        text = data.get('text') or ''
+        image_path = data.get('image_path') or None
+        if not isinstance(text, str) or (not text.strip() and not image_path):
+            return jsonify({
+                'error': 'Invalid input',
+                'message': 'Text or image_path is required'
+            }), 400
+        
+        priority, callback_url = jobs.parse_job_options(data.get('priority'), data.get('callback_url'))
+        return _job_response(*jobs.submit_multi_job(text, image_path, priority, callback_url))
         
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid input',
+            'message': str(e)
+        }), 400
+    except JobQueueFullError as e:
+        return jsonify({
+            'error': 'Queue full',
+            'message': str(e)
+        }), e.status_code, {'Retry-After': '5'}
+    except RequestEntityTooLarge:
+        return upload_too_large_response()
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
             'message': str(e)
         }), 500
 
-def calculate_credibility_score(results):
+@analyze_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Status of a submitted job
+    
+    Returns:
+        {
+            "job_id": "...",
+            "status": "queued" | "running" | "done" | "failed",
+            "result": {...analysis...},      # when done
+            "error": "...",                  # when failed
+            "expires_at": 1700000000.0,      # when finished
+            ...
+        }
+        or 404 once the job is unknown or its result has expired
     """
-    Calculate credibility score from multi-modal results
-    Uses weighted formula: 0.6 * text_score + 0.4 * visual_score
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({
+            'error': 'Not found',
+            'message': f'No job {job_id} (unknown or expired)'
+        }), 404
+    return jsonify(job), 200
+
+@analyze_bp.route('/cache/stats', methods=['GET'])
+def cache_stats():
     """
-    text_score = results.get('text_analysis_score')
-    visual_score = results.get('visual_analysis_score')
+    Result cache statistics
     
-    if text_score is not None and visual_score is not None:
-        return round(0.6 * text_score + 0.4 * visual_score)
-    elif text_score is not None:
-        return text_score
-    elif visual_score is not None:
-        return visual_score
-    else:
-        return 50  # Default neutral score
+    Returns:
+        {
+            "enabled": true,
+            "backend": "memory",
+            "hits": 120,
+            "misses": 30,
+            "hit_rate": 0.8,
+            "entries": 30,
+            ...
+        }
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify(cache.stats()), 200
+
+@analyze_bp.route('/rules', methods=['GET'])
+def rules():
+    """
+    Active scoring ruleset
+    
+    Returns:
+        {
+            "ruleset_version": "1.2.0",
+            "fingerprint": "1.2.0+3f1c...",
+            "keyword_families": 7,
+            "contradiction_pairs": 2
+        }
+    """
+    try:
+        return jsonify(ruleset_summary(get_ruleset())), 200
+    except RulesetError as e:
+        return jsonify({
+            'error': 'Invalid ruleset',
+            'message': str(e)
+        }), 500
 
+@analyze_bp.route('/rules/reload', methods=['POST'])
+def reload_rules():
+    """
+    Recompile the ruleset file and swap it in atomically
+    
+    Requests already in flight finish with the rules they started with.
+    An invalid file is rejected and the current rules stay active.
+    
+    Returns:
+        {
+            "previous_version": "1.1.0",
+            "ruleset_version": "1.2.0",
+            "fingerprint": "1.2.0+3f1c...",
+            "changed": true,
+            ...
+        }
+    """
+    try:
+        previous, ruleset = reload_ruleset()
+    except RulesetError as e:
+        return jsonify({
+            'error': 'Invalid ruleset',
+            'message': str(e)
+        }), 422
+    
+    result = ruleset_summary(ruleset)
+    result['previous_version'] = previous.version if previous else None
+    result['changed'] = previous is None or previous.fingerprint != ruleset.fingerprint
+    return jsonify(result), 200
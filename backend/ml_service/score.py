@@ -0,0 +1,282 @@
+"""
+Offline Batch Scorer
+Scores text and image corpora on disk with every core, without the web tier
+
+Usage:
+    python score.py --texts posts.jsonl --output scores.jsonl
+    python score.py --images /data/images --output scores.jsonl
+    python score.py --texts posts.jsonl --images /data/images --output scores.jsonl --workers 16
+
+Text input is JSONL, one {"id": ..., "text": "..."} object per line (the
+line number is used when "id" is missing). Images are read from the
+directory tree in a stable order and identified by their relative path.
+Each item produces one output line:
+
+    {"id": ..., "kind": "text", "result": {...analysis...}}
+    {"id": ..., "kind": "image", "error": "...", "message": "..."}
+
+Work is fanned out in batches over a process pool that calls the models
+directly. Results are appended in input order, and after every batch
+`<output>.checkpoint` records how far the run got. Running the same
+command again after an interruption truncates any partial output and
+resumes from the checkpoint; --restart starts over.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff')
+CHECKPOINT_FORMAT_VERSION = 1
+
+def _init_worker():
+    """Keep each worker single-threaded; the pool already uses every core"""
+    import cv2
+
+    cv2.setNumThreads(1)
+    # OCR runs in the worker itself rather than on a nested process pool
+    os.environ['ML_OCR_WORKERS'] = '0'
+
+def score_batch(kind: str, items: List[Tuple]) -> List[Dict]:
+    """
+    Score a batch of items inside a worker process
+
+    Args:
+        kind: 'text' or 'image'
+        items: (id, text) pairs for text, (id, path) pairs for images
+
+    Returns:
+        One output record per item, in order
+    """
+    from models.image_model import analyze_image_content
+    from models.text_model import analyze_text_content
+    from utils.claim_index import match_claims
+    from utils.image_io import DecodedImage
+    from utils.ocr_stub import extract_text_with_gate
+
+    records = []
+    scored = []
+    for item_id, value in items:
+        try:
+            if kind == 'text':
+                if not isinstance(value, str) or len(value.strip()) == 0:
+                    records.append({'id': item_id, 'kind': kind, 'error': 'Invalid input',
+                                    'message': 'Text must be a non-empty string'})
+                    continue
+                result = analyze_text_content(value)
+                scored.append((result, value))
+            else:
+                image = DecodedImage.from_path(value)
+                if image is None:
+                    records.append({'id': item_id, 'kind': kind, 'error': 'Invalid input',
+                                    'message': 'Image could not be decoded'})
+                    continue
+                ocr_text, ocr_mode = extract_text_with_gate(image)
+                result = analyze_image_content(image, ocr_text)
+                result['ocr_mode'] = ocr_mode
+            records.append({'id': item_id, 'kind': kind, 'result': result})
+        except Exception as e:
+            records.append({'id': item_id, 'kind': kind, 'error': 'Analysis failed', 'message': str(e)})
+
+    # Claim matches for the whole batch in one sparse product
+    if scored:
+        for (result, _), matches in zip(scored, match_claims([text for _, text in scored])):
+            result['fact_check_matches'] = matches
+    return records
+
+def read_texts(path: str, offset: int = 0, line_number: int = 0) -> Iterator[Tuple[Tuple, Dict]]:
+    """
+    Read (id, text) items from a JSONL file, starting at a byte offset
+
+    Yields:
+        ((id, text), position) where position is where reading resumes after this item
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                item = (record.get('id', line_number), record.get('text'))
+            else:
+                # Scored as an invalid item so the output still accounts for the line
+                item = (line_number, None)
+            yield item, {'texts_offset': f.tell(), 'texts_line': line_number}
+
+def walk_images(root: str) -> Iterator[str]:
+    """Image paths under root, relative to it, in a stable sorted order"""
+    def walk(directory: str):
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path)
+            elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(entry.path, root)
+
+    yield from walk(root)
+
+def read_images(root: str, skip: int = 0) -> Iterator[Tuple[Tuple, Dict]]:
+    """Yields ((relative_path, absolute_path), position) after skipping `skip` images"""
+    for index, relative in enumerate(walk_images(root)):
+        if index < skip:
+            continue
+        yield (relative, os.path.join(root, relative)), {'images_done': index + 1}
+
+def batched(items: Iterator[Tuple[Tuple, Dict]], size: int) -> Iterator[Tuple[List[Tuple], Dict]]:
+    """Group (item, position) pairs into (items, position after the last item)"""
+    batch, position = [], None
+    for item, position in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch, position
+            batch = []
+    if batch:
+        yield batch, position
+
+def load_checkpoint(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_checkpoint(path: str, checkpoint: Dict):
+    """Atomically replace the checkpoint file"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def run(texts: Optional[str], images: Optional[str], output: str, workers: int,
+        batch_size: int, image_batch_size: int, restart: bool = False,
+        max_items: Optional[int] = None) -> Dict:
+    """
+    Score the inputs into `output`, resuming from its checkpoint if present
+
+    Returns:
+        The final checkpoint ({"scored", "complete", ...})
+    """
+    checkpoint_path = f'{output}.checkpoint'
+    inputs = {
+        'texts': os.path.abspath(texts) if texts else None,
+        'images': os.path.abspath(images) if images else None,
+    }
+
+    checkpoint = None if restart else load_checkpoint(checkpoint_path)
+    if checkpoint is not None and (checkpoint.get('format') != CHECKPOINT_FORMAT_VERSION
+                                   or checkpoint.get('inputs') != inputs):
+        raise SystemExit(f'{checkpoint_path} belongs to a different run; use --restart to start over')
+
+    if checkpoint is None:
+        checkpoint = {
+            'format': CHECKPOINT_FORMAT_VERSION,
+            'inputs': inputs,
+            'texts_offset': 0,
+            'texts_line': 0,
+            'images_done': 0,
+            'output_bytes': 0,
+            'scored': 0,
+            'complete': False,
+        }
+    if checkpoint['complete']:
+        return checkpoint
+
+    # --max-items caps this invocation; the rest is left for a resumed run
+    budget = {'left': max_items}
+
+    def limited(items):
+        for item in items:
+            if budget['left'] is not None:
+                if budget['left'] <= 0:
+                    return
+                budget['left'] -= 1
+            yield item
+
+    phases = []
+    if texts:
+        # Build the claim index once here rather than racing in every worker
+        from utils.claim_index import get_claim_index
+
+        get_claim_index().refresh_if_changed()
+        phases.append(('text', batched(limited(read_texts(texts, checkpoint['texts_offset'],
+                                                          checkpoint['texts_line'])), batch_size)))
+    if images:
+        phases.append(('image', batched(limited(read_images(images, checkpoint['images_done'])),
+                                        image_batch_size)))
+
+    mode = 'r+b' if os.path.exists(output) else 'wb'
+    with open(output, mode) as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        # Drop anything written after the last checkpoint
+        out.truncate(checkpoint['output_bytes'])
+        out.seek(checkpoint['output_bytes'])
+
+        def write(batch_records: List[Dict], position: Dict):
+            for record in batch_records:
+                out.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+            out.flush()
+            os.fsync(out.fileno())
+            checkpoint.update(position)
+            checkpoint['output_bytes'] = out.tell()
+            checkpoint['scored'] += len(batch_records)
+            save_checkpoint(checkpoint_path, checkpoint)
+
+        # A bounded number of batches in flight keeps memory flat on huge inputs
+        pending = deque()
+        for kind, batches in phases:
+            for items, position in batches:
+                pending.append((executor.submit(score_batch, kind, items), position))
+                if len(pending) >= 2 * workers:
+                    future, position = pending.popleft()
+                    write(future.result(), position)
+
+        while pending:
+            future, position = pending.popleft()
+            write(future.result(), position)
+
+        checkpoint['complete'] = budget['left'] is None or budget['left'] > 0
+
+    save_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Score text and image corpora offline')
+    parser.add_argument('--texts', help='JSONL file of {"id", "text"} records')
+    parser.add_argument('--images', help='directory of images (searched recursively)')
+    parser.add_argument('--output', required=True, help='JSONL results file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--batch-size', type=int, default=256, help='texts per task')
+    parser.add_argument('--image-batch-size', type=int, default=4, help='images per task')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+    parser.add_argument('--max-items', type=int, default=None, help='stop after this many items')
+    args = parser.parse_args(argv)
+
+    if not args.texts and not args.images:
+        parser.error('at least one of --texts or --images is required')
+
+    started = time.monotonic()
+    checkpoint = run(args.texts, args.images, args.output, max(1, args.workers),
+                     args.batch_size, args.image_batch_size, args.restart, args.max_items)
+    elapsed = time.monotonic() - started
+    status = 'complete' if checkpoint['complete'] else 'stopped (rerun to resume)'
+    print(f'{checkpoint["scored"]} item(s) scored into {args.output} in {elapsed:.1f}s, {status}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
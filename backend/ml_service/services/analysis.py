@@ -0,0 +1,551 @@
+"""
+Analysis Service
+Shared text and image analysis pipeline used by the HTTP routes
+
+Wraps the text and image models with the content-hash result cache
+(see utils/result_cache.py), so repeated content is answered from the
+cache instead of re-running OCR and the models. Identical content that
+arrives while its analysis is still running waits for that analysis instead
+of starting another (see utils/single_flight.py). Texts that miss the cache
+are looked up in the near-duplicate index (see utils/near_duplicate.py)
+so lightly reworded reposts reuse the earlier verdict. Text results also
+list the closest fact-checked claims from the claim index (see
+utils/claim_index.py).
+
+Multi-modal requests run their text, OCR and image branches concurrently
+on a bounded thread pool (OpenCV and Tesseract release the GIL). A branch
+that misses its timeout is dropped from the response, which is marked
+degraded, instead of holding up the other branches.
+
+Configuration (environment variables):
+- ML_BRANCH_WORKERS: threads shared by all multi-modal branches (default: 8)
+- ML_TEXT_TIMEOUT: seconds allowed for the text branch (default: 2)
+- ML_OCR_TIMEOUT: seconds allowed for the OCR branch (default: 5)
+- ML_IMAGE_TIMEOUT: seconds allowed for the image branch (default: 10)
+- ML_IMAGE_BATCH_WORKERS: threads analysing the images of batch requests (default: 4)
+- ML_IMAGE_BATCH_DUPLICATE_DISTANCE: maximum average-hash Hamming distance
+  for two images of a batch to be reported as near-duplicates (default: 5)
+- ML_VIDEO_WINDOW: keyframes of one video analysed at a time, on the image
+  batch threads, while decoding continues (default: 4)
+"""
+
+import contextvars
+import copy
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Tuple
+
+from models.ruleset import Ruleset, get_ruleset
+from models.text_model import analyze_text_content
+from models.image_model import analyze_image_content, MODEL_VERSION
+from models.video_model import aggregate_frame_results
+from utils.claim_index import match_claims
+from utils.frame_io import FrameSampler, iter_keyframes
+from utils.image_fetch import get_image_fetcher, is_url
+from utils.image_io import DecodedImage
+from utils.metrics import track_stage
+from utils.near_duplicate import get_near_duplicate_index
+from utils.ocr_pool import OCRPoolError
+from utils.ocr_stub import extract_text_with_gate
+from utils.result_cache import get_result_cache, text_cache_key, content_cache_key, file_cache_key
+from utils.single_flight import get_single_flight
+
+BRANCH_TIMEOUTS = {
+    'text': float(os.environ.get('ML_TEXT_TIMEOUT', '2')),
+    'ocr': float(os.environ.get('ML_OCR_TIMEOUT', '5')),
+    'image': float(os.environ.get('ML_IMAGE_TIMEOUT', '10')),
+}
+
+_branch_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ML_BRANCH_WORKERS', '8')),
+    thread_name_prefix='ml-branch',
+)
+
+_image_batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ML_IMAGE_BATCH_WORKERS', '4')),
+    thread_name_prefix='ml-image-batch',
+)
+
+IMAGE_BATCH_DUPLICATE_DISTANCE = int(os.environ.get('ML_IMAGE_BATCH_DUPLICATE_DISTANCE', '5'))
+
+VIDEO_WINDOW = max(1, int(os.environ.get('ML_VIDEO_WINDOW', '4')))
+
+def analyze_text(text: str, ruleset: Optional[Ruleset] = None) -> Dict:
+    """
+    Analyze text, answering repeated content from the result cache
+    
+    Args:
+        text: Text content to analyze
+        ruleset: Rules to score with (default: the active ruleset)
+        
+    Returns:
+        Text analysis result (see analyze_text_content) with
+        'fact_check_matches' from the claim index
+    """
+    result = _score_text(text, ruleset or get_ruleset())
+    # Matched on every call, so corpus updates apply to cached verdicts too
+    with track_stage('claims'):
+        result['fact_check_matches'] = match_claims([text])[0]
+    return result
+
+def _score_text(text: str, ruleset: Ruleset) -> Dict:
+    """Text model result, from the result cache when possible"""
+    cache = get_result_cache()
+    key = text_cache_key('text', ruleset.fingerprint, text)
+    if cache is not None:
+        result = cache.get(key)
+        if result is not None:
+            return result
+    return get_single_flight().do(key, _score_text_miss, text, ruleset, key, kind='text')
+
+def _score_text_miss(text: str, ruleset: Ruleset, key: str) -> Dict:
+    result = _analyze_text_uncached(text, ruleset)
+    cache = get_result_cache()
+    if cache is not None:
+        cache.set(key, result)
+    return result
+
+def _analyze_text_uncached(text: str, ruleset: Ruleset) -> Dict:
+    """
+    Score text, reusing the verdict of a near-duplicate seen earlier
+    
+    A reused verdict carries "near_duplicate": {"similarity": ...}.
+    """
+    index = get_near_duplicate_index()
+    signature = index.signature(text) if index is not None else None
+    if signature is None:
+        with track_stage('text'):
+            return analyze_text_content(text, ruleset)
+    
+    with track_stage('near_duplicate'):
+        match = index.query(signature, ruleset.fingerprint)
+    if match is not None:
+        result, similarity = match
+        result['near_duplicate'] = {'similarity': similarity}
+        return result
+    
+    with track_stage('text'):
+        result = analyze_text_content(text, ruleset)
+    index.add(signature, ruleset.fingerprint, result)
+    return result
+
+def analyze_text_batch(texts: List) -> Dict:
+    """
+    Analyze several texts, reporting invalid or failing items in place
+    
+    Args:
+        texts: Items to analyze; non-string or blank items become errors
+        
+    Returns:
+        {
+            "results": [{...analysis...} or {"error": ..., "message": ...}],
+            "count": int,
+            "errors": int
+        }
+    """
+    results = []
+    scored = []
+    errors = 0
+    ruleset = get_ruleset()
+    for text in texts:
+        if not isinstance(text, str) or len(text.strip()) == 0:
+            results.append({
+                'error': 'Invalid input',
+                'message': 'Text must be a non-empty string'
+            })
+            errors += 1
+            continue
+        
+        try:
+            results.append(_score_text(text, ruleset))
+            scored.append((results[-1], text))
+        except Exception as e:
+            results.append({
+                'error': 'Analysis failed',
+                'message': str(e)
+            })
+            errors += 1
+    
+    # One batched claim search for every scored item
+    if scored:
+        with track_stage('claims'):
+            matches = match_claims([text for _, text in scored])
+        for (result, _), result_matches in zip(scored, matches):
+            result['fact_check_matches'] = result_matches
+    
+    return {
+        'results': results,
+        'count': len(results),
+        'errors': errors,
+    }
+
+def image_cache_key(image_bytes: bytes, ruleset: Ruleset) -> str:
+    """Cache key of an image result under the model and ruleset versions"""
+    return content_cache_key('image', f'{MODEL_VERSION}:{ruleset.fingerprint}', image_bytes)
+
+def analyze_image_bytes(image_bytes: bytes) -> Dict:
+    """
+    Run OCR and image analysis on raw image bytes, with caching
+    
+    The image is decoded once in memory and the same decoded image feeds
+    OCR, blur/manipulation checks, metadata and reverse search.
+    
+    Args:
+        image_bytes: Encoded image content
+        
+    Returns:
+        Image analysis result including 'ocr_text' (see analyze_image_content)
+    """
+    ruleset = get_ruleset()
+    cache = get_result_cache()
+    key = image_cache_key(image_bytes, ruleset)
+    if cache is not None:
+        result = cache.get(key)
+        if result is not None:
+            return result
+    
+    def decode_and_analyze():
+        with track_stage('decode'):
+            image = DecodedImage.from_bytes(image_bytes)
+        return _analyze_image_uncached(image, key, ruleset)
+    
+    return get_single_flight().do(key, decode_and_analyze, kind='image')
+
+def _analyze_image_uncached(image: Optional[DecodedImage], key: str, ruleset: Ruleset) -> Dict:
+    """
+    Full image result (OCR included), stored in the result cache
+    
+    An image that could not be decoded gets the 'Failed to load image'
+    result, which is not cached: it is cheap to produce again, and a
+    decoder added or fixed later should not be masked until it expires.
+    """
+    with track_stage('ocr'):
+        ocr_text, ocr_mode = extract_text_with_gate(image)
+    result = analyze_image_content(image, ocr_text, ruleset)
+    result['ocr_mode'] = ocr_mode
+    
+    cache = get_result_cache()
+    if cache is not None and image is not None:
+        cache.set(key, result)
+    return result
+
+def analyze_image_batch(images: List[bytes]) -> Dict:
+    """
+    Analyze several images on the batch worker pool
+    
+    Identical files are analysed once. Near-duplicate pairs are found from
+    the average hashes computed for reverse search, without another pass
+    over the pixels.
+    
+    Args:
+        images: Encoded image contents
+        
+    Returns:
+        {
+            "results": [{...analysis...} or {"error": ..., "message": ...}],
+            "count": int,
+            "errors": int,
+            "near_duplicates": [{"first": i, "second": j, "distance": int}]
+        }
+    """
+    ruleset = get_ruleset()
+    futures = {}
+    keys = []
+    for image_bytes in images:
+        key = image_cache_key(image_bytes, ruleset)
+        if key not in futures:
+            futures[key] = _image_batch_executor.submit(
+                contextvars.copy_context().run, _analyze_batch_image, image_bytes, key, ruleset)
+        keys.append(key)
+    
+    results = []
+    hashes = []
+    seen = set()
+    errors = 0
+    for key in keys:
+        try:
+            result, average_hash = futures[key].result()
+            # Repeated files share an outcome but get their own result object
+            results.append(copy.deepcopy(result) if key in seen else result)
+            seen.add(key)
+            if average_hash is not None:
+                hashes.append((len(results) - 1, average_hash))
+        except OCRPoolError as e:
+            results.append({'error': 'OCR unavailable', 'message': str(e)})
+            errors += 1
+        except Exception as e:
+            results.append({'error': 'Analysis failed', 'message': str(e)})
+            errors += 1
+    
+    return {
+        'results': results,
+        'count': len(results),
+        'errors': errors,
+        'near_duplicates': find_near_duplicates(hashes, IMAGE_BATCH_DUPLICATE_DISTANCE),
+    }
+
+def _analyze_batch_image(image_bytes: bytes, key: str, ruleset: Ruleset):
+    """
+    Analyze one image of a batch
+    
+    Returns:
+        (analysis result, 64-bit average hash, or None when the image could
+        not be decoded)
+    """
+    with track_stage('decode'):
+        image = DecodedImage.from_bytes(image_bytes)
+    if image is None:
+        # Same uncached 'Failed to load image' result as a single upload
+        return _analyze_image_uncached(None, key, ruleset), None
+    
+    cache = get_result_cache()
+    result = cache.get(key) if cache is not None else None
+    if result is None:
+        result = get_single_flight().do(key, _analyze_image_uncached, image, key, ruleset, kind='image')
+    # Already computed by reverse search unless the result came from the cache
+    return result, image.average_hash
+
+def find_near_duplicates(hashes: List, max_distance: int) -> List[Dict]:
+    """
+    Pairs of images whose average hashes are within a Hamming distance
+    
+    Args:
+        hashes: (position, 64-bit average hash) per image
+        max_distance: Maximum Hamming distance (inclusive)
+        
+    Returns:
+        [{"first": position, "second": position, "distance": int}] by position
+    """
+    pairs = []
+    for i, (first, first_hash) in enumerate(hashes):
+        for second, second_hash in hashes[i + 1:]:
+            distance = bin(first_hash ^ second_hash).count('1')
+            if distance <= max_distance:
+                pairs.append({'first': first, 'second': second, 'distance': distance})
+    return pairs
+
+def analyze_video_file(path: str) -> Dict:
+    """
+    Analyze a video or animated image, with caching
+    
+    Distinct keyframes are streamed out of the file (see utils/frame_io.py)
+    and analysed as they are decoded, at most VIDEO_WINDOW at a time, so
+    memory stays bounded whatever the clip length.
+    
+    Args:
+        path: Video, animated GIF/WebP/PNG or still image file
+        
+    Returns:
+        Clip-level result (see models/video_model.aggregate_frame_results)
+    
+    Raises:
+        ValueError: no frame could be decoded
+        ImagePolicyError: frames are too large to decode
+    """
+    ruleset = get_ruleset()
+    cache = get_result_cache()
+    key = file_cache_key('video', f'{MODEL_VERSION}:{ruleset.fingerprint}', path)
+    if cache is not None:
+        result = cache.get(key)
+        if result is not None:
+            return result
+    return get_single_flight().do(key, _analyze_video_uncached, path, key, ruleset, kind='video')
+
+def _analyze_video_uncached(path: str, key: str, ruleset: Ruleset) -> Dict:
+    sampler = FrameSampler()
+    pending = deque()
+    frames = []
+    
+    def collect_oldest():
+        keyframe, future = pending.popleft()
+        frames.append(dict(future.result(), index=keyframe.index, timestamp=keyframe.timestamp))
+    
+    for keyframe in iter_keyframes(path, sampler):
+        pending.append((keyframe, _image_batch_executor.submit(
+            contextvars.copy_context().run, _analyze_video_frame, keyframe.image, ruleset)))
+        if len(pending) >= VIDEO_WINDOW:
+            collect_oldest()
+    while pending:
+        collect_oldest()
+    
+    result = aggregate_frame_results(frames, sampler.stats, ruleset.version)
+    cache = get_result_cache()
+    if cache is not None:
+        cache.set(key, result)
+    return result
+
+def _analyze_video_frame(image: DecodedImage, ruleset: Ruleset) -> Dict:
+    """Blur, manipulation, OCR and reverse search on one keyframe"""
+    with track_stage('ocr'):
+        ocr_text, ocr_mode = extract_text_with_gate(image)
+    result = analyze_image_content(image, ocr_text, ruleset, metadata=False)
+    result['ocr_mode'] = ocr_mode
+    return result
+
+def read_image_file(image_path: str) -> Optional[bytes]:
+    """Read an image file's bytes, or None if it does not exist"""
+    if not os.path.exists(image_path):
+        return None
+    with open(image_path, 'rb') as f:
+        return f.read()
+
+def read_image_source(image_path: str) -> Optional[bytes]:
+    """
+    Read image bytes from a local path or an http(s) URL
+    
+    Returns:
+        Image bytes, or None if a local path does not exist
+    
+    Raises:
+        ImageFetchError: a URL could not be downloaded as an image
+    """
+    if is_url(image_path):
+        with track_stage('fetch'):
+            return get_image_fetcher().fetch(image_path)
+    return read_image_file(image_path)
+
+def analyze_multi(text: Optional[str], image_bytes: Optional[bytes]) -> Dict:
+    """
+    Analyze text and image content together
+    
+    The text, OCR and image branches run concurrently, each bounded by its
+    timeout in BRANCH_TIMEOUTS. Branches that time out or fail are listed
+    in 'degraded_branches' and their fields keep default values.
+    
+    Args:
+        text: Optional text content
+        image_bytes: Optional encoded image content
+        
+    Returns:
+        Combined analysis result with credibility_score
+    """
+    results = {
+        'text_analysis_score': None,
+        'visual_analysis_score': None,
+        'sentiment': 'unknown',
+        'claims': [],
+        'contradictions': [],
+        'summary': '',
+        'reasons': [],
+        'manipulation_prob': None,
+        'match_sources': [],
+        'ocr_text': None,
+        'ocr_mode': None,
+        'fact_check_matches': [],
+    }
+    
+    started = time.monotonic()
+    futures = {}
+    # Every branch scores with the same rules, even across a reload
+    ruleset = get_ruleset()
+    
+    # Analyze text if provided
+    if text and len(text.strip()) > 0:
+        futures['text'] = _submit_branch(analyze_text, text, ruleset)
+    
+    # Analyze image if provided (repeated images skip every branch)
+    image_result = None
+    cache = get_result_cache()
+    image_key = None
+    if image_bytes:
+        image_key = image_cache_key(image_bytes, ruleset)
+        image_result = cache.get(image_key) if cache is not None else None
+        if image_result is None:
+            with track_stage('decode'):
+                image = DecodedImage.from_bytes(image_bytes)
+            # Coalesced per branch: the full image key already covers whole results
+            single_flight = get_single_flight()
+            futures['ocr'] = _submit_branch(
+                single_flight.do, f'ocr:{image_key}', _run_ocr, image, kind='ocr')
+            futures['image'] = _submit_branch(
+                single_flight.do, f'image:{image_key}', analyze_image_content, image, None, ruleset,
+                kind='image')
+    
+    outcomes = _collect_branches(futures, started)
+    degraded = [name for name in futures if name not in outcomes]
+    
+    text_result = outcomes.get('text')
+    if text_result is not None:
+        results['text_analysis_score'] = text_result.get('text_analysis_score')
+        results['sentiment'] = text_result.get('sentiment', 'unknown')
+        results['claims'] = text_result.get('claims', [])
+        results['contradictions'] = text_result.get('contradictions', [])
+        results['summary'] = text_result.get('summary', '')
+        results['fact_check_matches'] = text_result.get('fact_check_matches', [])
+        results['reasons'].extend(text_result.get('reasons', []))
+    
+    if image_result is None and 'image' in outcomes:
+        image_result = outcomes['image']
+        image_result['ocr_text'], image_result['ocr_mode'] = outcomes.get('ocr', (None, None))
+        if 'ocr' in outcomes and cache is not None and image is not None:
+            cache.set(image_key, image_result)
+    
+    if image_result is not None:
+        results['visual_analysis_score'] = image_result.get('visual_analysis_score')
+        results['manipulation_prob'] = image_result.get('manipulation_prob')
+        results['match_sources'] = image_result.get('match_sources', [])
+        results['ocr_text'] = image_result.get('ocr_text')
+        results['ocr_mode'] = image_result.get('ocr_mode')
+        results['reasons'].extend(image_result.get('reasons', []))
+    
+    # Calculate combined credibility score
+    results['credibility_score'] = calculate_credibility_score(results)
+    
+    # Build explainability object
+    results['explainability'] = {
+        'top_reasons': results['reasons'][:3],
+        'text_contribution': results['text_analysis_score'] if results['text_analysis_score'] else 0,
+        'visual_contribution': results['visual_analysis_score'] if results['visual_analysis_score'] else 0,
+    }
+    
+    results['degraded'] = len(degraded) > 0
+    results['degraded_branches'] = degraded
+    results['ruleset_version'] = ruleset.version
+    
+    return results
+
+def _submit_branch(fn, *args, **kwargs):
+    """Submit a branch, carrying the request's metrics context to the worker"""
+    return _branch_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def _run_ocr(image: DecodedImage) -> Tuple[str, str]:
+    with track_stage('ocr'):
+        return extract_text_with_gate(image)
+
+def _collect_branches(futures: Dict, started: float) -> Dict:
+    """
+    Wait for each branch until its own deadline
+    
+    Returns:
+        Results of the branches that completed successfully, by name
+    """
+    outcomes = {}
+    for name, future in futures.items():
+        remaining = BRANCH_TIMEOUTS[name] - (time.monotonic() - started)
+        try:
+            outcomes[name] = future.result(timeout=max(0.0, remaining))
+        except FutureTimeoutError:
+            # Not started yet: drop it; already running: let it finish unused
+            future.cancel()
+        except Exception:
+            pass
+    return outcomes
+
+def calculate_credibility_score(results):
+    """
+    Calculate credibility score from multi-modal results
+    Uses weighted formula: 0.6 * text_score + 0.4 * visual_score
+    """
+    text_score = results.get('text_analysis_score')
+    visual_score = results.get('visual_analysis_score')
+    
+    if text_score is not None and visual_score is not None:
+        return round(0.6 * text_score + 0.4 * visual_score)
+    elif text_score is not None:
+        return text_score
+    elif visual_score is not None:
+        return visual_score
+    else:
+        return 50  # Default neutral score
@@ -0,0 +1,245 @@
+"""
+Job Service
+Asynchronous image and multi-modal analysis (submit, then poll or get a callback)
+
+Slow analyses (large images, heavy OCR) can outlast a caller's timeout, and
+a caller that retries then starts the same work again. A job is submitted
+instead: the request returns at once with a job id, the work is queued in
+the durable job store (see utils/job_store.py) and a pool of worker threads
+drains the queue by priority. Callers poll GET /ml/jobs/<id> or pass a
+callback_url that receives the finished job as a JSON POST.
+
+Jobs are deduplicated by content: an image job is keyed by the same hash
+as the result cache, a multi-modal job by its text and image source, so a
+retried or repeated submission returns the existing job (and, once it has
+finished, its result) rather than queueing the work again. The image of a
+multi-modal job is only fetched when the job runs, so its key covers the
+image_path string, not the image: resubmitting a URL whose image has since
+changed returns the earlier job until its result expires.
+
+Callbacks are notified of every finished job, including one given up on
+after its workers died ML_JOB_MAX_ATTEMPTS times.
+
+Configuration (environment variables):
+- ML_JOBS_PATH: SQLite job store (default: cache/jobs.sqlite3)
+- ML_JOB_WORKERS: threads running jobs in this process (default: 2)
+- ML_JOB_MAX_QUEUED: queued jobs before submissions get 503 (default: 1000)
+- ML_JOB_RESULT_TTL: seconds a finished job and its result are kept (default: 3600)
+- ML_JOB_LEASE: seconds before a running job whose worker died is run again (default: 300)
+- ML_JOB_MAX_ATTEMPTS: runs of one job before it is marked failed (default: 3)
+- ML_JOB_RETRY_BACKOFF: seconds a job waits before its first retry after a
+  transient error (e.g. OCR busy), doubling with each attempt (default: 1)
+- ML_JOB_POLL_INTERVAL: seconds an idle worker waits before checking the
+  store for jobs queued by other processes (default: 1)
+- ML_JOB_CALLBACK_TIMEOUT: seconds allowed per callback POST (default: 5)
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from models.image_model import MODEL_VERSION
+from models.ruleset import get_ruleset
+from services import analysis
+from utils import metrics
+from utils.image_fetch import ImageFetchError, is_url
+from utils.job_store import JobStore
+from utils.ocr_pool import OCRPoolError
+from utils.result_cache import content_cache_key
+
+JOB_WORKERS = int(os.environ.get('ML_JOB_WORKERS', '2'))
+JOB_POLL_INTERVAL = float(os.environ.get('ML_JOB_POLL_INTERVAL', '1'))
+JOB_CALLBACK_TIMEOUT = float(os.environ.get('ML_JOB_CALLBACK_TIMEOUT', '5'))
+JOB_CALLBACK_ATTEMPTS = 3
+MIN_PRIORITY, MAX_PRIORITY = 0, 9
+PURGE_INTERVAL = 60.0
+
+_store: Optional[JobStore] = None
+_store_lock = threading.Lock()
+_workers: List[threading.Thread] = []
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+
+def get_job_store() -> JobStore:
+    """Get the process-wide job store configured from the environment"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = JobStore(
+                    os.environ.get(
+                        'ML_JOBS_PATH',
+                        os.path.join(os.path.dirname(__file__), '..', 'cache', 'jobs.sqlite3'),
+                    ),
+                    max_queued=int(os.environ.get('ML_JOB_MAX_QUEUED', '1000')),
+                    result_ttl=float(os.environ.get('ML_JOB_RESULT_TTL', '3600')),
+                    lease=float(os.environ.get('ML_JOB_LEASE', '300')),
+                    max_attempts=int(os.environ.get('ML_JOB_MAX_ATTEMPTS', '3')),
+                    retry_backoff=float(os.environ.get('ML_JOB_RETRY_BACKOFF', '1')),
+                )
+    return _store
+
+def parse_job_options(priority, callback_url) -> Tuple[int, Optional[str]]:
+    """
+    Validate the priority and callback_url of a submission
+
+    Raises:
+        ValueError: either is invalid
+    """
+    if priority in (None, ''):
+        priority = MIN_PRIORITY
+    try:
+        priority = int(priority)
+    except (TypeError, ValueError):
+        raise ValueError(f'priority must be an integer from {MIN_PRIORITY} to {MAX_PRIORITY}')
+    if not MIN_PRIORITY <= priority <= MAX_PRIORITY:
+        raise ValueError(f'priority must be an integer from {MIN_PRIORITY} to {MAX_PRIORITY}')
+    if callback_url in (None, ''):
+        callback_url = None
+    elif not isinstance(callback_url, str) or not is_url(callback_url):
+        raise ValueError('callback_url must be an http(s) URL')
+    return priority, callback_url
+
+def submit_image_job(image_bytes: bytes, priority: int = MIN_PRIORITY,
+                     callback_url: Optional[str] = None) -> Tuple[Dict, bool]:
+    """
+    Queue image analysis (see analysis.analyze_image_bytes)
+
+    Returns:
+        (job, created); created is False when an equivalent job exists
+
+    Raises:
+        JobQueueFullError: the queue is full
+    """
+    key = analysis.image_cache_key(image_bytes, get_ruleset())
+    return _submit('image', key, {}, image_bytes, priority, callback_url)
+
+def submit_multi_job(text: str, image_path: Optional[str], priority: int = MIN_PRIORITY,
+                     callback_url: Optional[str] = None) -> Tuple[Dict, bool]:
+    """
+    Queue multi-modal analysis (see analysis.analyze_multi)
+
+    The image is read or downloaded by the worker, not at submission, so
+    the job is deduplicated by image_path rather than by image content.
+
+    Returns:
+        (job, created); created is False when an equivalent job exists
+
+    Raises:
+        JobQueueFullError: the queue is full
+    """
+    source = json.dumps([text or '', image_path or '']).encode('utf-8')
+    key = content_cache_key('multi', f'{MODEL_VERSION}:{get_ruleset().fingerprint}', source)
+    return _submit('multi', key, {'text': text, 'image_path': image_path}, None, priority, callback_url)
+
+def _submit(kind: str, key: str, params: Dict, payload: Optional[bytes], priority: int,
+            callback_url: Optional[str]) -> Tuple[Dict, bool]:
+    job, created = get_job_store().submit(kind, key, params, payload, priority, callback_url)
+    if created:
+        start_job_workers()
+        _wakeup.set()
+    return job, created
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """Job status and, once finished, its result; None if unknown or expired"""
+    return get_job_store().get(job_id)
+
+def start_job_workers():
+    """Start this process's job workers (idempotent); queued jobs left by a restart resume"""
+    with _workers_lock:
+        while len(_workers) < JOB_WORKERS:
+            worker = threading.Thread(target=_work, name=f'ml-job-{len(_workers)}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+def _work():
+    next_purge = 0.0
+    while True:
+        store = get_job_store()
+        _wakeup.clear()
+        try:
+            if time.monotonic() >= next_purge:
+                store.purge_expired()
+                next_purge = time.monotonic() + PURGE_INTERVAL
+            for abandoned in store.abandon_expired():
+                _notify_callbacks(store, abandoned)
+            job = store.claim()
+        except Exception as e:
+            print(f'Warning: job store unavailable: {e}')
+            job = None
+        if job is None:
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            continue
+        run_job(store, job)
+
+def run_job(store: JobStore, job: Dict):
+    """
+    Run one claimed job, record its outcome and notify its callbacks
+
+    The job's lease is renewed while it runs. If the lease is lost anyway
+    (e.g. the process stalled), the outcome is dropped: another worker owns
+    the job now.
+    """
+    job_id, lease_owner = job['job_id'], job['lease_owner']
+    metrics.begin_request(f"job_{job['kind']}")
+    done = threading.Event()
+    heartbeat = threading.Thread(target=_renew_lease, args=(store, job_id, lease_owner, done),
+                                 name=f'ml-job-lease-{job_id[:8]}', daemon=True)
+    heartbeat.start()
+    try:
+        with metrics.track_stage('job'):
+            result = _execute(job)
+        finished = store.complete(job_id, result, lease_owner)
+    except OCRPoolError as e:
+        # OCR workers were saturated: run the job again later
+        finished = store.retry(job_id, f'OCR unavailable: {e}', lease_owner)
+    except ImageFetchError as e:
+        finished = store.fail(job_id, f'Image fetch failed: {e}', lease_owner)
+    except Exception as e:
+        finished = store.fail(job_id, f'Analysis failed: {e}', lease_owner)
+    finally:
+        done.set()
+
+    if finished is not None:
+        _notify_callbacks(store, finished)
+
+def _renew_lease(store: JobStore, job_id: str, lease_owner: str, done: threading.Event):
+    """Renew a running job's lease every third of its length until the job is done"""
+    while not done.wait(max(store.lease / 3, 0.1)):
+        try:
+            if not store.renew(job_id, lease_owner):
+                print(f'Warning: job {job_id} lost its lease')
+                return
+        except Exception as e:
+            print(f'Warning: could not renew the lease of job {job_id}: {e}')
+
+def _execute(job: Dict) -> Dict:
+    if job['kind'] == 'image':
+        return analysis.analyze_image_bytes(job['payload'])
+    if job['kind'] == 'multi':
+        params = job['params']
+        image_path = params.get('image_path')
+        image_bytes = analysis.read_image_source(image_path) if image_path else None
+        return analysis.analyze_multi(params.get('text'), image_bytes)
+    raise ValueError(f"Unknown job kind: {job['kind']}")
+
+def _notify_callbacks(store: JobStore, job: Dict):
+    for callback_url in store.callbacks(job['job_id']):
+        _notify(callback_url, job)
+
+def _notify(callback_url: str, job: Dict):
+    """POST the finished job to a callback URL, retrying with backoff"""
+    for attempt in range(JOB_CALLBACK_ATTEMPTS):
+        try:
+            response = requests.post(callback_url, json=job, timeout=JOB_CALLBACK_TIMEOUT)
+            if response.status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        if attempt + 1 < JOB_CALLBACK_ATTEMPTS:
+            time.sleep(2 ** attempt)
+    print(f"Warning: callback for job {job['job_id']} to {callback_url} failed")
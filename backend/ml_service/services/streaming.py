@@ -0,0 +1,214 @@
+"""
+Streaming Analysis Service
+Newline-delimited JSON (NDJSON) bulk scoring for backfills
+
+Each input line is one JSON record carrying a caller-supplied "id" and
+the content to score:
+
+    {"id": "post-1", "text": "..."}
+    {"id": "post-2", "image": "<base64 image bytes>"}
+    {"id": "post-3", "text": "...", "image_path": "https://cdn.example/img.jpg"}
+
+and produces exactly one output line, in input order:
+
+    {"id": "post-1", "result": {...analysis...}}
+    {"id": "post-2", "error": "Invalid input", "message": "..."}
+
+Text-only records go through the text pipeline, image-only records through
+the image pipeline and records with both through the multi-modal pipeline,
+so results match the single-item endpoints. Lines are read and scored
+lazily: at most ML_STREAM_WINDOW records are in flight and no line longer
+than ML_STREAM_MAX_LINE_BYTES is held, so memory stays constant however
+long the stream is.
+
+Configuration (environment variables):
+- ML_STREAM_WORKERS: threads scoring stream records (default: 4)
+- ML_STREAM_WINDOW: records in flight per stream before reading pauses (default: 16)
+- ML_STREAM_MAX_LINE_BYTES: longest accepted input line (default: 16777216)
+"""
+
+import base64
+import binascii
+import contextvars
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, Optional
+
+from services import analysis
+from utils.image_fetch import ImageFetchError
+from utils.image_io import ImagePolicyError
+from utils.ocr_pool import OCRPoolError
+
+STREAM_WINDOW = max(1, int(os.environ.get('ML_STREAM_WINDOW', '16')))
+STREAM_MAX_LINE_BYTES = int(os.environ.get('ML_STREAM_MAX_LINE_BYTES', str(16 * 1024 * 1024)))
+
+_stream_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ML_STREAM_WORKERS', '4')),
+    thread_name_prefix='ml-stream',
+)
+
+CONTENT_TYPE = 'application/x-ndjson'
+
+def _error(record_id, error: str, message: str) -> Dict:
+    return {'id': record_id, 'error': error, 'message': message}
+
+def analyze_record(line: Optional[bytes]) -> Dict:
+    """
+    Score one NDJSON input line
+
+    Args:
+        line: Raw JSON line, or None for a line that exceeded the size limit
+
+    Returns:
+        {"id": ..., "result": {...}} or {"id": ..., "error": ..., "message": ...}
+    """
+    if line is None:
+        return _error(None, 'Invalid input', 'Line exceeds ML_STREAM_MAX_LINE_BYTES')
+
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return _error(None, 'Invalid input', 'Line is not valid JSON')
+    if not isinstance(record, dict):
+        return _error(None, 'Invalid input', 'Each line must be a JSON object')
+
+    record_id = record.get('id')
+    text = record.get('text')
+    if text is not None and (not isinstance(text, str) or len(text.strip()) == 0):
+        return _error(record_id, 'Invalid input', 'Text must be a non-empty string')
+
+    try:
+        image_bytes = _record_image(record)
+    except ValueError as e:
+        return _error(record_id, 'Invalid input', str(e))
+
+    if text is None and image_bytes is None:
+        return _error(record_id, 'Invalid input', 'Record needs text, image or image_path')
+
+    try:
+        if image_bytes is None:
+            result = analysis.analyze_text(text)
+        elif text is None:
+            result = analysis.analyze_image_bytes(image_bytes)
+        else:
+            result = analysis.analyze_multi(text, image_bytes)
+    except OCRPoolError as e:
+        return _error(record_id, 'OCR unavailable', str(e))
+    except ImageFetchError as e:
+        return _error(record_id, 'Image fetch failed', str(e))
+    except ImagePolicyError as e:
+        return _error(record_id, 'Image too large', str(e))
+    except Exception as e:
+        return _error(record_id, 'Analysis failed', str(e))
+
+    return {'id': record_id, 'result': result}
+
+def _record_image(record: Dict) -> Optional[bytes]:
+    """Image bytes from a record's base64 'image' or 'image_path' field"""
+    if record.get('image') is not None:
+        try:
+            return base64.b64decode(record['image'], validate=True)
+        except (TypeError, binascii.Error):
+            raise ValueError('image must be base64-encoded')
+
+    if record.get('image_path') is not None:
+        image_bytes = analysis.read_image_source(str(record['image_path']))
+        if image_bytes is None:
+            raise ValueError('image_path does not exist')
+        return image_bytes
+
+    return None
+
+def encode_record(record: Dict) -> bytes:
+    return json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+
+def iter_lines(readline: Callable[[int], bytes],
+               max_line_bytes: Optional[int] = None) -> Iterator[Optional[bytes]]:
+    """
+    Read lines from a binary stream without holding more than one line
+
+    Args:
+        readline: readline(limit) of a binary file-like object
+        max_line_bytes: Longest line kept; longer lines are skipped
+            (default: STREAM_MAX_LINE_BYTES)
+
+    Yields:
+        Non-blank lines, or None in place of each over-long line
+    """
+    if max_line_bytes is None:
+        max_line_bytes = STREAM_MAX_LINE_BYTES
+    while True:
+        line = readline(max_line_bytes + 1)
+        if not line:
+            return
+        if len(line) > max_line_bytes and not line.endswith(b'\n'):
+            # Discard the rest of the over-long line in bounded pieces
+            while line and not line.endswith(b'\n'):
+                line = readline(max_line_bytes + 1)
+            yield None
+        elif line.strip():
+            yield line
+
+async def aiter_lines(chunks: AsyncIterable[bytes],
+                      max_line_bytes: Optional[int] = None) -> AsyncIterator[Optional[bytes]]:
+    """
+    Split an async stream of body chunks into lines (see iter_lines)
+    """
+    if max_line_bytes is None:
+        max_line_bytes = STREAM_MAX_LINE_BYTES
+    buffer = bytearray()
+    oversized = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            newline = chunk.find(b'\n', start)
+            if newline < 0:
+                if not oversized:
+                    buffer += chunk[start:]
+                    if len(buffer) > max_line_bytes:
+                        buffer.clear()
+                        oversized = True
+                break
+            if oversized:
+                yield None
+            else:
+                buffer += chunk[start:newline + 1]
+                if len(buffer) > max_line_bytes + 1:
+                    yield None
+                elif buffer.strip():
+                    yield bytes(buffer)
+            buffer.clear()
+            oversized = False
+            start = newline + 1
+
+    if oversized:
+        yield None
+    elif buffer.strip():
+        yield bytes(buffer)
+
+def analyze_stream(lines: Iterable[Optional[bytes]]) -> Iterator[bytes]:
+    """
+    Score NDJSON lines concurrently, yielding encoded results in input order
+
+    At most STREAM_WINDOW records are scored at once. Results are yielded
+    as soon as every earlier record has finished, and reading pauses while
+    the window is full.
+
+    Args:
+        lines: Input lines, e.g. from iter_lines
+
+    Yields:
+        One encoded output line per input line
+    """
+    pending = deque()
+    for line in lines:
+        # Carry the request's metrics context to the worker thread
+        pending.append(_stream_executor.submit(contextvars.copy_context().run, analyze_record, line))
+        # Emit finished results right away; block only when the window is full
+        while pending and (pending[0].done() or len(pending) >= STREAM_WINDOW):
+            yield encode_record(pending.popleft().result())
+
+    while pending:
+        yield encode_record(pending.popleft().result())
@@ -0,0 +1,176 @@
+"""
+Warm-up Service
+Preloads libraries, indexes and rules before a worker reports ready
+
+Heavy libraries are imported lazily (see utils/lazy_import.py), so the app
+starts listening quickly. Warm-up then runs in the background: it imports
+the image stack, opens the reverse-search index, starts OCR workers and
+pushes a small sample through each pipeline so the first real request does
+not pay for any of it. /ready answers 503 until warm-up has finished,
+while /health keeps reporting liveness.
+
+Configuration (environment variables):
+- ML_WORKER_MODE: `full` warms the text and image pipelines; `text` warms
+  text analysis only and leaves OpenCV, PIL and OCR unloaded until
+  an image request needs them (default: full)
+- ML_WARMUP: warm up at startup; when false the worker is ready at once and
+  everything loads on first use (default: true)
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils import metrics
+
+WORKER_MODE = os.environ.get('ML_WORKER_MODE', 'full').lower()
+WARMUP_ENABLED = os.environ.get('ML_WARMUP', 'true').lower() == 'true'
+
+SAMPLE_TEXT = 'Breaking: scientists say this miracle cure is 100% guaranteed, but studies show otherwise.'
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_thread: Optional[threading.Thread] = None
+_state: Dict = {'status': 'pending', 'mode': WORKER_MODE, 'steps': {}, 'error': None}
+
+def _warm_text():
+    from models.text_model import analyze_text_content
+
+    analyze_text_content(SAMPLE_TEXT)
+
+def _warm_result_cache():
+    from utils.result_cache import get_result_cache
+
+    get_result_cache()
+
+def _warm_near_duplicates():
+    from utils.near_duplicate import get_near_duplicate_index
+
+    index = get_near_duplicate_index()
+    if index is not None:
+        index.signature(SAMPLE_TEXT)
+
+def _warm_claim_index():
+    from utils.claim_index import get_claim_index
+
+    get_claim_index().refresh_if_changed()
+
+def _warm_image_libraries():
+    from utils.image_io import cv2, np, Image
+    from utils.lazy_import import load
+
+    for module in (cv2, np, Image):
+        load(module)
+    # Optional dependencies: missing ones are reported by the analysers
+    for name in ('imagehash', 'pytesseract'):
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+def _warm_hash_index():
+    from utils.hash_index import get_hash_index
+
+    get_hash_index().refresh_if_changed()
+
+def _warm_ocr():
+    from utils.ocr_pool import get_ocr_pool
+
+    pool = get_ocr_pool()
+    if pool is not None:
+        pool.warm_up()
+
+def _warm_image_pipeline():
+    from models.image_model import analyze_image_content
+    from utils.image_io import DecodedImage, np
+
+    sample = DecodedImage(np.full((64, 64, 3), 127, dtype=np.uint8))
+    analyze_image_content(sample, '')
+
+def warmup_steps(mode: str) -> List[Tuple[str, Callable[[], None]]]:
+    """Warm-up steps, in order, for a worker mode ('text' or 'full')"""
+    steps = [
+        ('text_rules', _warm_text),
+        ('result_cache', _warm_result_cache),
+        ('near_duplicates', _warm_near_duplicates),
+        ('claim_index', _warm_claim_index),
+    ]
+    if mode != 'text':
+        steps += [
+            ('image_libraries', _warm_image_libraries),
+            ('hash_index', _warm_hash_index),
+            ('ocr_workers', _warm_ocr),
+            ('image_pipeline', _warm_image_pipeline),
+        ]
+    return steps
+
+def warm_up(mode: Optional[str] = None) -> Dict:
+    """
+    Run every warm-up step in the calling thread and mark the worker ready
+
+    Returns:
+        Readiness state (see readiness)
+    """
+    mode = mode or WORKER_MODE
+    with _lock:
+        _state.update(status='warming_up', mode=mode, steps={}, error=None)
+
+    # Stage metrics recorded during warm-up get their own pipeline label
+    metrics.begin_request('warmup')
+    started = time.perf_counter()
+    name = None
+    try:
+        for name, step in warmup_steps(mode):
+            step_started = time.perf_counter()
+            step()
+            with _lock:
+                _state['steps'][name] = round(time.perf_counter() - step_started, 4)
+    except Exception as e:
+        with _lock:
+            _state.update(status='failed', error=f'{name}: {e}')
+        return readiness()
+
+    with _lock:
+        _state.update(status='ready', warmup_seconds=round(time.perf_counter() - started, 4))
+    _ready.set()
+    return readiness()
+
+def start_warmup():
+    """
+    Start warm-up in a background thread (once per process)
+
+    With ML_WARMUP=false the worker is marked ready immediately.
+    """
+    global _thread
+
+    with _lock:
+        if _thread is not None or _ready.is_set():
+            return
+        if not WARMUP_ENABLED:
+            _state.update(status='ready', mode=WORKER_MODE)
+            _ready.set()
+            return
+        _thread = threading.Thread(target=warm_up, name='ml-warmup', daemon=True)
+        _thread.start()
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+def wait_until_ready(timeout: Optional[float] = None) -> bool:
+    return _ready.wait(timeout)
+
+def readiness() -> Dict:
+    """
+    Current warm-up state
+
+    Returns:
+        {"status": "pending" | "warming_up" | "ready" | "failed",
+         "mode": "full" | "text", "steps": {step: seconds}, ...}
+    """
+    with _lock:
+        state = dict(_state)
+        state['steps'] = dict(_state['steps'])
+    if state.get('error') is None:
+        state.pop('error', None)
+    return state
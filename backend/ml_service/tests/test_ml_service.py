@@ -4,14 +4,24 @@ Tests analysis endpoints and model functions
 """
 
 import pytest
+import io
 import os
 import tempfile
 from PIL import Image
 import numpy as np
 
-from models.text_model import analyze_text_content
-from models.image_model import analyze_image_content
-from utils.ocr_stub import extract_text_from_image
+from models.text_model import (
+    analyze_text_content, KeywordMatcher, ContradictionDetector,
+)
+from models.ruleset import RulesetError, get_ruleset, reload_ruleset
+from models.image_model import analyze_image_content, extract_image_features
+from utils.ocr_stub import extract_text_from_image, preprocess_for_ocr
+from utils.ocr_pool import OCRPool, OCRBusyError
+from utils.image_io import DecodedImage
+from utils.hash_index import ImageHashIndex, compute_average_hash
+from utils.result_cache import (
+    ResultCache, MemoryCacheBackend, DiskCacheBackend, text_cache_key,
+)
 
 class TestTextModel:
     """Tests for text analysis model"""
@@ -47,6 +57,40 @@ class TestTextModel:
         """Test handling of empty text"""
         result = analyze_text_content("")
         assert 'text_analysis_score' in result
+    
+    def test_keyword_matcher_counts_shared_keywords_per_family(self):
+        """Test that a keyword listed in several families counts for each"""
+        matcher = KeywordMatcher({'a': ['cure', 'miracle'], 'b': ['cure', 'heal']})
+        counts = matcher.count('a miracle cure')
+        
+        assert counts == {'a': 2, 'b': 1}
+    
+    def test_analyze_text_scores_are_stable(self):
+        """Test exact scores produced by the shared keyword matcher"""
+        text = "SHOCKING miracle cure! Act now, doctors hate it. Nobody ever fails, everyone always wins."
+        counts = get_ruleset().keyword_matcher.count(text.lower())
+        result = analyze_text_content(text)
+        
+        assert counts['clickbait'] == 4
+        assert counts['medical'] == 1
+        assert result['text_analysis_score'] == 0
+        assert result['claims'] == [
+            'Contains clickbait language',
+            'Uses absolute language',
+            'Unsubstantiated medical claims',
+        ]
+    
+    def test_contradiction_detector_matches_ordered_pairs_per_line(self):
+        """Test that anchor pairs must appear in order on the same line"""
+        detector = ContradictionDetector([
+            ('never', 'always', 'never/always'),
+            ('all', 'none', 'all/none'),
+        ])
+        
+        assert detector.detect('we never said it is always true') == ['never/always']
+        assert detector.detect('always, and never') == []
+        assert detector.detect('never\nalways') == []
+        assert detector.detect('all of it\nnever mind, none always') == ['never/always']
 
 class TestImageModel:
     """Tests for image analysis model"""
@@ -76,12 +120,1021 @@ class TestImageModel:
         finally:
             os.unlink(image_path)
     
+    def test_analyze_image_accepts_decoded_image(self):
+        """Test that a single in-memory decode gives the same result as a path"""
+        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
+            pixels = (np.random.default_rng(1).random((64, 64, 3)) * 255).astype('uint8')
+            Image.fromarray(pixels).save(tmp_file.name)
+            image_path = tmp_file.name
+        
+        try:
+            with open(image_path, 'rb') as f:
+                decoded = DecodedImage.from_bytes(f.read())
+            
+            assert analyze_image_content(decoded) == analyze_image_content(image_path)
+            assert DecodedImage.from_bytes(b'not an image') is None
+        finally:
+            os.unlink(image_path)
+    
+    def test_sampled_features_track_full_resolution_statistics(self):
+        """Test that tile sampling on large images stays close to a full pass"""
+        rng = np.random.default_rng(2)
+        img = np.zeros((1500, 2000, 3), dtype=np.uint8)
+        for _ in range(80):
+            x, y = (int(v) for v in rng.integers(0, 2000, 2))
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            img[y % 1500:y % 1500 + 200, x:x + 300] = color
+        img = np.clip(img + rng.normal(0, 4, img.shape), 0, 255).astype(np.uint8)
+        
+        full = extract_image_features(img, max_side=0)
+        sampled = extract_image_features(img, max_side=512)
+        
+        assert not full['sampled'] and sampled['sampled']
+        assert sampled['laplacian_var'] == pytest.approx(full['laplacian_var'], rel=0.25)
+        assert sampled['edge_density'] == pytest.approx(full['edge_density'], rel=0.25, abs=0.005)
+        assert sampled['saturation_std'] == pytest.approx(full['saturation_std'], rel=0.1)
+    
     def test_analyze_image_invalid_path(self):
         """Test handling of invalid image path"""
         result = analyze_image_content('/nonexistent/image.png')
         assert result['visual_analysis_score'] == 0
         assert result['manipulation_prob'] == 1.0
 
+    def test_decode_policy_rejects_bombs_and_reduces_large_jpegs(self):
+        """Test header-based rejection and reduced-scale JPEG decoding"""
+        import struct
+        import zlib
+        from utils.image_io import ImagePolicyError
+        
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+        
+        # A few hundred bytes claiming 20000x20000 pixels
+        bomb = (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 20000, 20000, 8, 2, 0, 0, 0))
+                + chunk(b'IDAT', zlib.compress(b'\x00' * 1024)) + chunk(b'IEND', b''))
+        with pytest.raises(ImagePolicyError):
+            DecodedImage.from_bytes(bomb)
+        
+        buffer = io.BytesIO()
+        Image.new('RGB', (9000, 300), color='white').save(buffer, format='JPEG')
+        decoded = DecodedImage.from_bytes(buffer.getvalue())
+        assert decoded.reduction == 2
+        assert decoded.bgr.shape == (150, 4500, 3)
+        
+        from app import app
+        response = app.test_client().post(
+            '/ml/analyze/image', data={'image': (io.BytesIO(bomb), 'bomb.png')},
+            content_type='multipart/form-data')
+        assert response.status_code == 422
+        assert response.get_json()['error'] == 'Image too large'
+
+class TestRoutes:
+    """Tests for HTTP analysis endpoints"""
+    
+    @pytest.fixture
+    def client(self):
+        from app import app
+        app.config['TESTING'] = True
+        return app.test_client()
+    
+    def test_analyze_text_batch_preserves_order_and_item_errors(self, client):
+        """Test that batch results follow input order with per-item errors"""
+        texts = ["Miracle cure discovered!", "", "A calm report on local weather."]
+        response = client.post('/ml/analyze/text/batch', json={'texts': texts})
+        data = response.get_json()
+        
+        assert response.status_code == 200
+        assert data['count'] == 3
+        assert data['errors'] == 1
+        assert data['results'][0] == dict(analyze_text_content(texts[0]), fact_check_matches=[])
+        assert data['results'][1]['error'] == 'Invalid input'
+        assert data['results'][2] == dict(analyze_text_content(texts[2]), fact_check_matches=[])
+    
+    def test_analyze_text_batch_rejects_oversized_batch(self, client, monkeypatch):
+        """Test that batches above the configured maximum are rejected"""
+        monkeypatch.setattr('routes.analyze.TEXT_BATCH_MAX_SIZE', 2)
+        response = client.post('/ml/analyze/text/batch', json={'texts': ['a', 'b', 'c']})
+        
+        assert response.status_code == 413
+    
+    def test_analyze_image_upload(self, client):
+        """Test that an uploaded image is analyzed from memory"""
+        buffer = io.BytesIO()
+        Image.new('RGB', (100, 100), color='red').save(buffer, format='PNG')
+        buffer.seek(0)
+        
+        response = client.post('/ml/analyze/image', data={'image': (buffer, 'red.png')},
+                               content_type='multipart/form-data')
+        
+        assert response.status_code == 200
+        assert 0 <= response.get_json()['visual_analysis_score'] <= 100
+        assert response.get_json()['ocr_mode'] == 'skipped'
+    
+    def test_analyze_image_batch_flags_near_duplicates(self, client):
+        """Test per-file results in order, undecodable files and near-duplicate pairs"""
+        from models.ruleset import get_ruleset
+        from services.analysis import image_cache_key
+        from utils.result_cache import get_result_cache
+        
+        def encode(array, fmt):
+            buffer = io.BytesIO()
+            Image.fromarray(array).save(buffer, format=fmt)
+            return buffer.getvalue()
+        
+        left_white = np.zeros((96, 96, 3), dtype=np.uint8)
+        left_white[:, :48] = 255
+        top_white = np.zeros((96, 96, 3), dtype=np.uint8)
+        top_white[:48] = 255
+        files = [encode(left_white, 'PNG'), encode(top_white, 'PNG'), b'not an image',
+                 encode(left_white, 'JPEG'), encode(left_white, 'PNG')]
+        
+        response = client.post('/ml/analyze/image/batch', content_type='multipart/form-data', data={
+            'images': [(io.BytesIO(data), f'{n}.img') for n, data in enumerate(files)]})
+        data = response.get_json()
+        
+        assert response.status_code == 200
+        assert data['count'] == 5 and data['errors'] == 0
+        # Reported like a single upload of the same file
+        single = client.post('/ml/analyze/image', content_type='multipart/form-data',
+                             data={'image': (io.BytesIO(b'not an image'), 'bad.img')}).get_json()
+        assert data['results'][2] == single
+        assert single['reasons'] == ['Failed to load image']
+        cache = get_result_cache()
+        assert cache is None or cache.get(image_cache_key(b'not an image', get_ruleset())) is None
+        assert data['results'][4] == data['results'][0]
+        assert [(pair['first'], pair['second']) for pair in data['near_duplicates']] == [(0, 3), (0, 4), (3, 4)]
+        
+        response = client.post('/ml/analyze/image/batch', content_type='multipart/form-data', data={})
+        assert response.status_code == 400
+    
+    def test_analyze_multi_marks_slow_ocr_as_degraded(self, client, monkeypatch, tmp_path):
+        """Test that a slow OCR branch yields a partial, degraded result"""
+        import time
+        from services import analysis
+        
+        def slow_ocr(image):
+            time.sleep(0.5)
+            return 'late text', 'full'
+        
+        monkeypatch.setattr(analysis, 'extract_text_with_gate', slow_ocr)
+        monkeypatch.setitem(analysis.BRANCH_TIMEOUTS, 'ocr', 0.05)
+        image_path = tmp_path / 'multi.png'
+        Image.new('RGB', (120, 80), color='blue').save(image_path)
+        
+        response = client.post('/ml/analyze/multi', json={
+            'text': 'Breaking: miracle cure', 'image_path': str(image_path),
+        })
+        data = response.get_json()
+        
+        assert response.status_code == 200
+        assert data['degraded'] is True
+        assert data['degraded_branches'] == ['ocr']
+        assert data['ocr_text'] is None
+        assert data['text_analysis_score'] is not None
+        assert data['visual_analysis_score'] is not None
+    
+    def test_analyze_stream_keeps_ids_order_and_item_errors(self, client, monkeypatch):
+        """Test that NDJSON records are scored in order with their ids"""
+        import base64
+        import json
+        from services import streaming
+        monkeypatch.setattr(streaming, 'STREAM_MAX_LINE_BYTES', 4096)
+        
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), color='green').save(buffer, format='PNG')
+        lines = [
+            json.dumps({'id': 'a', 'text': 'Miracle cure discovered!'}),
+            '',
+            json.dumps({'id': 7, 'image': base64.b64encode(buffer.getvalue()).decode()}),
+            json.dumps({'id': 'c', 'text': 'x' * 5000}),
+            'not json',
+            json.dumps({'id': 'd'}),
+        ]
+        body = '\n'.join(lines).encode()
+        
+        response = client.post('/ml/analyze/stream', data=body, content_type='application/x-ndjson')
+        records = [json.loads(line) for line in response.get_data().splitlines()]
+        
+        assert response.status_code == 200
+        assert response.content_type == 'application/x-ndjson'
+        assert [record['id'] for record in records] == ['a', 7, None, None, 'd']
+        assert records[0]['result'] == dict(analyze_text_content('Miracle cure discovered!'), fact_check_matches=[])
+        assert 0 <= records[1]['result']['visual_analysis_score'] <= 100
+        assert [record.get('error') for record in records[2:]] == ['Invalid input'] * 3
+    
+    def test_ready_reports_warm_up_state(self, client, monkeypatch):
+        """Test that /ready answers 503 until warm-up has finished"""
+        import threading
+        from services import warmup
+        
+        warmup.start_warmup()
+        assert warmup.wait_until_ready(timeout=60)
+        response = client.get('/ready')
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'ready'
+        assert 'image_pipeline' in response.get_json()['steps']
+        
+        monkeypatch.setattr(warmup, '_ready', threading.Event())
+        assert client.get('/ready').status_code == 503
+        assert client.get('/health').status_code == 200
+    
+    def test_text_only_startup_defers_image_libraries(self):
+        """Test that importing the app and scoring text does not load OpenCV or PIL"""
+        import subprocess
+        import sys
+        
+        code = ('import sys, app; from services import analysis; '
+                'analysis.analyze_text("Miracle cure!"); '
+                'print(sorted(m for m in ("cv2", "PIL.Image") if m in sys.modules))')
+        env = dict(os.environ, ML_WARMUP='false')
+        output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True,
+                                text=True, check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+        
+        assert output.stdout.strip() == '[]'
+    
+    def test_metrics_endpoint_and_server_timing(self, client, monkeypatch):
+        """Test that stage latencies are exported and echoed per response"""
+        from utils import metrics
+        monkeypatch.setattr(metrics, 'SERVER_TIMING_ENABLED', True)
+        
+        response = client.post('/ml/analyze/text', json={'text': 'A metrics probe text'})
+        exposition = client.get('/metrics').get_data(as_text=True)
+        
+        assert 'text;dur=' in response.headers['Server-Timing']
+        assert 'ml_stage_duration_seconds_count{pipeline="text",stage="text"}' in exposition
+        assert 'ml_request_duration_seconds_count{route="/ml/analyze/text",status="200"}' in exposition
+        assert 'ml_requests_in_flight' in exposition
+    
+    def test_upload_over_byte_limit_is_rejected(self, client, monkeypatch):
+        """Test 413 for declared and chunked uploads and JSON bodies over the limit, and no limit on streams"""
+        from routes import analyze as analyze_routes
+        
+        monkeypatch.setattr(analyze_routes, 'UPLOAD_MAX_BYTES', 1024)
+        response = client.post('/ml/analyze/image', data={'image': (io.BytesIO(b'x' * 4096), 'big.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 413
+        assert response.get_json()['error'] == 'Upload too large'
+        
+        body = (b'--b\r\nContent-Disposition: form-data; name="image"; filename="big.png"\r\n\r\n'
+                + b'x' * 4096 + b'\r\n--b--\r\n')
+        chunked = client.post('/ml/analyze/image', input_stream=io.BytesIO(body),
+                              content_type='multipart/form-data; boundary=b',
+                              headers={'Transfer-Encoding': 'chunked'},
+                              environ_overrides={'wsgi.input_terminated': True})
+        assert chunked.status_code == 413
+        
+        monkeypatch.setattr(analyze_routes, 'IMAGE_BATCH_MAX_BYTES', 2048)
+        files = [(io.BytesIO(b'x' * 1000), f'{n}.png') for n in range(3)]
+        response = client.post('/ml/analyze/image/batch', data={'images': files}, content_type='multipart/form-data')
+        assert response.status_code == 413
+        
+        # JSON routes too: a chunked body must not be parsed truncated at the limit
+        for path in ('/ml/analyze/text', '/ml/analyze/multi'):
+            json_body = b'{"text": "' + b'x' * 4096 + b'"}'
+            response = client.post(path, input_stream=io.BytesIO(json_body), content_type='application/json',
+                                   headers={'Transfer-Encoding': 'chunked'},
+                                   environ_overrides={'wsgi.input_terminated': True})
+            assert response.status_code == 413 and response.get_json()['error'] == 'Upload too large'
+        
+        lines = b''.join(b'{"id": %d, "text": "%s"}\n' % (n, b'word ' * 50) for n in range(20))
+        stream = client.post('/ml/analyze/stream', data=lines, content_type='application/x-ndjson')
+        assert stream.status_code == 200 and len(stream.data.splitlines()) == 20
+    
+    def test_root_lists_every_analysis_route(self, client):
+        """Test that the root endpoint lists each /ml/analyze route in both apps"""
+        from starlette.testclient import TestClient
+        from app import app
+        from asgi import app as asgi_app
+        
+        analyze_rules = {rule.rule for rule in app.url_map.iter_rules() if rule.rule.startswith('/ml/analyze/')}
+        listed = set(client.get('/').get_json()['endpoints'].values())
+        assert analyze_rules <= listed and '/ml/analyze/image/batch' in listed
+        assert set(TestClient(asgi_app).get('/').json()['endpoints'].values()) == listed
+    
+    def test_repeated_text_is_served_from_cache(self, client):
+        """Test that repeated text requests hit the result cache"""
+        before = client.get('/ml/cache/stats').get_json()
+        first = client.post('/ml/analyze/text', json={'text': 'A unique cache probe text'})
+        second = client.post('/ml/analyze/text', json={'text': 'a unique cache probe TEXT '})
+        after = client.get('/ml/cache/stats').get_json()
+        
+        assert first.get_json() == second.get_json()
+        assert after['hits'] - before['hits'] == 1
+        assert after['misses'] - before['misses'] == 1
+
+class TestASGI:
+    """Tests for the ASGI entry point"""
+    
+    def test_asgi_text_route_matches_flask(self):
+        """Test that the ASGI app serves the same text analysis"""
+        from starlette.testclient import TestClient
+        from asgi import app
+        
+        text = "Shocking news: they never tell you, it is always hidden"
+        response = TestClient(app).post('/ml/analyze/text', json={'text': text})
+        
+        assert response.status_code == 200
+        assert response.json() == dict(analyze_text_content(text), fact_check_matches=[])
+    
+    def test_asgi_image_batch_limits_file_count(self, monkeypatch):
+        """Test that ASGI image batches over the limit get 413 like the Flask route"""
+        from starlette.testclient import TestClient
+        import asgi
+        
+        monkeypatch.setattr(asgi, 'IMAGE_BATCH_MAX_SIZE', 2)
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 32), color='blue').save(buffer, format='PNG')
+        client = TestClient(asgi.app)
+        
+        files = [('images', (f'{n}.png', buffer.getvalue(), 'image/png')) for n in range(3)]
+        assert client.post('/ml/analyze/image/batch', files=files).status_code == 413
+        response = client.post('/ml/analyze/image/batch', files=files[:2])
+        assert response.status_code == 200
+        assert response.json()['near_duplicates'] == [{'first': 0, 'second': 1, 'distance': 0}]
+    
+    def test_asgi_body_limit_follows_flask_routes(self, monkeypatch):
+        """Test that the ASGI app enforces the byte limits configured for the Flask routes"""
+        from starlette.testclient import TestClient
+        from routes import analyze as analyze_routes
+        from asgi import app
+        
+        monkeypatch.setattr(analyze_routes, 'UPLOAD_MAX_BYTES', 1024)
+        client = TestClient(app)
+        
+        response = client.post('/ml/analyze/image', files={'image': ('big.png', b'x' * 4096, 'image/png')})
+        assert response.status_code == 413 and response.json()['error'] == 'Upload too large'
+        assert client.post('/ml/analyze/text', json={'text': 'hello'}).status_code == 200
+        
+        # Image batches have their own total cap, not one upload limit per file
+        monkeypatch.setattr(analyze_routes, 'UPLOAD_MAX_BYTES', 1 << 20)
+        monkeypatch.setattr(analyze_routes, 'IMAGE_BATCH_MAX_BYTES', 4096)
+        files = [('images', (f'{n}.png', b'x' * 1024, 'image/png')) for n in range(5)]
+        response = client.post('/ml/analyze/image/batch', files=files)
+        assert response.status_code == 413 and response.json()['error'] == 'Upload too large'
+    
+    def test_asgi_stream_matches_flask_splitting(self):
+        """Test that the ASGI stream splits chunked lines like the Flask route"""
+        import asyncio
+        import json
+        from services.streaming import aiter_lines
+        from starlette.testclient import TestClient
+        from asgi import app
+        
+        async def chunks():
+            for chunk in (b'{"id": 1, "te', b'xt": "hello"}\n\n{"id"', b': 2, "text": "world"}'):
+                yield chunk
+        
+        async def collect():
+            return [line async for line in aiter_lines(chunks(), max_line_bytes=64)]
+        
+        assert asyncio.run(collect()) == [b'{"id": 1, "text": "hello"}\n', b'{"id": 2, "text": "world"}']
+        
+        body = b'{"id": 1, "text": "hello"}\n{"id": 2, "text": "world"}\n'
+        response = TestClient(app).post('/ml/analyze/stream', content=body)
+        records = [json.loads(line) for line in response.text.splitlines()]
+        
+        assert [record['id'] for record in records] == [1, 2]
+        assert records[1]['result'] == dict(analyze_text_content('world'), fact_check_matches=[])
+    
+    def test_asgi_rejects_requests_over_concurrency_limit(self):
+        """Test that requests beyond the in-flight limit get 429"""
+        from starlette.testclient import TestClient
+        from asgi import ConcurrencyLimitMiddleware, starlette_app
+        
+        client = TestClient(ConcurrencyLimitMiddleware(starlette_app, limit=0))
+        
+        assert client.post('/ml/analyze/text', json={'text': 'hello'}).status_code == 429
+        assert client.get('/health').status_code == 200
+
+class TestRuleset:
+    """Tests for the data-driven scoring ruleset"""
+    
+    @pytest.fixture
+    def rules_file(self, tmp_path, monkeypatch):
+        """A copy of the default ruleset, active for the test; call save() after edits"""
+        import json
+        from models.ruleset import default_rules_path
+        
+        with open(default_rules_path()) as f:
+            data = json.load(f)
+        path = tmp_path / 'ruleset.json'
+        monkeypatch.setenv('ML_RULES_PATH', str(path))
+        
+        def save():
+            path.write_text(json.dumps(data))
+        
+        save()
+        yield data, save
+        monkeypatch.delenv('ML_RULES_PATH')
+        reload_ruleset()
+    
+    def test_reload_swaps_rules_and_keeps_pinned_ones(self, rules_file):
+        """Test that a reload changes scores for new calls but not pinned rules"""
+        data, save = rules_file
+        text = 'Miracle cure discovered!'
+        pinned = get_ruleset()
+        before = analyze_text_content(text)
+        
+        data['version'] = '9.9.9'
+        data['text']['penalties']['clickbait_per_keyword'] = 0
+        save()
+        previous, current = reload_ruleset()
+        
+        assert previous is pinned and current.version == '9.9.9'
+        assert analyze_text_content(text)['ruleset_version'] == '9.9.9'
+        assert analyze_text_content(text)['text_analysis_score'] == before['text_analysis_score'] + 20
+        assert analyze_text_content(text, pinned) == before
+    
+    def test_invalid_ruleset_is_rejected_and_current_rules_stay(self, rules_file):
+        """Test that a broken file neither swaps rules nor drops requests"""
+        from app import app
+        client = app.test_client()
+        data, save = rules_file
+        active = get_ruleset()
+        
+        data['image']['blur_penalty'] = 'ten'
+        save()
+        response = client.post('/ml/rules/reload')
+        
+        assert response.status_code == 422
+        assert get_ruleset() is active
+        with pytest.raises(RulesetError):
+            reload_ruleset()
+        
+        data['image']['blur_penalty'] = 10
+        data['version'] = '2.0.0'
+        save()
+        response = client.post('/ml/rules/reload')
+        result = client.post('/ml/analyze/text', json={'text': 'A ruleset reload probe'}).get_json()
+        
+        assert response.status_code == 200
+        assert response.get_json()['changed'] is True
+        assert result['ruleset_version'] == '2.0.0'
+
+class TestResultCache:
+    """Tests for the content-hash result cache"""
+    
+    def test_text_key_ignores_case_and_surrounding_whitespace(self):
+        """Test that equivalent texts share a cache key"""
+        assert text_cache_key('text', '1', '  Miracle CURE\n') == text_cache_key('text', '1', 'miracle cure')
+        assert text_cache_key('text', '1', 'cure') != text_cache_key('text', '2', 'cure')
+    
+    def test_memory_backend_evicts_least_recently_used(self):
+        """Test LRU eviction and hit/miss accounting"""
+        cache = ResultCache(MemoryCacheBackend(max_entries=2, max_bytes=1024), ttl=0)
+        cache.set('a', {'v': 1})
+        cache.set('b', {'v': 2})
+        assert cache.get('a') == {'v': 1}
+        cache.set('c', {'v': 3})
+        
+        assert cache.get('b') is None
+        assert cache.get('c') == {'v': 3}
+        stats = cache.stats()
+        assert stats['hits'] == 2
+        assert stats['misses'] == 1
+        assert stats['evictions'] == 1
+    
+    def test_disk_backend_round_trip_and_expiry(self, tmp_path):
+        """Test that the disk backend stores results and honours the TTL"""
+        backend = DiskCacheBackend(str(tmp_path / 'cache.sqlite3'), max_entries=10, max_bytes=1024)
+        cache = ResultCache(backend, ttl=60)
+        cache.set('k', {'score': 42})
+        assert cache.get('k') == {'score': 42}
+        
+        backend.set('old', '{}', expires_at=1.0)
+        assert cache.get('old') is None
+
+class TestSingleFlight:
+    """Tests for coalescing identical in-flight analyses"""
+    
+    def test_waiters_share_result_errors_and_time_out(self):
+        """Test one computation per key, copied results, shared errors and waiter timeouts"""
+        import threading
+        import time
+        from utils.single_flight import SingleFlight, CoalescingTimeoutError
+        
+        flight = SingleFlight(timeout=5)
+        release = threading.Event()
+        calls = []
+        
+        def compute(value):
+            calls.append(value)
+            release.wait(5)
+            if value == 'bad':
+                raise ValueError('broken input')
+            return {'value': value}
+        
+        def run(key, value, outcomes):
+            try:
+                outcomes.append(flight.do(key, compute, value))
+            except Exception as e:
+                outcomes.append(e)
+        
+        results, errors = [], []
+        threads = [threading.Thread(target=run, args=('good', 'good', results)) for _ in range(4)]
+        threads += [threading.Thread(target=run, args=('bad', 'bad', errors)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while flight.in_flight() < 2 or len(calls) < 2:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        assert sorted(calls) == ['bad', 'good']
+        assert results == [{'value': 'good'}] * 4
+        assert len({id(result) for result in results}) == 4
+        assert all(isinstance(e, ValueError) and str(e) == 'broken input' for e in errors)
+        assert flight.in_flight() == 0
+        
+        release.clear()
+        slow = threading.Thread(target=flight.do, args=('slow', compute, 'slow'))
+        slow.start()
+        while flight.in_flight() == 0:
+            time.sleep(0.01)
+        flight.timeout = 0.05
+        with pytest.raises(CoalescingTimeoutError):
+            flight.do('slow', compute, 'slow')
+        release.set()
+        slow.join()
+    
+    def test_concurrent_identical_images_are_analysed_once(self, monkeypatch):
+        """Test that simultaneous uploads of the same image share one analysis"""
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from services import analysis
+        
+        ocr_calls = []
+        
+        def slow_ocr(image):
+            ocr_calls.append(image)
+            time.sleep(0.2)
+            return 'coalesced text', 'full'
+        
+        monkeypatch.setattr(analysis, 'get_result_cache', lambda: None)
+        monkeypatch.setattr(analysis, 'extract_text_with_gate', slow_ocr)
+        buffer = io.BytesIO()
+        Image.new('RGB', (48, 48), color=(12, 34, 56)).save(buffer, format='PNG')
+        image_bytes = buffer.getvalue()
+        
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(analysis.analyze_image_bytes, [image_bytes] * 4))
+        
+        assert len(ocr_calls) == 1
+        assert all(result['ocr_text'] == 'coalesced text' for result in results)
+        assert len({id(result) for result in results}) == 4
+
+class TestJobs:
+    """Tests for the asynchronous job queue"""
+    
+    def test_store_orders_dedups_leases_and_expires(self, tmp_path):
+        """Test priorities, content dedup, lease recovery, attempt limits, retry backoff and expiry"""
+        import time
+        from utils.job_store import JobStore, JobQueueFullError
+        
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'), max_queued=3, result_ttl=60, lease=60, max_attempts=2)
+        low, _ = store.submit('image', 'key-low', {}, b'low', priority=1)
+        high, _ = store.submit('image', 'key-high', {}, b'high', priority=5)
+        again, created = store.submit('image', 'key-low', {}, b'low', priority=7,
+                                      callback_url='http://example.com/hook')
+        assert not created and again['job_id'] == low['job_id']
+        assert store.callbacks(low['job_id']) == ['http://example.com/hook']
+        store.submit('multi', 'key-multi', {'text': 'x'})
+        with pytest.raises(JobQueueFullError):
+            store.submit('image', 'key-other', {}, b'other')
+        
+        # Raised to priority 7 by the duplicate submission
+        claimed = store.claim()
+        assert claimed['job_id'] == low['job_id'] and claimed['payload'] == b'low'
+        claimed_high = store.claim()
+        assert claimed_high['job_id'] == high['job_id']
+        assert store.renew(low['job_id'], claimed['lease_owner'])
+        done = store.complete(low['job_id'], {'score': 1}, claimed['lease_owner'])
+        assert done['status'] == 'done' and done['result'] == {'score': 1}
+        assert store.submit('image', 'key-low', {}, b'low')[0]['result'] == {'score': 1}
+        
+        # A worker that died: its lease runs out and the job is claimed again, then given up
+        store.lease = 0
+        multi = store.claim()
+        assert multi['kind'] == 'multi' and multi['params'] == {'text': 'x'}
+        time.sleep(0.01)
+        takeover = store.claim()
+        assert takeover['job_id'] == multi['job_id']
+        # The first worker lost its lease: it can neither renew it nor record a result
+        assert not store.renew(multi['job_id'], multi['lease_owner'])
+        assert store.complete(multi['job_id'], {'score': 2}, multi['lease_owner']) is None
+        assert store.get(multi['job_id'])['status'] == 'running'
+        time.sleep(0.01)
+        assert store.claim() is None
+        abandoned = store.abandon_expired()
+        assert [job['job_id'] for job in abandoned] == [multi['job_id']]
+        assert abandoned[0]['status'] == 'failed'
+        assert store.get(multi['job_id'])['error'] == 'Job abandoned after 2 attempts'
+        assert store.abandon_expired() == []
+        
+        store.result_ttl = 0.01
+        store.fail(high['job_id'], 'boom', claimed_high['lease_owner'])
+        time.sleep(0.02)
+        assert store.get(high['job_id']) is None
+        assert store.purge_expired() == 1
+        
+        # A transient error puts the job back, but not before its backoff
+        store.lease, store.retry_backoff = 60, 0.05
+        retried, _ = store.submit('image', 'key-retry', {}, b'retry')
+        first_run = store.claim()
+        assert first_run['job_id'] == retried['job_id']
+        assert store.retry(retried['job_id'], 'OCR busy', first_run['lease_owner']) is None
+        assert store.claim() is None
+        time.sleep(0.06)
+        assert store.claim()['job_id'] == retried['job_id']
+    
+    def test_image_job_runs_in_background_and_dedups(self, tmp_path, monkeypatch):
+        """Test submit/poll through the routes and that resubmission returns the finished job"""
+        import time
+        from app import app
+        from services import jobs
+        from utils.job_store import JobStore
+        
+        monkeypatch.setattr(jobs, '_store', JobStore(str(tmp_path / 'jobs.sqlite3')))
+        jobs.start_job_workers()
+        client = app.test_client()
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 40), color=(90, 10, 200)).save(buffer, format='PNG')
+        
+        def submit(**fields):
+            data = {'image': (io.BytesIO(buffer.getvalue()), 'job.png'), **fields}
+            return client.post('/ml/jobs/image', data=data, content_type='multipart/form-data')
+        
+        response = submit(priority='3')
+        assert response.status_code == 202
+        job = response.get_json()
+        assert response.headers['Location'] == f"/ml/jobs/{job['job_id']}"
+        assert job['priority'] == 3 and job['deduplicated'] is False
+        
+        deadline = time.monotonic() + 10
+        while job['status'] in ('queued', 'running') and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = client.get(f"/ml/jobs/{job['job_id']}").get_json()
+        assert job['status'] == 'done'
+        assert 'visual_analysis_score' in job['result']
+        
+        repeat = submit()
+        assert repeat.status_code == 200
+        assert repeat.get_json()['job_id'] == job['job_id'] and repeat.get_json()['deduplicated']
+        assert submit(priority='high').status_code == 400
+        assert client.post('/ml/jobs/multi', json={'text': ''}).status_code == 400
+        assert client.get('/ml/jobs/unknown').status_code == 404
+
+class TestVideo:
+    """Tests for keyframe sampling and video analysis"""
+    
+    def test_gif_route_analyses_distinct_keyframes_in_order(self):
+        """Test that a GIF is scored from its distinct frames, repeats skipped"""
+        from app import app
+        
+        def frame(pattern):
+            pixels = np.zeros((64, 64, 3), dtype=np.uint8)
+            if pattern == 'vertical':
+                pixels[:, :32] = 255
+            elif pattern == 'horizontal':
+                pixels[:32, :] = 255
+            else:
+                pixels[:32, :32] = pixels[32:, 32:] = 255
+            return Image.fromarray(pixels)
+        
+        # The clip cuts back to its first scene, slightly altered
+        frames = [frame(pattern) for pattern in ('vertical', 'horizontal', 'checker', 'vertical')]
+        frames[3].putpixel((0, 63), (40, 40, 40))
+        buffer = io.BytesIO()
+        frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=1000, loop=0)
+        
+        client = app.test_client()
+        response = client.post('/ml/analyze/video', data={'video': (io.BytesIO(buffer.getvalue()), 'clip.gif')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+        result = response.get_json()
+        
+        stats = result['frame_stats']
+        assert stats['frames_decoded'] == 4
+        assert stats['keyframes'] == 3 and stats['duplicates_skipped'] == 1
+        assert [f['timestamp'] for f in result['frames']] == [0.0, 1.0, 2.0]
+        assert 0 <= result['visual_analysis_score'] <= 100
+        assert result['manipulation_prob'] == max(f['manipulation_prob'] for f in result['frames'])
+        
+        missing = client.post('/ml/analyze/video', data={}, content_type='multipart/form-data')
+        assert missing.status_code == 400
+    
+    def test_static_video_is_sampled_sparsely(self, tmp_path):
+        """Test that the sampling interval grows on a static clip, giving one keyframe"""
+        import cv2
+        from utils.frame_io import FrameSampler, iter_keyframes
+        
+        path = str(tmp_path / 'static.mp4')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 10, (64, 64))
+        still = np.zeros((64, 64, 3), dtype=np.uint8)
+        still[16:48, 16:48] = 200
+        for _ in range(200):
+            writer.write(still)
+        writer.release()
+        
+        sampler = FrameSampler(interval=1, max_interval=4)
+        keyframes = list(iter_keyframes(path, sampler))
+        
+        assert len(keyframes) == 1 and keyframes[0].index == 0
+        assert sampler.stats['frames_decoded'] == 200
+        # 0, 1, 3, 7, 11, 15, 19 s and the last frame
+        assert sampler.stats['frames_sampled'] <= 8
+
+class TestNearDuplicateIndex:
+    """Tests for near-duplicate verdict reuse"""
+    
+    def test_reworded_post_reuses_verdict(self):
+        """Test that punctuation, hashtag and emoji edits reuse the first verdict"""
+        from app import app
+        client = app.test_client()
+        original = ('Shocking news: doctors hate this miracle cure that heals every patient '
+                    'in three days, share before it gets deleted by the government')
+        reworded = ('SHOCKING news!!! Doctors hate this #miracle cure that heals every patient '
+                    'in three days... share before it gets deleted by the government \U0001F631')
+        
+        first = client.post('/ml/analyze/text', json={'text': original}).get_json()
+        second = client.post('/ml/analyze/text', json={'text': reworded}).get_json()
+        unrelated = client.post('/ml/analyze/text', json={
+            'text': 'The city council approved the new library budget after a long public hearing'
+        }).get_json()
+        
+        assert 'near_duplicate' not in first
+        assert second['near_duplicate']['similarity'] >= 0.8
+        assert second['text_analysis_score'] == first['text_analysis_score']
+        assert 'near_duplicate' not in unrelated
+    
+    def test_eviction_namespaces_and_persistence(self, tmp_path):
+        """Test LRU eviction, per-ruleset namespaces and a save/load round trip"""
+        from utils.near_duplicate import NearDuplicateIndex
+        
+        index = NearDuplicateIndex(max_entries=2)
+        texts = [f'post number {n} about the {word} vaccine rollout in the region'
+                 for n, word in ((1, 'first'), (2, 'second'), (3, 'third'))]
+        for n, text in enumerate(texts):
+            index.add(index.signature(text), 'v1', {'score': n})
+        
+        assert len(index) == 2 and index.stats()['evictions'] == 1
+        assert index.query(index.signature(texts[0]), 'v1') is None
+        assert index.query(index.signature(texts[2]), 'v1') == ({'score': 2}, 1.0)
+        assert index.query(index.signature(texts[2]), 'v2') is None
+        
+        assert index.save(str(tmp_path)) is True
+        assert index.save(str(tmp_path)) is False
+        restored = NearDuplicateIndex(max_entries=2)
+        assert restored.load(str(tmp_path)) == 2
+        assert restored.query(restored.signature(texts[1]), 'v1') == ({'score': 1}, 1.0)
+
+class TestClaimIndex:
+    """Tests for fact-check claim matching"""
+    
+    def test_search_ranks_claims_and_rebuilds_on_change(self, tmp_path, monkeypatch):
+        """Test top-k cosine search, reloading from disk and corpus updates"""
+        import json
+        import threading
+        from utils.claim_index import ClaimIndex
+        
+        corpus = tmp_path / 'claims.jsonl'
+        records = [
+            {'id': 'a', 'claim': '5G networks spread the coronavirus', 'rating': 'False'},
+            {'id': 'b', 'claim': 'Garlic prevents coronavirus infection', 'rating': 'False'},
+            {'id': 'c', 'claim': 'The city library opens on Sundays', 'rating': 'True'},
+        ]
+        corpus.write_text(''.join(json.dumps(record) + '\n' for record in records))
+        index = ClaimIndex(str(corpus), str(tmp_path / 'index'))
+        
+        matches = index.search('Breaking: 5G networks spread the coronavirus!!', top_k=2, min_score=0.0)
+        assert [match['id'] for match in matches] == ['a', 'b']
+        assert matches[0]['score'] > 0.7 > matches[1]['score']
+        assert index.search('Weather is sunny today') == []
+        
+        reloaded = ClaimIndex(str(corpus), str(tmp_path / 'index'))
+        assert reloaded.refresh_if_changed() is False
+        assert reloaded.search_many(['garlic prevents infection', 'library opens sundays']) == [
+            [dict(records[1], score=pytest.approx(reloaded.search('garlic prevents infection')[0]['score']))],
+            [dict(records[2], score=pytest.approx(reloaded.search('library opens sundays')[0]['score']))],
+        ]
+        
+        with open(corpus, 'a') as f:
+            f.write(json.dumps({'id': 'd', 'claim': 'Sunny weather is expected today'}) + '\n')
+        
+        # Searches keep using the old snapshot while the rebuild runs in the background
+        release = threading.Event()
+        build = reloaded._build
+        monkeypatch.setattr(reloaded, '_build', lambda *args: release.wait(5) and build(*args))
+        assert reloaded.search('Weather is sunny today') == []
+        release.set()
+        reloaded.refresh_if_changed()
+        assert reloaded.search('Weather is sunny today')[0]['id'] == 'd'
+    
+    def test_search_reads_snapshot_records_after_corpus_rewrite(self, tmp_path, monkeypatch):
+        """Test matches come from the indexed records, not the rewritten corpus"""
+        import json
+        import threading
+        from utils.claim_index import ClaimIndex
+        
+        corpus = tmp_path / 'claims.jsonl'
+        records = [
+            {'id': 'a', 'claim': '5G networks spread the coronavirus', 'rating': 'False'},
+            {'id': 'b', 'claim': 'Garlic prevents coronavirus infection', 'rating': 'False'},
+        ]
+        corpus.write_text(''.join(json.dumps(record) + '\n' for record in records))
+        index = ClaimIndex(str(corpus), str(tmp_path / 'index'))
+        assert index.refresh_if_changed() is True
+        
+        # Prepending shifts every line; the rebuild is held back so searches use the old snapshot
+        corpus.write_text(json.dumps({'id': 'new', 'claim': 'A much longer prepended claim ' * 4}) + '\n'
+                          + '{not json\n' + ''.join(json.dumps(record) + '\n' for record in records))
+        release = threading.Event()
+        build = index._build
+        monkeypatch.setattr(index, '_build', lambda *args: release.wait(5) and build(*args))
+        
+        assert index.search('garlic prevents infection')[0]['id'] == 'b'
+        assert index.search('5G networks spread the coronavirus')[0] == dict(records[0], score=pytest.approx(1.0))
+        release.set()
+        index.refresh_if_changed()
+        assert index.search('A much longer prepended claim')[0]['id'] == 'new'
+        assert index.search('garlic prevents infection')[0]['id'] == 'b'
+    
+    def test_text_batch_and_multi_responses_include_matches(self):
+        """Test fact_check_matches in the text, batch and multi responses"""
+        from app import app
+        client = app.test_client()
+        text = 'SHARE NOW: vaccines cause autism in children, doctors admit'
+        
+        single = client.post('/ml/analyze/text', json={'text': text}).get_json()
+        batch = client.post('/ml/analyze/text/batch', json={'texts': [text, 'Nice weather']}).get_json()
+        multi = client.post('/ml/analyze/multi', json={'text': text}).get_json()
+        
+        assert single['fact_check_matches'][0]['id'] == 'fc-0004'
+        assert single['fact_check_matches'][0]['rating'] == 'False'
+        assert batch['results'][0]['fact_check_matches'] == single['fact_check_matches']
+        assert batch['results'][1]['fact_check_matches'] == []
+        assert multi['fact_check_matches'] == single['fact_check_matches']
+
+class TestImageFetcher:
+    """Tests for downloading image_path URLs"""
+    
+    @pytest.fixture
+    def image_server(self):
+        """Local HTTP server with an ETag-tagged PNG, an HTML page, a large and a slow image"""
+        import threading
+        import time
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), color='purple').save(buffer, format='PNG')
+        png = buffer.getvalue()
+        requests_seen = []
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests_seen.append((self.path, self.headers.get('If-None-Match')))
+                if self.path == '/page.html':
+                    body, content_type = b'<html></html>', 'text/html'
+                elif self.path == '/large.png':
+                    body, content_type = png * 10, 'image/png'
+                elif self.path == '/slow.png':
+                    # A byte at a time, each well within the read timeout
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/png')
+                    self.send_header('Content-Length', str(len(png)))
+                    self.end_headers()
+                    try:
+                        for byte in png:
+                            self.wfile.write(bytes([byte]))
+                            self.wfile.flush()
+                            time.sleep(0.02)
+                    except OSError:
+                        pass
+                    return
+                else:
+                    if self.headers.get('If-None-Match') == '"v1"':
+                        self.send_response(304)
+                        self.end_headers()
+                        return
+                    body, content_type = png, 'image/png'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', '"v1"')
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield f'http://127.0.0.1:{server.server_address[1]}', png, requests_seen
+        server.shutdown()
+        server.server_close()
+    
+    def test_download_is_cached_and_revalidated(self, image_server, tmp_path):
+        """Test that a URL is downloaded once, then reused and revalidated via ETag"""
+        from utils.image_fetch import ImageFetcher
+        base, png, requests_seen = image_server
+        fetcher = ImageFetcher(cache_dir=str(tmp_path), cache_ttl=60)
+        
+        assert fetcher.fetch(f'{base}/photo.png') == png
+        assert fetcher.fetch(f'{base}/photo.png') == png
+        assert requests_seen == [('/photo.png', None)]
+        
+        fetcher.cache_ttl = 0
+        assert fetcher.fetch(f'{base}/photo.png') == png
+        assert requests_seen[-1] == ('/photo.png', '"v1"')
+        assert fetcher.stats()['downloads'] == 1
+        assert fetcher.stats()['revalidations'] == 1
+        assert len(os.listdir(tmp_path / 'blobs')) == 1
+        assert fetcher._url_locks == {}
+    
+    def test_download_has_an_overall_deadline(self, image_server):
+        """Test that a server trickling bytes is cut off at the total timeout"""
+        import time
+        from utils.image_fetch import ImageFetcher, ImageFetchError
+        base, _, _ = image_server
+        fetcher = ImageFetcher(timeout=5, total_timeout=0.3)
+        
+        started = time.monotonic()
+        with pytest.raises(ImageFetchError, match='longer than'):
+            fetcher.fetch(f'{base}/slow.png')
+        assert time.monotonic() - started < 2
+    
+    def test_multi_route_fetches_url_and_rejects_bad_content(self, image_server, tmp_path, monkeypatch):
+        """Test URL images in /ml/analyze/multi and the content-type and size checks"""
+        from app import app
+        from utils import image_fetch
+        base, png, _ = image_server
+        monkeypatch.setattr(image_fetch, '_fetcher', image_fetch.ImageFetcher(
+            max_bytes=len(png) * 2, cache_dir=str(tmp_path)))
+        client = app.test_client()
+        
+        response = client.post('/ml/analyze/multi', json={'text': 'Look at this', 'image_path': f'{base}/photo.png'})
+        assert response.status_code == 200
+        assert response.get_json()['visual_analysis_score'] is not None
+        
+        response = client.post('/ml/analyze/multi', json={'image_path': f'{base}/page.html'})
+        assert response.status_code == 415
+        response = client.post('/ml/analyze/multi', json={'image_path': f'{base}/large.png'})
+        assert response.status_code == 413
+
+class TestHashIndex:
+    """Tests for the perceptual hash index used by reverse search"""
+    
+    def test_index_finds_closest_sample_and_tracks_removals(self, tmp_path):
+        """Test top-k lookup by distance and incremental refresh"""
+        rng = np.random.default_rng(0)
+        for i in range(5):
+            pixels = (rng.random((16, 16, 3)) * 255).astype('uint8')
+            Image.fromarray(pixels).resize((64, 64)).save(tmp_path / f'sample{i}.png')
+        
+        index = ImageHashIndex(str(tmp_path), str(tmp_path / 'index'))
+        query_hash = compute_average_hash(Image.open(tmp_path / 'sample2.png'))
+        
+        assert index.query(query_hash, max_distance=9, top_k=3)[0] == ('sample2.png', 0)
+        assert len(index) == 5
+        
+        # A fresh instance reuses the persisted index; removals are picked up
+        (tmp_path / 'sample2.png').unlink()
+        reloaded = ImageHashIndex(str(tmp_path), str(tmp_path / 'index'))
+        assert len(reloaded) == 5
+        assert reloaded.query(query_hash, max_distance=9, top_k=3) == []
+        assert len(reloaded) == 4
+    
+    def test_index_picks_up_files_overwritten_in_place(self, tmp_path):
+        """Test that the periodic rescan re-hashes a sample modified without a directory change"""
+        rng = np.random.default_rng(1)
+        samples = tmp_path / 'samples'
+        samples.mkdir()
+        sample = samples / 'sample.png'
+        old_pixels, new_pixels = ((rng.random((16, 16, 3)) * 255).astype('uint8') for _ in range(2))
+        Image.fromarray(old_pixels).resize((64, 64)).save(sample)
+        
+        index = ImageHashIndex(str(samples), str(tmp_path / 'index'), rescan_interval=3600)
+        old_hash = compute_average_hash(Image.open(sample))
+        assert index.query(old_hash, max_distance=0) == [('sample.png', 0)]
+        
+        # Rewritten through the same inode: the directory mtime stays as it was
+        dir_mtime_ns = os.stat(samples).st_mtime_ns
+        with open(sample, 'r+b') as f:
+            buffer = io.BytesIO()
+            Image.fromarray(new_pixels).resize((64, 64)).save(buffer, format='PNG')
+            f.write(buffer.getvalue())
+            f.truncate()
+        os.utime(samples, ns=(dir_mtime_ns, dir_mtime_ns))
+        new_hash = compute_average_hash(Image.open(sample))
+        assert new_hash != old_hash
+        
+        assert index.query(new_hash, max_distance=0) == []
+        index.rescan_interval = 0
+        assert index.query(new_hash, max_distance=0) == [('sample.png', 0)]
+        assert index.query(old_hash, max_distance=0) == []
+
 class TestOCR:
     """Tests for OCR functionality"""
     
@@ -100,6 +1153,173 @@ class TestOCR:
             assert isinstance(text, str)
         finally:
             os.unlink(image_path)
+    
+    def test_preprocess_for_ocr_resizes_and_binarizes(self):
+        """Test OCR preprocessing options"""
+        pixels = (np.random.default_rng(3).random((300, 600, 3)) * 255).astype('uint8')
+        image = DecodedImage(pixels)
+        
+        binary = preprocess_for_ocr(image, max_side=200, binarize=True)
+        
+        assert binary.shape == (100, 200)
+        assert set(np.unique(binary)) <= {0, 255}
+        assert preprocess_for_ocr(image, grayscale=True).shape == (300, 600)
+        # Colour by default, as OCR input was before preprocessing was configurable
+        assert preprocess_for_ocr(image).shape == (300, 600, 3)
+    
+    def test_text_gate_skips_photos_and_crops_text_regions(self, monkeypatch):
+        """Test that OCR is skipped without text and limited to text regions"""
+        import cv2
+        from utils import ocr_stub
+        
+        read = []
+        monkeypatch.setattr(ocr_stub, 'extract_text_from_image',
+                            lambda image: read.append(image.bgr.shape[:2]) or 'text')
+        
+        # Smooth gradient photo: no strokes, OCR never runs
+        photo = np.zeros((480, 640, 3), dtype=np.uint8)
+        photo[:] = np.linspace(30, 220, 640, dtype=np.uint8)[None, :, None]
+        assert ocr_stub.extract_text_with_gate(DecodedImage(photo)) == ('', 'skipped')
+        assert read == []
+        
+        # A caption line: OCR reads a crop around it only
+        cv2.putText(photo, 'Share before it is deleted', (40, 420), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0, (255, 255, 255), 2)
+        assert ocr_stub.extract_text_with_gate(DecodedImage(photo)) == ('text', 'cropped')
+        assert len(read) == 1 and read[0][0] < 100 and read[0][1] < 640
+        
+        # A second caption: both crops are stacked and read in a single call
+        cv2.putText(photo, 'Doctors hate this', (300, 60), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0, (255, 255, 255), 2)
+        assert ocr_stub.extract_text_with_gate(DecodedImage(photo)) == ('text', 'cropped')
+        assert len(read) == 2 and read[1][0] < 240 and read[1][1] < 640
+        
+        # A page of text: one full-image pass
+        page = np.full((800, 600, 3), 255, dtype=np.uint8)
+        for line in range(15):
+            cv2.putText(page, 'Lorem ipsum dolor sit amet', (20, 40 + line * 45),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+        assert ocr_stub.extract_text_with_gate(DecodedImage(page)) == ('text', 'full')
+        assert read[-1] == (800, 600)
+        
+        regions = [(40, 390, 420, 40), (300, 30, 260, 40)]
+        strip = ocr_stub.stack_regions(photo, regions)
+        assert strip.shape == (40 + ocr_stub.CROP_GAP + 40, 420, 3)
+        assert np.array_equal(strip[:40], photo[390:430, 40:460])
+        assert np.array_equal(strip[-40:, :260], photo[30:70, 300:560])
+    
+    def test_ocr_pool_applies_backpressure(self):
+        """Test that a full OCR queue rejects new jobs immediately"""
+        pool = OCRPool(workers=1, max_pending=0, job_timeout=30)
+        try:
+            pool._slots.acquire()
+            with pytest.raises(OCRBusyError):
+                pool.run(np.zeros((10, 10), dtype=np.uint8))
+        finally:
+            pool._slots.release()
+            pool.shutdown()
+    
+    def test_ocr_worker_job_enforces_its_timeout(self, monkeypatch):
+        """Test that a worker passes the job timeout to the engine instead of hanging"""
+        import pytesseract
+        from utils import ocr_pool
+        
+        calls = []
+        monkeypatch.setattr(ocr_pool, '_worker_api', None)
+        monkeypatch.setattr(pytesseract, 'image_to_string', lambda img, **kwargs: calls.append(kwargs) or 'text')
+        assert ocr_pool._ocr_job(np.zeros((10, 10), dtype=np.uint8), 2.5) == 'text'
+        assert calls[0]['timeout'] == 2.5
+        
+        def hang(img, **kwargs):
+            raise RuntimeError('Tesseract process timeout')
+        monkeypatch.setattr(pytesseract, 'image_to_string', hang)
+        with pytest.raises(ocr_pool._WorkerTimeoutError):
+            ocr_pool._ocr_job(np.zeros((10, 10), dtype=np.uint8), 0.1)
+    
+    def test_ocr_pool_reports_worker_timeout_as_504(self, monkeypatch):
+        """Test that a job timed out in its worker raises OCRTimeoutError, not an OCR failure"""
+        from concurrent.futures import Future
+        from utils import ocr_pool
+        
+        class Executor:
+            def submit(self, fn, pixels, timeout):
+                future = Future()
+                future.set_exception(ocr_pool._WorkerTimeoutError('Tesseract process timeout'))
+                return future
+        
+        pool = OCRPool(workers=1, max_pending=0, job_timeout=30)
+        pool.shutdown()
+        monkeypatch.setattr(pool, '_executor', Executor())
+        with pytest.raises(ocr_pool.OCRTimeoutError) as excinfo:
+            pool.run(np.zeros((10, 10), dtype=np.uint8))
+        assert excinfo.value.status_code == 504
+
+class TestBatchScorer:
+    """Tests for the offline batch scorer"""
+    
+    def test_interrupted_run_resumes_without_gaps_or_duplicates(self, tmp_path):
+        """Test that a resumed run continues exactly where the checkpoint stopped"""
+        import json
+        import score
+        
+        texts = tmp_path / 'texts.jsonl'
+        texts.write_text(''.join(json.dumps({'id': i, 'text': f'Miracle cure number {i}'}) + '\n'
+                                 for i in range(7)))
+        images = tmp_path / 'images'
+        images.mkdir()
+        Image.new('RGB', (40, 40), color='red').save(images / 'a.png')
+        output = tmp_path / 'scores.jsonl'
+        
+        first = score.run(str(texts), str(images), str(output), workers=1,
+                          batch_size=2, image_batch_size=1, max_items=3)
+        # Simulate a crash after the checkpoint: a partial line must be discarded
+        with open(output, 'ab') as f:
+            f.write(b'{"id": "partial')
+        second = score.run(str(texts), str(images), str(output), workers=1,
+                           batch_size=2, image_batch_size=1)
+        records = [json.loads(line) for line in output.read_text().splitlines()]
+        
+        assert first['complete'] is False and second['complete'] is True
+        assert [record['id'] for record in records] == [0, 1, 2, 3, 4, 5, 6, 'a.png']
+        assert records[3]['result'] == dict(analyze_text_content('Miracle cure number 3'), fact_check_matches=[])
+        assert records[-1]['kind'] == 'image'
+
+class TestBenchmarks:
+    """Tests for the benchmark suite"""
+    
+    def test_corpus_is_deterministic(self):
+        """Test that the synthetic corpus is identical between runs"""
+        from benchmarks.corpus import IMAGE_SIZES, image_corpus, text_corpus
+        
+        assert text_corpus() == text_corpus()
+        assert image_corpus(IMAGE_SIZES[:1]) == image_corpus(IMAGE_SIZES[:1])
+    
+    def test_single_pass_reference_counts_like_the_keyword_matcher(self):
+        """Test that the benchmarked single-pass regex gives the matcher's counts"""
+        from benchmarks.corpus import text_corpus
+        from benchmarks.run import single_pass_keyword_counter
+        
+        matcher = KeywordMatcher({'a': ['cure', 'secure', 'all', 'act now'], 'b': ['cure', 'sun', 'sunny']})
+        single_pass = single_pass_keyword_counter(matcher)
+        for text in ['secure and sunny, act now!', 'small act\nnow', '']:
+            assert single_pass(text) == matcher.count(text)
+        
+        matcher = get_ruleset().keyword_matcher
+        single_pass = single_pass_keyword_counter(matcher)
+        for text in text_corpus()['short_post'][:50]:
+            assert single_pass(text.lower()) == matcher.count(text.lower())
+    
+    def test_compare_flags_regressions(self):
+        """Test that median slowdowns above the threshold are reported"""
+        from benchmarks.run import compare
+        
+        baseline = {'results': {'fast': {'median_ms': 10.0}, 'slow': {'median_ms': 10.0}}}
+        current = {'results': {'fast': {'median_ms': 10.5}, 'slow': {'median_ms': 12.0}, 'new': {'median_ms': 1.0}}}
+        
+        regressions = compare(current, baseline, threshold=0.10)
+        
+        assert len(regressions) == 1
+        assert regressions[0].startswith('slow:')
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -0,0 +1,364 @@
+"""
+Fact-Check Claim Index
+Sparse TF-IDF index of fact-checked claims for matching incoming text
+
+Claims are read from a JSONL corpus (one {"id", "claim", "rating", ...}
+record per line). Each claim becomes an L2-normalised TF-IDF vector over
+hashed word unigrams and bigrams (no vocabulary to store or grow), and the
+vectors are stored term-major as a CSR matrix, i.e. an inverted index.
+Scoring a batch of texts is one sparse matrix product that only touches the
+posting lists of the terms they contain, followed by a top-k selection, so
+searches take milliseconds on a CPU even for hundreds of thousands of
+claims.
+
+The matrix, IDF weights and record offsets are saved as .npy files and
+memory-mapped at load time. Each generation also keeps its own copy of the
+indexed corpus records, which matches are read back from by offset, so a
+snapshot never depends on the live corpus file (which may already have been
+rewritten while a rebuild is under way). When the corpus file changes, searches start a rebuild
+on a background thread and keep using the current snapshot until the new
+one is swapped in.
+
+Usage (prebuild or refresh the index):
+    python -m utils.claim_index [claims.jsonl]
+
+Configuration (environment variables):
+- ML_CLAIMS_PATH: fact-check corpus (default: claims/fact_checks.jsonl)
+- ML_CLAIM_INDEX_DIR: index location (default: <corpus dir>/.claim_index)
+- ML_CLAIM_TOP_K: maximum matches returned per text (default: 3)
+- ML_CLAIM_MIN_SCORE: minimum cosine similarity of a match (default: 0.25)
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import uuid
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+INDEX_FORMAT_VERSION = 2
+FEATURE_BITS = 20
+FEATURE_COUNT = 1 << FEATURE_BITS
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Frequent function words carry no evidence and have the longest posting lists
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'been', 'but', 'by', 'can', 'could', 'did',
+    'do', 'does', 'for', 'from', 'had', 'has', 'have', 'he', 'her', 'his', 'i', 'if', 'in',
+    'is', 'it', 'its', 'just', 'of', 'on', 'or', 'our', 'she', 'so', 'than', 'that', 'the',
+    'their', 'them', 'then', 'there', 'these', 'they', 'this', 'those', 'to', 'was', 'we',
+    'were', 'will', 'with', 'would', 'you', 'your',
+))
+
+def term_features(text: str) -> np.ndarray:
+    """Hashed feature ids of a text's word unigrams and bigrams (with repeats)"""
+    tokens = [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+    terms = tokens + [f'{first} {second}' for first, second in zip(tokens, tokens[1:])]
+    return np.fromiter((zlib.crc32(term.encode('utf-8')) & (FEATURE_COUNT - 1) for term in terms),
+                       dtype=np.int64, count=len(terms))
+
+def vectorize(texts: List[str], idf: np.ndarray):
+    """
+    L2-normalised TF-IDF rows (sublinear term frequency) for a list of texts
+
+    Returns:
+        scipy.sparse CSR matrix of shape (len(texts), FEATURE_COUNT)
+    """
+    return _vectors([term_features(text) for text in texts], idf)
+
+def _vectors(rows: List[np.ndarray], idf: np.ndarray):
+    from scipy import sparse
+
+    indptr = [0]
+    indices = []
+    values = []
+    for features in rows:
+        features, counts = np.unique(features, return_counts=True)
+        weights = (1.0 + np.log(counts)) * idf[features]
+        norm = np.sqrt(np.dot(weights, weights))
+        if norm > 0:
+            indices.append(features)
+            values.append(weights / norm)
+            indptr.append(indptr[-1] + len(features))
+        else:
+            indptr.append(indptr[-1])
+
+    return sparse.csr_matrix((
+        np.concatenate(values).astype(np.float32) if values else np.zeros(0, dtype=np.float32),
+        np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64),
+        np.array(indptr, dtype=np.int64),
+    ), shape=(len(rows), FEATURE_COUNT))
+
+class _Snapshot:
+    """
+    Immutable view of one index generation
+
+    records_fd is an open descriptor of the generation's records file: it
+    stays readable after a newer generation has unlinked the file, until the
+    snapshot is dropped. offsets holds one entry per claim plus the end of
+    the last record.
+    """
+
+    def __init__(self, source: Optional[Tuple[int, int]], offsets: np.ndarray,
+                 idf: np.ndarray, postings, records_fd: Optional[int] = None):
+        self.source = source
+        self.offsets = offsets
+        self.idf = idf
+        self.postings = postings
+        self.records_fd = records_fd
+
+    def __len__(self):
+        return max(len(self.offsets) - 1, 0)
+
+    def record(self, row: int) -> Dict:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(os.pread(self.records_fd, end - start, start))
+
+    def __del__(self):
+        if self.records_fd is not None:
+            os.close(self.records_fd)
+
+class ClaimIndex:
+    """
+    Cosine-similarity search over a corpus of fact-checked claims
+    """
+
+    def __init__(self, corpus_path: str, index_dir: Optional[str] = None):
+        self.corpus_path = corpus_path
+        self.index_dir = index_dir or os.path.join(os.path.dirname(corpus_path) or '.', '.claim_index')
+        # Serialises rebuilds; searches read self._snapshot without locking
+        self._lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._refresh_thread_lock = threading.Lock()
+        self._snapshot = self._empty()
+        self._load()
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    @staticmethod
+    def _empty() -> _Snapshot:
+        from scipy import sparse
+
+        return _Snapshot(None, np.zeros(1, dtype=np.int64), np.ones(FEATURE_COUNT, dtype=np.float32),
+                         sparse.csr_matrix((FEATURE_COUNT, 0), dtype=np.float32))
+
+    def search(self, text: str, top_k: int = 3, min_score: float = 0.25) -> List[Dict]:
+        """Matches for a single text (see search_many)"""
+        return self.search_many([text], top_k, min_score)[0]
+
+    def search_many(self, texts: List[str], top_k: int = 3, min_score: float = 0.25) -> List[List[Dict]]:
+        """
+        Find the fact-checked claims most similar to each text
+
+        Args:
+            texts: Texts to match, scored together in one sparse product
+            top_k: Maximum matches per text
+            min_score: Minimum cosine similarity (0-1)
+
+        Returns:
+            Per text, up to top_k corpus records with an added "score",
+            best match first
+        """
+        self.refresh_if_changed(background=True)
+        snapshot = self._snapshot
+        if len(snapshot) == 0 or not texts:
+            return [[] for _ in texts]
+
+        scores = (vectorize(texts, snapshot.idf) @ snapshot.postings).tocsr()
+        hits = []
+        for row in range(len(texts)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            claims, values = scores.indices[start:end], scores.data[start:end]
+            keep = values >= min_score
+            claims, values = claims[keep], values[keep]
+            if len(values) > top_k:
+                best = np.argpartition(-values, top_k - 1)[:top_k]
+                claims, values = claims[best], values[best]
+            order = np.lexsort((claims, -values))
+            hits.append([(int(claims[i]), float(values[i])) for i in order])
+
+        records = self._records(snapshot, {claim for text_hits in hits for claim, _ in text_hits})
+        return [[dict(records[claim], score=round(min(score, 1.0), 4)) for claim, score in text_hits]
+                for text_hits in hits]
+
+    @staticmethod
+    def _records(snapshot: _Snapshot, rows) -> Dict[int, Dict]:
+        """Records of matched claims, from the snapshot's own copy of the corpus"""
+        return {row: snapshot.record(row) for row in sorted(rows)}
+
+    def _source_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.corpus_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def refresh_if_changed(self, background: bool = False) -> bool:
+        """
+        Rebuild when the corpus file changed since the index was built
+
+        Args:
+            background: Rebuild on a background thread and return at once;
+                the current snapshot is served until the new one is ready.
+                An index that was never built is still built in the caller,
+                as there is nothing to serve meanwhile.
+
+        Returns:
+            True if the index changed or a background rebuild is under way
+        """
+        if self._source_stat() == self._snapshot.source:
+            return False
+        if not background or self._snapshot.source is None:
+            return self.refresh()
+        with self._refresh_thread_lock:
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(
+                    target=self._refresh_in_background, name='claim-index-refresh', daemon=True)
+                self._refresh_thread.start()
+        return True
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f'Warning: claim index rebuild failed: {e}')
+
+    def refresh(self) -> bool:
+        """
+        Rebuild the index from the corpus file
+
+        Returns:
+            True if the index changed
+        """
+        with self._lock:
+            source = self._source_stat()
+            if source == self._snapshot.source:
+                return False
+            if source is None:
+                self._snapshot = self._empty()
+                return True
+            generation = uuid.uuid4().hex[:12]
+            snapshot = self._build(source, generation)
+            # Swapped in whole; searches in progress keep the snapshot they started with
+            self._snapshot = snapshot
+            self._save(snapshot, generation)
+            return True
+
+    def _build(self, source: Tuple[int, int], generation: str) -> _Snapshot:
+        """Index the corpus, copying the indexed records into the generation's records file"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        records_path = os.path.join(self.index_dir, f'records-{generation}.jsonl')
+        offsets = [0]
+        features = []
+        with open(self.corpus_path, 'rb') as f, open(records_path, 'wb') as records:
+            for line in f:
+                try:
+                    claim = json.loads(line).get('claim')
+                except (ValueError, AttributeError):
+                    claim = None
+                if isinstance(claim, str) and claim.strip():
+                    records.write(line.rstrip(b'\r\n') + b'\n')
+                    offsets.append(records.tell())
+                    features.append(term_features(claim))
+
+        # Smoothed IDF over claims containing each feature
+        document_frequency = np.zeros(FEATURE_COUNT, dtype=np.int64)
+        for claim_features in features:
+            document_frequency[np.unique(claim_features)] += 1
+        idf = (np.log((1.0 + len(features)) / (1.0 + document_frequency)) + 1.0).astype(np.float32)
+
+        # Weighted exactly like queries, then stored term-major
+        postings = _vectors(features, idf).T.tocsr()
+        postings.sort_indices()
+        return _Snapshot(source, np.array(offsets, dtype=np.int64), idf, postings,
+                         os.open(records_path, os.O_RDONLY))
+
+    def _save(self, snapshot: _Snapshot, generation: str):
+        """Write the generation's index files next to its records, then switch the manifest"""
+        for part, array in (('offsets', snapshot.offsets), ('idf', snapshot.idf),
+                            ('data', snapshot.postings.data), ('indices', snapshot.postings.indices),
+                            ('indptr', snapshot.postings.indptr)):
+            np.save(os.path.join(self.index_dir, f'{part}-{generation}.npy'), array)
+
+        manifest_path = os.path.join(self.index_dir, 'manifest.json')
+        tmp_path = f'{manifest_path}.{generation}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'format': INDEX_FORMAT_VERSION,
+                'generation': generation,
+                'feature_bits': FEATURE_BITS,
+                'source': list(snapshot.source),
+                'claims': len(snapshot),
+            }, f)
+        os.replace(tmp_path, manifest_path)
+
+        # Old generations stay readable by existing memory maps and descriptors until closed
+        for filename in os.listdir(self.index_dir):
+            if filename.endswith(('.npy', '.jsonl')) and generation not in filename:
+                try:
+                    os.unlink(os.path.join(self.index_dir, filename))
+                except OSError:
+                    pass
+
+    def _load(self):
+        from scipy import sparse
+
+        manifest_path = os.path.join(self.index_dir, 'manifest.json')
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('format') != INDEX_FORMAT_VERSION or manifest.get('feature_bits') != FEATURE_BITS:
+                return
+            generation = manifest['generation']
+
+            def load(part):
+                path = os.path.join(self.index_dir, f'{part}-{generation}.npy')
+                return np.load(path, mmap_mode='r')
+
+            offsets = load('offsets')
+            postings = sparse.csr_matrix((load('data'), load('indices'), load('indptr')),
+                                         shape=(FEATURE_COUNT, len(offsets) - 1), copy=False)
+            records_fd = os.open(os.path.join(self.index_dir, f'records-{generation}.jsonl'), os.O_RDONLY)
+            self._snapshot = _Snapshot(tuple(manifest['source']), offsets, load('idf'), postings, records_fd)
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing or unreadable index: the first search rebuilds it
+            pass
+
+_index: Optional[ClaimIndex] = None
+_index_lock = threading.Lock()
+
+def default_claims_path() -> str:
+    return os.environ.get(
+        'ML_CLAIMS_PATH',
+        os.path.join(os.path.dirname(__file__), '..', 'claims', 'fact_checks.jsonl'),
+    )
+
+def get_claim_index() -> ClaimIndex:
+    """Get the process-wide index over the configured fact-check corpus"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ClaimIndex(default_claims_path(), os.environ.get('ML_CLAIM_INDEX_DIR'))
+    return _index
+
+def match_claims(texts: List[str]) -> List[List[Dict]]:
+    """Fact-check matches for several texts with the configured limits"""
+    return get_claim_index().search_many(
+        texts,
+        top_k=int(os.environ.get('ML_CLAIM_TOP_K', '3')),
+        min_score=float(os.environ.get('ML_CLAIM_MIN_SCORE', '0.25')),
+    )
+
+if __name__ == '__main__':
+    claims_path = sys.argv[1] if len(sys.argv) > 1 else default_claims_path()
+    index = ClaimIndex(claims_path, os.environ.get('ML_CLAIM_INDEX_DIR'))
+    changed = index.refresh_if_changed()
+    print(f'{len(index)} claim(s) indexed in {index.index_dir}'
+          f' ({"updated" if changed else "up to date"})')
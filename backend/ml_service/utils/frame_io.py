@@ -0,0 +1,207 @@
+"""
+Frame I/O Utility
+Streams distinct keyframes out of videos and animated images
+
+Frames are decoded one at a time, in order, and only a few are kept. A frame
+is sampled when the sampling clock reaches it; the interval between samples
+adapts to how much the picture changed since the previous sample (halved
+after a scene change, doubled while the picture is static). A sampled frame
+whose average hash (the hash reverse search uses) is within a few bits of a
+frame already kept is skipped as a near-duplicate. Frames that are not
+sampled are only grabbed from the decoder, never converted, so memory
+depends on the frame size and not on the clip length.
+
+Videos are read with OpenCV's FFmpeg backend; animated GIF, WebP and PNG
+files with PIL. A still image yields its single frame.
+
+Configuration (environment variables):
+- ML_VIDEO_SAMPLE_INTERVAL: seconds between sampled frames at the start (default: 1)
+- ML_VIDEO_MAX_INTERVAL: longest interval while the picture is static (default: 4)
+- ML_VIDEO_DUPLICATE_DISTANCE: maximum average-hash Hamming distance to a
+  kept frame for a sampled frame to be skipped (default: 5)
+- ML_VIDEO_MAX_FRAMES: distinct frames kept per clip (default: 24)
+- ML_VIDEO_MAX_SECONDS: media time read per clip; the rest is ignored (default: 600)
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from utils.image_io import IMAGE_MAX_PIXELS, DecodedImage, ImagePolicyError, read_image_header
+from utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+SAMPLE_INTERVAL = float(os.environ.get('ML_VIDEO_SAMPLE_INTERVAL', '1'))
+MAX_INTERVAL = float(os.environ.get('ML_VIDEO_MAX_INTERVAL', '4'))
+DUPLICATE_DISTANCE = int(os.environ.get('ML_VIDEO_DUPLICATE_DISTANCE', '5'))
+MAX_FRAMES = int(os.environ.get('ML_VIDEO_MAX_FRAMES', '24'))
+MAX_SECONDS = float(os.environ.get('ML_VIDEO_MAX_SECONDS', '600'))
+
+# Read with PIL (frame by frame); anything else goes to OpenCV/FFmpeg
+PIL_FORMATS = ('GIF', 'WEBP', 'PNG', 'JPEG', 'BMP', 'TIFF')
+
+# Mean absolute difference (0-1) between 32x32 grayscale thumbnails of samples
+THUMBNAIL_SIDE = 32
+SCENE_CHANGE_DIFF = 0.12
+STATIC_DIFF = 0.02
+
+# Frame rate assumed when a container does not report one
+DEFAULT_FPS = 25.0
+# GIF delays this short are shown as 100 ms by browsers
+GIF_DEFAULT_DELAY_MS = 100
+GIF_MIN_DELAY_MS = 10
+
+class Keyframe(NamedTuple):
+    index: int
+    timestamp: float
+    image: DecodedImage
+
+# (index, timestamp, is_last, retrieve) per decoded frame; retrieve() converts it to BGR
+FrameSource = Iterator[Tuple[int, float, bool, Callable[[], Optional['np.ndarray']]]]
+
+class FrameSampler:
+    """
+    Adaptive sampling clock and near-duplicate filter for one frame stream
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, max_interval: float = MAX_INTERVAL,
+                 duplicate_distance: int = DUPLICATE_DISTANCE, max_frames: int = MAX_FRAMES):
+        self.interval = interval
+        self.min_interval = interval / 4
+        self.max_interval = max(interval, max_interval)
+        self.duplicate_distance = duplicate_distance
+        self.max_frames = max_frames
+        self.next_time = 0.0
+        self._thumbnail = None
+        self._hashes: List[int] = []
+        self.stats = {
+            'frames_decoded': 0,
+            'frames_sampled': 0,
+            'duplicates_skipped': 0,
+            'keyframes': 0,
+            'duration': 0.0,
+        }
+
+    @property
+    def full(self) -> bool:
+        return len(self._hashes) >= self.max_frames
+
+    def due(self, timestamp: float, is_last: bool = False) -> bool:
+        """
+        Count a decoded frame and tell whether it should be sampled
+
+        The last frame always is, so a scene that starts after the final
+        sample is not lost when the interval has grown.
+        """
+        self.stats['frames_decoded'] += 1
+        self.stats['duration'] = round(timestamp, 3)
+        return timestamp >= self.next_time or is_last
+
+    def offer(self, index: int, timestamp: float, bgr: np.ndarray) -> Optional[Keyframe]:
+        """
+        Sample a frame: adapt the interval, then keep it unless it is a near-duplicate
+
+        Returns:
+            Keyframe, or None when a kept frame looks the same
+        """
+        self.stats['frames_sampled'] += 1
+        thumbnail = cv2.resize(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY), (THUMBNAIL_SIDE, THUMBNAIL_SIDE),
+                               interpolation=cv2.INTER_AREA)
+        if self._thumbnail is not None:
+            change = float(np.mean(cv2.absdiff(thumbnail, self._thumbnail))) / 255.0
+            if change >= SCENE_CHANGE_DIFF:
+                self.interval = max(self.min_interval, self.interval / 2)
+            elif change <= STATIC_DIFF:
+                self.interval = min(self.max_interval, self.interval * 2)
+        self._thumbnail = thumbnail
+        self.next_time = timestamp + self.interval
+
+        image = DecodedImage(bgr)
+        frame_hash = image.average_hash
+        if any(bin(frame_hash ^ kept).count('1') <= self.duplicate_distance for kept in self._hashes):
+            self.stats['duplicates_skipped'] += 1
+            return None
+        self._hashes.append(frame_hash)
+        self.stats['keyframes'] += 1
+        return Keyframe(index, round(timestamp, 3), image)
+
+def iter_keyframes(path: str, sampler: Optional[FrameSampler] = None) -> Iterator[Keyframe]:
+    """
+    Decode a video or animated image file and yield its distinct keyframes
+
+    Args:
+        path: Video, animated image or still image file
+        sampler: Sampling state; its "stats" describe the pass afterwards
+
+    Raises:
+        ImagePolicyError: frames are larger than ML_IMAGE_MAX_PIXELS
+    """
+    sampler = sampler or FrameSampler()
+    header = read_image_header(path)
+    frames = _image_frames(path) if header is not None and header[0] in PIL_FORMATS else _video_frames(path)
+
+    try:
+        for index, timestamp, is_last, retrieve in frames:
+            if timestamp > MAX_SECONDS or sampler.full:
+                break
+            if not sampler.due(timestamp, is_last):
+                continue
+            bgr = retrieve()
+            if bgr is None:
+                continue
+            keyframe = sampler.offer(index, timestamp, bgr)
+            if keyframe is not None:
+                yield keyframe
+    finally:
+        # Releases the decoder as soon as enough frames were read
+        frames.close()
+
+def _check_frame_size(width: int, height: int):
+    if width * height > IMAGE_MAX_PIXELS:
+        raise ImagePolicyError(
+            f'Frames are {width}x{height} pixels; at most {IMAGE_MAX_PIXELS} pixels can be decoded')
+
+def _video_frames(path: str) -> FrameSource:
+    """Frames of a video; grabbing a frame does not convert it"""
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return
+        _check_frame_size(int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                          int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        if not 0 < fps <= 1000:
+            fps = DEFAULT_FPS
+        # From the container header; 0 (unknown) or inexact for some formats
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        def retrieve():
+            ok, bgr = capture.retrieve()
+            return bgr if ok else None
+
+        index = 0
+        while capture.grab():
+            yield index, index / fps, index + 1 == frame_count, retrieve
+            index += 1
+    finally:
+        capture.release()
+
+def _image_frames(path: str) -> FrameSource:
+    """Frames of an animated (or still) image"""
+    with Image.open(path) as img:
+        _check_frame_size(img.width, img.height)
+
+        def retrieve():
+            return cv2.cvtColor(np.asarray(img.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+        frame_count = getattr(img, 'n_frames', 1)
+        timestamp = 0.0
+        for index in range(frame_count):
+            img.seek(index)
+            yield index, timestamp, index + 1 == frame_count, retrieve
+            delay = img.info.get('duration') or GIF_DEFAULT_DELAY_MS
+            timestamp += (delay if delay > GIF_MIN_DELAY_MS else GIF_DEFAULT_DELAY_MS) / 1000.0
@@ -0,0 +1,329 @@
+"""
+Perceptual Hash Index
+Persistent, memory-mapped index of sample-image hashes for reverse search
+
+The 64-bit average hash of every image in the samples directory is stored
+on disk next to four sorted tables of its 16-bit chunks (multi-index
+hashing). A query within Hamming radius r only has to look up chunk values
+within r // 4 bits of the query's chunks (pigeonhole principle), so lookups
+stay sub-linear as the reference corpus grows. The index files are
+memory-mapped at load time and rebuilt incrementally, re-hashing only files
+whose size or mtime changed since the last build.
+
+Adding, removing or renaming a sample changes the directory's mtime and is
+picked up by the next query. Overwriting a file in place does not, so the
+files themselves are re-scanned at most every rescan interval as well.
+
+Usage (prebuild or refresh the index):
+    python -m utils.hash_index [samples_dir]
+
+Configuration (environment variables):
+- ML_SAMPLES_DIR: reference image directory (default: samples/)
+- ML_HASH_INDEX_DIR: index location (default: <samples_dir>/.hash_index)
+- ML_HASH_INDEX_RESCAN_INTERVAL: seconds between scans for files modified
+  in place (default: 30)
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+INDEX_FORMAT_VERSION = 2
+CHUNK_COUNT = 4
+CHUNK_BITS = 16
+
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def compute_average_hash(img) -> int:
+    """
+    Compute the 64-bit average hash of a PIL image as an integer
+
+    Bit order follows imagehash.average_hash, so Hamming distances match
+    `hash_a - hash_b` on the corresponding ImageHash objects.
+    """
+    import imagehash
+
+    bits = imagehash.average_hash(img).hash.flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming_distances(hashes: np.ndarray, value: int) -> np.ndarray:
+    """Hamming distance between each uint64 hash and a single hash value"""
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(value))
+    return _POPCOUNT8[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def _chunks(hashes: np.ndarray) -> np.ndarray:
+    """Split uint64 hashes into CHUNK_COUNT uint16 chunks (shape: chunks x N)"""
+    mask = np.uint64((1 << CHUNK_BITS) - 1)
+    return np.stack([
+        ((hashes >> np.uint64(CHUNK_BITS * i)) & mask).astype(np.uint16)
+        for i in range(CHUNK_COUNT)
+    ]) if len(hashes) else np.zeros((CHUNK_COUNT, 0), dtype=np.uint16)
+
+_flip_masks: Dict[int, np.ndarray] = {}
+
+def _chunk_flip_masks(radius: int) -> np.ndarray:
+    """All 16-bit masks with at most `radius` bits set"""
+    if radius not in _flip_masks:
+        masks = [0]
+        for bits in range(1, radius + 1):
+            for positions in combinations(range(CHUNK_BITS), bits):
+                mask = 0
+                for position in positions:
+                    mask |= 1 << position
+                masks.append(mask)
+        _flip_masks[radius] = np.array(masks, dtype=np.uint16)
+    return _flip_masks[radius]
+
+class _Snapshot:
+    """Immutable view of one index generation"""
+
+    def __init__(self, names: List[str], stats: List[Tuple[int, int]],
+                 hashes: np.ndarray, chunk_keys: np.ndarray, chunk_rows: np.ndarray):
+        self.names = names
+        self.stats = stats
+        self.hashes = hashes
+        self.chunk_keys = chunk_keys
+        self.chunk_rows = chunk_rows
+
+    def __len__(self):
+        return len(self.names)
+
+class ImageHashIndex:
+    """
+    Multi-index hashing over the average hashes of a sample directory
+    """
+
+    def __init__(self, samples_dir: str, index_dir: Optional[str] = None,
+                 rescan_interval: float = 30.0):
+        self.samples_dir = samples_dir
+        self.index_dir = index_dir or os.path.join(samples_dir, '.hash_index')
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot([], [], np.zeros(0, dtype=np.uint64),
+                                   np.zeros((CHUNK_COUNT, 0), dtype=np.uint16),
+                                   np.zeros((CHUNK_COUNT, 0), dtype=np.uint32))
+        self._dir_mtime_ns: Optional[int] = None
+        self._scanned_at: Optional[float] = None
+        self._load()
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def query(self, value: int, max_distance: int = 9, top_k: int = 3) -> List[Tuple[str, int]]:
+        """
+        Find indexed images within a Hamming radius of a hash
+
+        Args:
+            value: 64-bit average hash of the query image
+            max_distance: Maximum Hamming distance (inclusive)
+            top_k: Maximum number of matches to return
+
+        Returns:
+            List of (filename, distance) sorted by distance, then filename
+        """
+        self.refresh_if_changed()
+        snapshot = self._snapshot
+        if len(snapshot) == 0:
+            return []
+
+        masks = _chunk_flip_masks(max_distance // CHUNK_COUNT)
+        candidates = []
+        for chunk in range(CHUNK_COUNT):
+            query_chunk = np.uint16((value >> (CHUNK_BITS * chunk)) & ((1 << CHUNK_BITS) - 1))
+            probes = np.bitwise_xor(masks, query_chunk)
+            keys = snapshot.chunk_keys[chunk]
+            lefts = np.searchsorted(keys, probes, side='left')
+            rights = np.searchsorted(keys, probes, side='right')
+            for left, right in zip(lefts[rights > lefts], rights[rights > lefts]):
+                candidates.append(snapshot.chunk_rows[chunk][left:right])
+
+        if not candidates:
+            return []
+
+        rows = np.unique(np.concatenate(candidates))
+        distances = hamming_distances(snapshot.hashes[rows], value)
+        within = distances <= max_distance
+        matches = sorted(
+            (int(distance), snapshot.names[row])
+            for row, distance in zip(rows[within], distances[within])
+        )
+        return [(name, distance) for distance, name in matches[:top_k]]
+
+    def refresh_if_changed(self) -> bool:
+        """
+        Refresh when the samples directory changed since the last scan, or
+        when the rescan interval has passed (files modified in place)
+        """
+        try:
+            mtime_ns = os.stat(self.samples_dir).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if (mtime_ns == self._dir_mtime_ns and self._scanned_at is not None
+                and time.monotonic() - self._scanned_at < self.rescan_interval):
+            return False
+        return self.refresh()
+
+    def refresh(self) -> bool:
+        """
+        Bring the index up to date with the samples directory
+
+        Only new or modified files (by size and mtime) are re-hashed.
+
+        Returns:
+            True if the index changed
+        """
+        with self._lock:
+            try:
+                self._dir_mtime_ns = os.stat(self.samples_dir).st_mtime_ns
+            except OSError:
+                self._dir_mtime_ns = None
+
+            self._scanned_at = time.monotonic()
+            current = self._scan()
+            snapshot = self._snapshot
+            known = {name: (row, stat) for row, (name, stat)
+                     in enumerate(zip(snapshot.names, snapshot.stats))}
+
+            if len(current) == len(known) and all(
+                name in known and known[name][1] == stat for name, stat in current.items()
+            ):
+                return False
+
+            names, stats, values = [], [], []
+            for name in sorted(current):
+                stat = current[name]
+                if name in known and known[name][1] == stat:
+                    value = int(snapshot.hashes[known[name][0]])
+                else:
+                    value = self._hash_file(name)
+                    if value is None:
+                        continue
+                names.append(name)
+                stats.append(stat)
+                values.append(value)
+
+            self._snapshot = self._build(names, stats, np.array(values, dtype=np.uint64))
+            self._save()
+            return True
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        entries = {}
+        if not os.path.isdir(self.samples_dir):
+            return entries
+        with os.scandir(self.samples_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    entries[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return entries
+
+    def _hash_file(self, name: str) -> Optional[int]:
+        # Decode exactly like query images so hashes are comparable
+        from utils.image_io import DecodedImage
+
+        try:
+            decoded = DecodedImage.from_path(os.path.join(self.samples_dir, name))
+            return decoded.average_hash if decoded is not None else None
+        except Exception:
+            return None
+
+    @staticmethod
+    def _build(names, stats, hashes: np.ndarray) -> _Snapshot:
+        chunks = _chunks(hashes)
+        order = np.argsort(chunks, axis=1, kind='stable').astype(np.uint32)
+        keys = np.take_along_axis(chunks, order.astype(np.intp), axis=1)
+        return _Snapshot(names, stats, hashes, keys, order)
+
+    def _save(self):
+        """Write a new generation of index files, then switch the manifest"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        snapshot = self._snapshot
+        generation = uuid.uuid4().hex[:12]
+        for part, array in (('hashes', snapshot.hashes),
+                            ('chunk_keys', snapshot.chunk_keys),
+                            ('chunk_rows', snapshot.chunk_rows)):
+            np.save(os.path.join(self.index_dir, f'{part}-{generation}.npy'), array)
+
+        manifest_path = os.path.join(self.index_dir, 'manifest.json')
+        tmp_path = f'{manifest_path}.{generation}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'format': INDEX_FORMAT_VERSION,
+                'generation': generation,
+                'entries': [[name, mtime_ns, size] for name, (mtime_ns, size)
+                            in zip(snapshot.names, snapshot.stats)],
+            }, f)
+        os.replace(tmp_path, manifest_path)
+
+        # Old generations stay readable by existing memory maps until closed
+        for filename in os.listdir(self.index_dir):
+            if filename.endswith('.npy') and generation not in filename:
+                try:
+                    os.unlink(os.path.join(self.index_dir, filename))
+                except OSError:
+                    pass
+
+    def _load(self):
+        manifest_path = os.path.join(self.index_dir, 'manifest.json')
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('format') != INDEX_FORMAT_VERSION:
+                return
+            entries = manifest['entries']
+            generation = manifest['generation']
+            if not entries:
+                return
+
+            def load(part):
+                path = os.path.join(self.index_dir, f'{part}-{generation}.npy')
+                return np.load(path, mmap_mode='r')
+
+            self._snapshot = _Snapshot(
+                [entry[0] for entry in entries],
+                [(entry[1], entry[2]) for entry in entries],
+                load('hashes'), load('chunk_keys'), load('chunk_rows'),
+            )
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable index: the first query rebuilds it
+            pass
+
+_index: Optional[ImageHashIndex] = None
+_index_lock = threading.Lock()
+
+def default_samples_dir() -> str:
+    return os.environ.get(
+        'ML_SAMPLES_DIR',
+        os.path.join(os.path.dirname(__file__), '..', 'samples'),
+    )
+
+def get_hash_index() -> ImageHashIndex:
+    """Get the process-wide index over the configured samples directory"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ImageHashIndex(
+                    default_samples_dir(),
+                    os.environ.get('ML_HASH_INDEX_DIR'),
+                    rescan_interval=float(os.environ.get('ML_HASH_INDEX_RESCAN_INTERVAL', '30')),
+                )
+    return _index
+
+if __name__ == '__main__':
+    samples_dir = sys.argv[1] if len(sys.argv) > 1 else default_samples_dir()
+    index = ImageHashIndex(samples_dir, os.environ.get('ML_HASH_INDEX_DIR'))
+    changed = index.refresh()
+    print(f'{len(index)} image(s) indexed in {index.index_dir}'
+          f' ({"updated" if changed else "up to date"})')
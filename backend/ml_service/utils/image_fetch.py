@@ -0,0 +1,322 @@
+"""
+Image Fetcher
+Downloads remote images for `image_path` URLs with pooling, limits and caching
+
+Requests go through one requests.Session whose keep-alive connection pool is
+shared by every request thread. A download is rejected as soon as the
+response headers show a non-image content type or a Content-Length over the
+byte cap, and the body is streamed so a server that lies about its size is
+cut off at the cap as well. The body is read as it arrives and the whole
+download must finish within an overall deadline, so a server trickling
+bytes just fast enough to beat the read timeout cannot hold a request
+thread indefinitely.
+
+Downloaded images are kept in a local content-addressed cache: blobs are
+stored once by SHA-256 of their bytes, and each URL records which blob it
+served together with its ETag/Last-Modified validators. Within the freshness
+window a URL is answered from disk without any request; after it, the URL is
+revalidated with a conditional GET and a 304 reuses the stored blob. Popular
+images shared by many posts are therefore downloaded once, and concurrent
+requests for the same URL wait for a single download.
+
+Configuration (environment variables):
+- ML_FETCH_TIMEOUT: connect/read timeout in seconds (default: 5)
+- ML_FETCH_TOTAL_TIMEOUT: seconds allowed for a whole download (default: 30)
+- ML_FETCH_MAX_BYTES: largest accepted image (default: 20 MB)
+- ML_FETCH_POOL_SIZE: keep-alive connections kept per host (default: 16)
+- ML_FETCH_CACHE_DIR: download cache directory, empty to disable (default: cache/images)
+- ML_FETCH_CACHE_TTL: seconds a cached URL is used without revalidation (default: 300)
+- ML_FETCH_CACHE_MAX_BYTES: download cache size before least recently used blobs are removed (default: 512 MB)
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 64 * 1024
+USER_AGENT = 'misinfo-ml-service/1.0'
+
+class ImageFetchError(Exception):
+    """A remote image could not be used; carries an HTTP status code"""
+    status_code = 502
+
+class ImageTooLargeError(ImageFetchError):
+    """The image is larger than the byte cap"""
+    status_code = 413
+
+class NotAnImageError(ImageFetchError):
+    """The server answered with a content type that is not an image"""
+    status_code = 415
+
+def is_url(image_path: str) -> bool:
+    return urlsplit(image_path).scheme in ('http', 'https')
+
+class ImageFetcher:
+    """
+    Pooled, size-capped image downloader with an optional disk cache
+    """
+
+    def __init__(self, timeout: float = 5.0, max_bytes: int = 20 * 1024 * 1024, pool_size: int = 16,
+                 cache_dir: Optional[str] = None, cache_ttl: float = 300.0,
+                 cache_max_bytes: int = 512 * 1024 * 1024, total_timeout: float = 30.0):
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self.cache_max_bytes = cache_max_bytes
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = USER_AGENT
+
+        # Per-URL lock and the number of threads holding or waiting for it
+        self._url_locks: Dict[str, list] = {}
+        # Guards the URL lock table and the counters
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self.downloads = 0
+        self.revalidations = 0
+        self.cache_hits = 0
+        self._cache_bytes = 0
+        if cache_dir:
+            os.makedirs(os.path.join(cache_dir, 'blobs'), exist_ok=True)
+            os.makedirs(os.path.join(cache_dir, 'urls'), exist_ok=True)
+            self._cache_bytes = sum(entry.stat().st_size for entry in os.scandir(self._blob_dir()))
+
+    def fetch(self, url: str) -> bytes:
+        """
+        Get an image's bytes, from the cache when possible
+
+        Raises:
+            ImageFetchError: unsupported URL, network error or error status
+            ImageTooLargeError: the image exceeds the byte cap
+            NotAnImageError: the response is not an image
+        """
+        if not is_url(url):
+            raise ImageFetchError(f'Unsupported image URL: {url}')
+        if not self.cache_dir:
+            return self._download(url, None)[0]
+
+        with self._url_lock(url):
+            entry = self._read_entry(url)
+            if entry is not None:
+                blob = self._read_blob(entry['sha256'])
+                if blob is not None and time.time() - entry['fetched_at'] < self.cache_ttl:
+                    self._count('cache_hits')
+                    return blob
+                if blob is None:
+                    entry = None
+
+            data, headers = self._download(url, entry)
+            if data is None:
+                # 304 Not Modified: the stored blob is still current
+                self._count('revalidations')
+                entry['fetched_at'] = time.time()
+                self._write_entry(url, entry)
+                return blob
+
+            digest = self._write_blob(data)
+            self._write_entry(url, {
+                'sha256': digest,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'fetched_at': time.time(),
+            })
+            return data
+
+    def _download(self, url: str, entry: Optional[Dict]):
+        """
+        GET an image, conditionally when a cached entry has validators
+
+        Returns:
+            (bytes, response headers), or (None, headers) on 304 Not Modified
+        """
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        deadline = time.monotonic() + self.total_timeout
+        try:
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304 and entry is not None:
+                    return None, response.headers
+                if response.status_code != 200:
+                    raise ImageFetchError(f'Image URL returned HTTP {response.status_code}')
+
+                content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                if not content_type.startswith('image/'):
+                    raise NotAnImageError(f'Image URL returned {content_type or "no content type"}')
+                length = response.headers.get('Content-Length')
+                if length is not None and length.isdigit() and int(length) > self.max_bytes:
+                    raise ImageTooLargeError(f'Image is larger than {self.max_bytes} bytes')
+
+                chunks = []
+                size = 0
+                for chunk in _iter_body(response):
+                    if time.monotonic() > deadline:
+                        raise ImageFetchError(f'Image download took longer than {self.total_timeout} seconds')
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ImageTooLargeError(f'Image is larger than {self.max_bytes} bytes')
+                    chunks.append(chunk)
+                self._count('downloads')
+                return b''.join(chunks), response.headers
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            raise ImageFetchError(f'Image download failed: {e}')
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @contextmanager
+    def _url_lock(self, url: str):
+        """Hold the URL's lock; the table only keeps locks someone holds or waits for"""
+        with self._lock:
+            entry = self._url_locks.get(url)
+            if entry is None:
+                entry = self._url_locks[url] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._url_locks[url]
+
+    def _blob_dir(self) -> str:
+        return os.path.join(self.cache_dir, 'blobs')
+
+    def _entry_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, 'urls',
+                            hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _read_entry(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self._entry_path(url)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, url: str, entry: Dict):
+        path = self._entry_path(url)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def _read_blob(self, digest: str) -> Optional[bytes]:
+        path = os.path.join(self._blob_dir(), digest)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Access time for eviction, independent of the filesystem's atime policy
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self._blob_dir(), digest)
+        if os.path.exists(path):
+            os.utime(path)
+            return digest
+
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._prune_lock:
+            self._cache_bytes += len(data)
+            if self._cache_bytes > self.cache_max_bytes:
+                self._prune()
+        return digest
+
+    def _prune(self):
+        """Remove least recently used blobs until the cache is under 90% of its cap"""
+        blobs = []
+        for entry in os.scandir(self._blob_dir()):
+            if entry.name.endswith('.tmp'):
+                continue
+            stat = entry.stat()
+            blobs.append((stat.st_mtime, stat.st_size, entry.path))
+        blobs.sort()
+
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in blobs:
+            if total <= self.cache_max_bytes * 0.9:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+        # URL entries pointing at removed blobs are refetched on next use
+        self._cache_bytes = total
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'downloads': self.downloads,
+                'revalidations': self.revalidations,
+                'cache_hits': self.cache_hits,
+                'cache_bytes': self._cache_bytes,
+            }
+
+def _iter_body(response: requests.Response):
+    """
+    Response body in chunks as they arrive
+
+    iter_content waits for a full chunk, which a trickling server can
+    stretch out indefinitely; urllib3 2.x read1 returns each network read.
+    """
+    read1 = getattr(response.raw, 'read1', None)
+    if read1 is None:
+        yield from response.iter_content(CHUNK_SIZE)
+        return
+    while True:
+        chunk = read1(CHUNK_SIZE, decode_content=True)
+        if not chunk:
+            return
+        yield chunk
+
+_fetcher: Optional[ImageFetcher] = None
+_fetcher_lock = threading.Lock()
+
+def get_image_fetcher() -> ImageFetcher:
+    """Get the process-wide image fetcher configured from the environment"""
+    global _fetcher
+
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = ImageFetcher(
+                    timeout=float(os.environ.get('ML_FETCH_TIMEOUT', '5')),
+                    max_bytes=int(os.environ.get('ML_FETCH_MAX_BYTES', str(20 * 1024 * 1024))),
+                    pool_size=int(os.environ.get('ML_FETCH_POOL_SIZE', '16')),
+                    cache_dir=os.environ.get(
+                        'ML_FETCH_CACHE_DIR',
+                        os.path.join(os.path.dirname(__file__), '..', 'cache', 'images'),
+                    ) or None,
+                    cache_ttl=float(os.environ.get('ML_FETCH_CACHE_TTL', '300')),
+                    cache_max_bytes=int(os.environ.get('ML_FETCH_CACHE_MAX_BYTES', str(512 * 1024 * 1024))),
+                    total_timeout=float(os.environ.get('ML_FETCH_TOTAL_TIMEOUT', '30')),
+                )
+    return _fetcher
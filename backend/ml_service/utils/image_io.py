@@ -0,0 +1,179 @@
+"""
+Image I/O Utility
+Decodes an image once and shares it across the analysis stages
+
+OCR, blur/manipulation checks, metadata inspection and perceptual hashing
+all consume the same DecodedImage, so an upload is decoded a single time
+straight from its bytes, without a temporary file.
+
+Decoded memory is bounded: the header is read first, and a file whose
+dimensions would decode to more than ML_IMAGE_MAX_PIXELS is rejected before
+any pixel is decompressed (a small PNG can claim 20000x20000). JPEGs larger
+than ML_IMAGE_DECODE_MAX_SIDE are decoded at 1/2, 1/4 or 1/8 scale straight
+from the DCT coefficients, which is faster and never holds the full-size
+pixels; other formats are decoded at full size.
+
+Configuration (environment variables):
+- ML_IMAGE_MAX_PIXELS: largest decoded image, in pixels (default: 40000000)
+- ML_IMAGE_DECODE_MAX_SIDE: JPEGs are decoded at reduced scale while their
+  longest side stays at least this long (default: 4096)
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import warnings
+from typing import Optional, Tuple, Union
+
+from utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+IMAGE_MAX_PIXELS = int(os.environ.get('ML_IMAGE_MAX_PIXELS', '40000000'))
+IMAGE_DECODE_MAX_SIDE = int(os.environ.get('ML_IMAGE_DECODE_MAX_SIDE', '4096'))
+
+# Formats OpenCV can decode at reduced scale without a full-size pass
+REDUCED_DECODE_FORMATS = ('JPEG',)
+
+class ImagePolicyError(ValueError):
+    """The image's dimensions are over the decode policy"""
+    status_code = 422
+
+def read_image_header(data: Union[bytes, str]) -> Optional[Tuple[str, int, int]]:
+    """
+    Format and dimensions from an image's header, without decoding pixels
+
+    Args:
+        data: Encoded image bytes, or the path of an image file
+
+    Returns:
+        (format, width, height), or None if the bytes are not a known image
+    """
+    try:
+        with warnings.catch_warnings():
+            # Sizes are checked against our own policy below
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(data) if isinstance(data, bytes) else data) as img:
+                return img.format, img.width, img.height
+    except Image.DecompressionBombError as e:
+        raise ImagePolicyError(str(e))
+    except Exception:
+        return None
+
+def decode_reduction(image_format: str, width: int, height: int) -> int:
+    """
+    Scale-down factor (1, 2, 4 or 8) to decode an image at
+
+    Raises:
+        ImagePolicyError: even the reduced image has too many pixels
+    """
+    reduction = 1
+    if image_format in REDUCED_DECODE_FORMATS:
+        while reduction < 8 and max(width, height) // (reduction * 2) >= IMAGE_DECODE_MAX_SIDE:
+            reduction *= 2
+    pixels = -(-width // reduction) * -(-height // reduction)
+    if pixels > IMAGE_MAX_PIXELS:
+        raise ImagePolicyError(
+            f'Image is {width}x{height} pixels; at most {IMAGE_MAX_PIXELS} pixels can be decoded')
+    return reduction
+
+class DecodedImage:
+    """
+    An image decoded once from its encoded bytes
+
+    Attributes:
+        bgr: Decoded pixels as a BGR uint8 array (same as cv2.imread)
+        data: Original encoded bytes, if known (used for metadata)
+        reduction: Factor the image was scaled down by at decode time
+    """
+
+    def __init__(self, bgr: np.ndarray, data: Optional[bytes] = None, reduction: int = 1):
+        self.bgr = bgr
+        self.data = data
+        self.reduction = reduction
+        self._pil: Optional[Image.Image] = None
+        self._average_hash: Optional[int] = None
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Optional['DecodedImage']:
+        """
+        Decode encoded image bytes within the decode policy
+
+        Returns:
+            DecodedImage, or None if the bytes are not an image
+
+        Raises:
+            ImagePolicyError: the image is too large to decode
+        """
+        if not data:
+            return None
+        header = read_image_header(data)
+        if header is None:
+            return None
+        reduction = decode_reduction(*header)
+        flags = {
+            1: cv2.IMREAD_COLOR,
+            2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_COLOR_8,
+        }[reduction]
+        try:
+            bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        except cv2.error:
+            return None
+        if bgr is None:
+            return None
+        return cls(bgr, data, reduction)
+
+    @classmethod
+    def from_path(cls, path: str) -> Optional['DecodedImage']:
+        """Read and decode an image file; returns None if it cannot be loaded (see from_bytes)"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        return cls.from_bytes(data)
+
+    @property
+    def pil(self) -> Image.Image:
+        """RGB PIL view of the decoded pixels (no second decode)"""
+        if self._pil is None:
+            self._pil = Image.fromarray(cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB))
+        return self._pil
+
+    def exif(self):
+        """
+        Raw EXIF dictionary of the original file
+
+        Only the header is parsed; pixel data is not decoded again.
+        Raises if the format has no EXIF support, like PIL's _getexif.
+        """
+        if self.data is None:
+            return None
+        with Image.open(io.BytesIO(self.data)) as img:
+            return img._getexif()
+
+    @property
+    def average_hash(self) -> int:
+        """64-bit perceptual average hash (see utils/hash_index.py)"""
+        if self._average_hash is None:
+            from utils.hash_index import compute_average_hash
+            self._average_hash = compute_average_hash(self.pil)
+        return self._average_hash
+
+def load_image(source: Union[str, bytes, DecodedImage, None]) -> Optional[DecodedImage]:
+    """
+    Get a DecodedImage from a path, encoded bytes or an already decoded image
+
+    Returns:
+        DecodedImage, or None if the source cannot be loaded
+    """
+    if source is None or isinstance(source, DecodedImage):
+        return source
+    if isinstance(source, (bytes, bytearray)):
+        return DecodedImage.from_bytes(bytes(source))
+    return DecodedImage.from_path(source)
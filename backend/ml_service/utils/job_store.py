@@ -0,0 +1,330 @@
+"""
+Job Store
+Durable local queue of asynchronous analysis jobs
+
+Jobs live in a SQLite file (WAL mode), so queued work survives restarts and
+every worker process on the host drains the same queue. Workers claim the
+highest-priority, oldest queued job inside an immediate transaction and
+hold it under a lease, which they renew while the job runs; a job whose
+worker died is claimed again once its lease runs out, up to a maximum
+number of attempts. Each claim gets its own lease owner token, and only the
+current owner can record the outcome, so a worker that lost its lease
+cannot overwrite the result of the worker that took the job over. A job put back after a
+transient error waits out an exponential backoff before it can be claimed
+again. Finished jobs keep their result until they expire and are purged.
+
+A job carries a dedup key (a content hash); submitting content whose job is
+queued, running or finished and unexpired returns that job instead of
+queueing the work again.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+ACTIVE_STATUSES = ('queued', 'running', 'done')
+
+class JobQueueFullError(Exception):
+    """Too many jobs are waiting; the caller should retry later"""
+    status_code = 503
+
+class JobStore:
+    """SQLite-backed job queue with priorities, leases and result expiry"""
+
+    def __init__(self, path: str, max_queued: int = 1000, result_ttl: float = 3600.0,
+                 lease: float = 300.0, max_attempts: int = 3, retry_backoff: float = 1.0):
+        self.path = path
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Other processes may hold the write lock briefly; wait instead of failing
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,'
+            ' priority INTEGER NOT NULL, dedup_key TEXT NOT NULL, params TEXT NOT NULL,'
+            ' payload BLOB, result TEXT, error TEXT, callbacks TEXT NOT NULL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL,'
+            ' started_at REAL, finished_at REAL, lease_expires_at REAL, expires_at REAL,'
+            ' not_before REAL, lease_owner TEXT)'
+        )
+        # Stores created before retry backoff and lease owners existed
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in (('not_before', 'REAL'), ('lease_owner', 'TEXT')):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created_at)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key)')
+
+    def submit(self, kind: str, dedup_key: str, params: Dict, payload: Optional[bytes] = None,
+               priority: int = 0, callback_url: Optional[str] = None) -> Tuple[Dict, bool]:
+        """
+        Queue a job, or return the live job for the same content
+
+        Args:
+            kind: Job type, e.g. "image" or "multi"
+            dedup_key: Content hash identifying equivalent work
+            params: JSON-serialisable job parameters
+            payload: Optional binary input (e.g. image bytes)
+            priority: Higher runs first
+            callback_url: URL notified when the job finishes
+
+        Returns:
+            (job, created); a deduplicated submission gets the existing job,
+            whose priority is raised to the new one and which also notifies
+            the new callback
+
+        Raises:
+            JobQueueFullError: max_queued jobs are already waiting
+        """
+        now = time.time()
+        with self._transaction():
+            row = self._conn.execute(
+                'SELECT id, status, priority, callbacks FROM jobs WHERE dedup_key = ? AND kind = ?'
+                ' AND status IN (?, ?, ?) AND (expires_at IS NULL OR expires_at > ?)'
+                ' ORDER BY created_at DESC LIMIT 1',
+                (dedup_key, kind, *ACTIVE_STATUSES, now),
+            ).fetchone()
+            if row is not None:
+                job_id, status, current_priority, callbacks = row
+                callbacks = json.loads(callbacks)
+                if status != 'done' and callback_url and callback_url not in callbacks:
+                    callbacks.append(callback_url)
+                self._conn.execute(
+                    'UPDATE jobs SET priority = ?, callbacks = ? WHERE id = ?',
+                    (max(priority, current_priority), json.dumps(callbacks), job_id),
+                )
+                return self._get(job_id), False
+
+            queued, = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+            if queued >= self.max_queued:
+                raise JobQueueFullError(f'{queued} jobs are already queued')
+
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                'INSERT INTO jobs (id, kind, status, priority, dedup_key, params, payload, callbacks,'
+                ' created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, 'queued', priority, dedup_key, json.dumps(params), payload,
+                 json.dumps([callback_url] if callback_url else []), now),
+            )
+            return self._get(job_id), True
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Take the next job to run under a lease
+
+        Returns:
+            Job with its "params", "payload" and "lease_owner" token (needed
+            to renew the lease and record the outcome), or None when nothing
+            is queued
+        """
+        now = time.time()
+        with self._transaction():
+            # Expired jobs out of attempts are left to abandon_expired
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE (status = 'queued' AND (not_before IS NULL OR not_before <= ?))"
+                " OR (status = 'running' AND lease_expires_at < ? AND attempts < ?)"
+                ' ORDER BY priority DESC, created_at LIMIT 1',
+                (now, now, self.max_attempts),
+            ).fetchone()
+            if row is None:
+                return None
+            lease_owner = uuid.uuid4().hex
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?,"
+                ' lease_expires_at = ?, lease_owner = ? WHERE id = ?',
+                (now, now + self.lease, lease_owner, row[0]),
+            )
+            job = self._get(row[0])
+            params, payload = self._conn.execute(
+                'SELECT params, payload FROM jobs WHERE id = ?', (row[0],)
+            ).fetchone()
+        job['params'] = json.loads(params)
+        job['payload'] = payload
+        job['lease_owner'] = lease_owner
+        return job
+
+    def abandon_expired(self) -> List[Dict]:
+        """
+        Give up on jobs whose workers keep dying rather than retry them forever
+
+        Returns:
+            The jobs marked failed (their lease ran out on the last attempt),
+            for their callbacks to be notified
+        """
+        now = time.time()
+        with self._transaction():
+            job_ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )]
+            for job_id in job_ids:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, payload = NULL, finished_at = ?,"
+                    ' expires_at = ?, lease_owner = NULL WHERE id = ?',
+                    (f'Job abandoned after {self.max_attempts} attempts', now, self._expiry(now), job_id),
+                )
+            return [self._get(job_id) for job_id in job_ids]
+
+    def renew(self, job_id: str, lease_owner: str) -> bool:
+        """
+        Extend the lease of a running job
+
+        Returns:
+            False if the lease was lost (expired and claimed by another worker)
+        """
+        with self._transaction():
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (time.time() + self.lease, job_id, lease_owner),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: str, result: Dict, lease_owner: str) -> Optional[Dict]:
+        """Store a job's result; returns the finished job, or None if the lease was lost"""
+        return self._finish(job_id, lease_owner, 'done', result=json.dumps(result, separators=(',', ':')))
+
+    def fail(self, job_id: str, error: str, lease_owner: str) -> Optional[Dict]:
+        """Mark a job failed; returns the finished job, or None if the lease was lost"""
+        return self._finish(job_id, lease_owner, 'failed', error=error)
+
+    def retry(self, job_id: str, error: str, lease_owner: str) -> Optional[Dict]:
+        """
+        Put a job back in the queue after a transient error
+
+        The job is not claimed again for retry_backoff seconds, doubling with
+        each attempt, so a busy dependency is not retried into failure.
+
+        Returns:
+            The failed job once it has used all its attempts, else None
+            (also when the lease was lost)
+        """
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT attempts FROM jobs WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (job_id, lease_owner),
+            ).fetchone()
+            if row is None:
+                return None
+            attempts, = row
+            if attempts < self.max_attempts:
+                not_before = time.time() + self.retry_backoff * 2 ** max(attempts - 1, 0)
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', lease_expires_at = NULL, lease_owner = NULL,"
+                    ' not_before = ? WHERE id = ?',
+                    (not_before, job_id))
+                return None
+        return self.fail(job_id, error, lease_owner)
+
+    def _finish(self, job_id: str, lease_owner: str, status: str, result: Optional[str] = None,
+                error: Optional[str] = None) -> Optional[Dict]:
+        now = time.time()
+        with self._transaction():
+            cursor = self._conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, finished_at = ?,'
+                " lease_expires_at = NULL, lease_owner = NULL, expires_at = ?"
+                " WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (status, result, error, now, self._expiry(now), job_id, lease_owner),
+            )
+            if cursor.rowcount != 1:
+                return None
+            return self._get(job_id)
+
+    def _expiry(self, now: float) -> Optional[float]:
+        return now + self.result_ttl if self.result_ttl > 0 else None
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Public view of a job
+
+        Returns:
+            Job status, timestamps and, once finished, its "result" or
+            "error"; None if the job is unknown or has expired
+        """
+        with self._lock:
+            job = self._get(job_id)
+        if job is None or (job['expires_at'] is not None and job['expires_at'] <= time.time()):
+            return None
+        return job
+
+    def callbacks(self, job_id: str) -> List[str]:
+        with self._lock:
+            row = self._conn.execute('SELECT callbacks FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def purge_expired(self) -> int:
+        """Delete finished jobs past their expiry; returns how many"""
+        with self._lock:
+            cursor = self._conn.execute(
+                'DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),))
+            return cursor.rowcount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {
+            **{status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')},
+            'max_queued': self.max_queued,
+            'result_ttl': self.result_ttl,
+            'path': self.path,
+        }
+
+    def _get(self, job_id: str) -> Optional[Dict]:
+        row = self._conn.execute(
+            'SELECT id, kind, status, priority, attempts, created_at, started_at, finished_at,'
+            ' expires_at, result, error FROM jobs WHERE id = ?',
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        (job_id, kind, status, priority, attempts, created_at, started_at, finished_at,
+         expires_at, result, error) = row
+        job = {
+            'job_id': job_id,
+            'kind': kind,
+            'status': status,
+            'priority': priority,
+            'attempts': attempts,
+            'created_at': created_at,
+            'started_at': started_at,
+            'finished_at': finished_at,
+            'expires_at': expires_at,
+        }
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+class _Transaction:
+    """Thread lock plus an immediate SQLite transaction (a write lock across processes)"""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self._conn = conn
+        self._lock = lock
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self._conn.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        finally:
+            self._lock.release()
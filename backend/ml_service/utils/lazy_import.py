@@ -0,0 +1,74 @@
+"""
+Lazy Import Utility
+Defers loading heavy libraries until they are first used
+
+`cv2 = lazy_import('cv2')` binds a placeholder module whose real import runs
+on the first attribute access. Text-only workers therefore never load
+OpenCV or PIL, and full workers load them during warm-up (see
+services/warmup.py) rather than while importing the app.
+"""
+
+import importlib
+import sys
+import threading
+import types
+
+class LazyModule(types.ModuleType):
+    """
+    Module placeholder that imports the real module on first attribute access
+
+    The import goes through importlib, whose per-module locks make a first
+    access from several threads at once safe. Once loaded, the real
+    module's attributes are copied onto the placeholder so later lookups
+    cost the same as on the module itself.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_lock = threading.Lock()
+        self._lazy_module = None
+
+    def _load(self) -> types.ModuleType:
+        if self._lazy_module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__.update(
+                        (key, value) for key, value in module.__dict__.items()
+                        if key not in ('__name__', '__spec__', '__loader__')
+                    )
+                    self._lazy_module = module
+        return self._lazy_module
+
+    def __getattr__(self, attr: str):
+        # Only reached for attributes not copied over yet
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._lazy_module is not None else 'not loaded'
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    Get a module, deferring its import until first use
+
+    Args:
+        name: Absolute module name, e.g. 'cv2' or 'PIL.Image'
+
+    Returns:
+        The module itself if it is already imported, otherwise a LazyModule
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+def is_loaded(module: types.ModuleType) -> bool:
+    """Whether a module returned by lazy_import has been imported"""
+    return not isinstance(module, LazyModule) or module._lazy_module is not None
+
+def load(module: types.ModuleType) -> types.ModuleType:
+    """Import a lazily bound module now (no-op for regular modules)"""
+    if isinstance(module, LazyModule):
+        return module._load()
+    return module
@@ -0,0 +1,226 @@
+"""
+Metrics Utility
+Low-overhead latency instrumentation with a Prometheus text exposition
+
+Stages of the text, image and multi pipelines are wrapped in
+`track_stage(...)`, which records a duration histogram and an error
+counter labelled by pipeline and stage. The pipeline label comes from the
+request being served (set once per request by the app), so the same stage
+called from /ml/analyze/image and /ml/analyze/multi is reported
+separately. Per-request stage timings are also kept so the app can emit a
+`Server-Timing` response header.
+
+Configuration (environment variables):
+- ML_SERVER_TIMING: add a Server-Timing header to responses (default: false)
+"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+SERVER_TIMING_ENABLED = os.environ.get('ML_SERVER_TIMING', 'false').lower() == 'true'
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+class Gauge(Counter):
+    """Value that can go up and down (e.g. requests in flight)"""
+
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    """Cumulative bucketed distribution of observed values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f'{self.name}_bucket{le} {cumulative}')
+                le = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{le} {count}')
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+class Registry:
+    """Collection of metrics rendered together on /metrics"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'ml_stage_duration_seconds', 'Time spent in each analysis stage', ('pipeline', 'stage')))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    'ml_stage_errors_total', 'Analysis stages that raised', ('pipeline', 'stage')))
+STAGES_IN_FLIGHT = REGISTRY.register(Gauge(
+    'ml_stages_in_flight', 'Analysis stages currently running', ('pipeline', 'stage')))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'ml_request_duration_seconds', 'HTTP request latency', ('route', 'status')))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'ml_requests_in_flight', 'HTTP requests currently being served', ('route',)))
+COALESCED_REQUESTS = REGISTRY.register(Counter(
+    'ml_coalesced_requests_total', 'Analyses served by an identical in-flight computation', ('kind',)))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Per-request state: the pipeline label and the collected stage timings
+_pipeline: contextvars.ContextVar[str] = contextvars.ContextVar('ml_pipeline', default='direct')
+_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = \
+    contextvars.ContextVar('ml_stage_timings', default=None)
+
+def pipeline_from_path(path: str) -> str:
+    """Pipeline label for a request path (e.g. /ml/analyze/text/batch -> text_batch)"""
+    prefix = '/ml/analyze/'
+    if path.startswith(prefix):
+        return path[len(prefix):].strip('/').replace('/', '_') or 'other'
+    return 'other'
+
+def begin_request(pipeline: str):
+    """Start collecting stage timings for the current request"""
+    _pipeline.set(pipeline)
+    _timings.set([])
+
+def current_pipeline() -> str:
+    return _pipeline.get()
+
+@contextmanager
+def track_stage(stage: str):
+    """
+    Time a pipeline stage
+
+    Records the duration histogram, in-flight gauge and error counter for
+    (current pipeline, stage), and the stage timing of the current request.
+    """
+    pipeline = _pipeline.get()
+    STAGES_IN_FLIGHT.inc(pipeline=pipeline, stage=stage)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(pipeline=pipeline, stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGES_IN_FLIGHT.dec(pipeline=pipeline, stage=stage)
+        STAGE_SECONDS.observe(elapsed, pipeline=pipeline, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+def server_timing_header() -> Optional[str]:
+    """
+    Server-Timing header value for the current request
+
+    Repeated stages (e.g. per-item batch stages) are summed.
+    """
+    timings = _timings.get()
+    if not timings:
+        return None
+    totals: Dict[str, float] = {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ', '.join(f'{stage.replace(".", "-")};dur={elapsed * 1000:.2f}'
+                     for stage, elapsed in totals.items())
+
+def render_metrics() -> str:
+    """Prometheus text exposition of every registered metric"""
+    return REGISTRY.render()
@@ -0,0 +1,307 @@
+"""
+Near-Duplicate Index
+MinHash/LSH lookup of earlier text verdicts for lightly edited copies
+
+Reworded reposts (changed punctuation, extra hashtags, swapped emojis)
+miss the exact-content result cache. Each analysed text is reduced to a
+MinHash signature over its word shingles; signatures are split into LSH
+bands, so a lookup only compares the query against texts sharing at least
+one band, and returns the stored verdict of the most similar one when its
+estimated Jaccard similarity reaches the threshold.
+
+Memory is bounded by ML_NEARDUP_MAX_ENTRIES (least recently used entries
+are evicted). With ML_NEARDUP_PATH set, the index is loaded from that
+directory at startup and saved back periodically and at exit.
+
+Configuration (environment variables):
+- ML_NEARDUP: enable near-duplicate reuse for text analysis (default: true)
+- ML_NEARDUP_THRESHOLD: minimum estimated Jaccard similarity to reuse a verdict (default: 0.8)
+- ML_NEARDUP_MAX_ENTRIES: maximum indexed texts (default: 50000)
+- ML_NEARDUP_PATH: directory to persist the index in, empty for memory only (default: empty)
+- ML_NEARDUP_SAVE_INTERVAL: seconds between saves when persisting (default: 300)
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import re
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from utils.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+INDEX_FORMAT_VERSION = 1
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_TOKEN_RE = re.compile(r'\w+')
+
+def shingles(text: str, size: int = 3) -> List[str]:
+    """
+    Word shingles of normalised text
+
+    Case, punctuation, emojis and the '#'/'@' of hashtags and mentions are
+    ignored, so such edits change few or no shingles.
+    """
+    tokens = _TOKEN_RE.findall(text.lower())
+    if len(tokens) <= size:
+        return [' '.join(tokens)] if tokens else []
+    return [' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+class NearDuplicateIndex:
+    """
+    Bounded LRU index of MinHash signatures with LSH banding
+    """
+
+    def __init__(self, threshold: float = 0.8, max_entries: int = 50000,
+                 num_perm: int = 64, bands: int = 16, shingle_size: int = 3, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+
+        # Fixed permutations, so signatures stay comparable across processes
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        self._lock = threading.Lock()
+        self._signatures = np.zeros((min(max_entries, 1024), num_perm), dtype=np.uint32)
+        self._namespaces: List[Optional[str]] = [None] * len(self._signatures)
+        self._results: List[Optional[str]] = [None] * len(self._signatures)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._lru: 'OrderedDict[int, None]' = OrderedDict()
+        self._free: List[int] = list(range(len(self._signatures) - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._lru)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash signature of a text, or None when it has no words"""
+        values = shingles(text, self.shingle_size)
+        if not values:
+            return None
+        hashes = np.fromiter((zlib.crc32(value.encode('utf-8')) for value in values),
+                             dtype=np.uint64, count=len(values))
+        # Universal hashing (a*x + b) mod p, one row per permutation
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % np.uint64(_MERSENNE_PRIME)
+        return (permuted & np.uint64(_MAX_HASH)).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                for band in range(self.bands)]
+
+    def query(self, signature: np.ndarray, namespace: str) -> Optional[Tuple[Dict, float]]:
+        """
+        Find the most similar earlier verdict in a namespace
+
+        Args:
+            signature: MinHash signature of the query text
+            namespace: Only entries added under this namespace (e.g. a
+                ruleset fingerprint) are considered
+
+        Returns:
+            (stored result, estimated similarity) or None below the threshold
+        """
+        with self._lock:
+            candidates = set()
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                slots = bucket.get(key)
+                if slots:
+                    candidates.update(slots)
+            candidates = [slot for slot in candidates if self._namespaces[slot] == namespace]
+
+            best_slot, best_similarity = None, 0.0
+            if candidates:
+                similarities = (self._signatures[candidates] == signature).mean(axis=1)
+                best = int(similarities.argmax())
+                best_slot, best_similarity = candidates[best], float(similarities[best])
+
+            if best_slot is None or best_similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._lru.move_to_end(best_slot)
+            encoded = self._results[best_slot]
+        return json.loads(encoded), round(best_similarity, 4)
+
+    def add(self, signature: np.ndarray, namespace: str, result: Dict):
+        """Index a verdict, evicting the least recently used entry when full"""
+        encoded = json.dumps(result, separators=(',', ':'))
+        with self._lock:
+            if not self._free:
+                if len(self._signatures) < self.max_entries:
+                    self._grow()
+                else:
+                    self._evict(next(iter(self._lru)))
+                    self.evictions += 1
+            slot = self._free.pop()
+            self._signatures[slot] = signature
+            self._namespaces[slot] = namespace
+            self._results[slot] = encoded
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                bucket.setdefault(key, []).append(slot)
+            self._lru[slot] = None
+            self._dirty = True
+
+    def _grow(self):
+        size = len(self._signatures)
+        new_size = min(self.max_entries, size * 2)
+        grown = np.zeros((new_size, self.num_perm), dtype=np.uint32)
+        grown[:size] = self._signatures
+        self._signatures = grown
+        self._namespaces.extend([None] * (new_size - size))
+        self._results.extend([None] * (new_size - size))
+        self._free.extend(range(new_size - 1, size - 1, -1))
+
+    def _evict(self, slot: int):
+        for bucket, key in zip(self._buckets, self._band_keys(self._signatures[slot])):
+            slots = bucket.get(key)
+            if slots is not None:
+                slots.remove(slot)
+                if not slots:
+                    del bucket[key]
+        del self._lru[slot]
+        self._namespaces[slot] = None
+        self._results[slot] = None
+        self._free.append(slot)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'threshold': self.threshold,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+        }
+
+    def _params(self) -> Dict:
+        return {'num_perm': self.num_perm, 'bands': self.bands,
+                'shingle_size': self.shingle_size, 'seed': self.seed}
+
+    def save(self, directory: str) -> bool:
+        """
+        Write the index to a directory (entries in LRU order)
+
+        Returns:
+            False when nothing changed since the last save
+        """
+        with self._lock:
+            if not self._dirty:
+                return False
+            slots = list(self._lru)
+            signatures = self._signatures[slots].copy()
+            entries = [[self._namespaces[slot], self._results[slot]] for slot in slots]
+            self._dirty = False
+
+        os.makedirs(directory, exist_ok=True)
+        generation = uuid.uuid4().hex[:12]
+        np.save(os.path.join(directory, f'signatures-{generation}.npy'), signatures)
+        manifest_path = os.path.join(directory, 'manifest.json')
+        tmp_path = f'{manifest_path}.{generation}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'format': INDEX_FORMAT_VERSION, 'generation': generation,
+                       'params': self._params(), 'entries': entries}, f)
+        os.replace(tmp_path, manifest_path)
+
+        for filename in os.listdir(directory):
+            if filename.endswith('.npy') and generation not in filename:
+                try:
+                    os.unlink(os.path.join(directory, filename))
+                except OSError:
+                    pass
+        return True
+
+    def load(self, directory: str) -> int:
+        """
+        Add the entries saved in a directory
+
+        Returns:
+            Number of entries loaded (0 if missing or saved with other parameters)
+        """
+        try:
+            with open(os.path.join(directory, 'manifest.json')) as f:
+                manifest = json.load(f)
+            if manifest.get('format') != INDEX_FORMAT_VERSION or manifest.get('params') != self._params():
+                return 0
+            signatures = np.load(os.path.join(directory, f'signatures-{manifest["generation"]}.npy'))
+            entries = manifest['entries']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+        # Keep the most recently used entries if the saved index is larger
+        start = max(0, len(entries) - self.max_entries)
+        for signature, (namespace, encoded) in zip(signatures[start:], entries[start:]):
+            self.add(signature, namespace, json.loads(encoded))
+        with self._lock:
+            self._dirty = False
+        return len(entries) - start
+
+_index: Optional[NearDuplicateIndex] = None
+_index_lock = threading.Lock()
+
+def get_near_duplicate_index() -> Optional[NearDuplicateIndex]:
+    """
+    Get the process-wide near-duplicate index configured from the environment
+
+    Returns:
+        NearDuplicateIndex instance, or None when disabled
+    """
+    global _index
+
+    if os.environ.get('ML_NEARDUP', 'true').lower() != 'true':
+        return None
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = NearDuplicateIndex(
+                    threshold=float(os.environ.get('ML_NEARDUP_THRESHOLD', '0.8')),
+                    max_entries=int(os.environ.get('ML_NEARDUP_MAX_ENTRIES', '50000')),
+                )
+                path = os.environ.get('ML_NEARDUP_PATH', '')
+                if path:
+                    index.load(path)
+                    _start_saver(index, path, float(os.environ.get('ML_NEARDUP_SAVE_INTERVAL', '300')))
+                _index = index
+    return _index
+
+def _start_saver(index: NearDuplicateIndex, path: str, interval: float):
+    """Save periodically from a daemon thread, and once more at exit"""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                index.save(path)
+            except OSError as e:
+                print(f'Warning: saving near-duplicate index failed: {e}')
+
+    def save_at_exit():
+        stop.set()
+        try:
+            index.save(path)
+        except OSError:
+            pass
+
+    threading.Thread(target=run, name='ml-neardup-saver', daemon=True).start()
+    atexit.register(save_at_exit)
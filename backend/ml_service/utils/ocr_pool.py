@@ -0,0 +1,197 @@
+"""
+OCR Worker Pool
+Long-lived OCR worker processes with a bounded job queue
+
+Each worker process is started once and keeps its OCR engine warm: with
+the tesserocr bindings installed it holds an in-process Tesseract API for
+its whole lifetime, otherwise it falls back to pytesseract (which still
+runs tesseract per call, but off the Flask request thread). Jobs beyond
+the worker count wait in a bounded queue; when that is full, submissions
+fail fast with OCRBusyError instead of piling up.
+
+A running job cannot be cancelled from the parent, so the job timeout is
+also enforced inside the worker: tesserocr stops recognition at the
+deadline and pytesseract kills its tesseract process. A worker stuck on
+a slow image is therefore freed for the next job, not held indefinitely.
+The parent waits TIMEOUT_GRACE seconds longer than that deadline, so a job
+that timed out in its worker is reported as OCRTimeoutError (504), not as
+an OCR failure.
+
+Configuration (environment variables):
+- ML_OCR_WORKERS: worker processes, 0 runs OCR in the calling thread (default: 0)
+- ML_OCR_MAX_PENDING: jobs allowed to wait for a free worker (default: 2 x workers)
+- ML_OCR_JOB_TIMEOUT: seconds to wait for a job result (default: 10)
+- ML_OCR_LANG: Tesseract language (default: eng)
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import numpy as np
+
+class OCRPoolError(Exception):
+    """OCR could not be served by the pool; carries an HTTP status code"""
+    status_code = 503
+
+class OCRBusyError(OCRPoolError):
+    """The OCR queue is full (backpressure)"""
+    status_code = 503
+
+class OCRTimeoutError(OCRPoolError):
+    """An OCR job did not finish within its timeout"""
+    status_code = 504
+
+class _WorkerTimeoutError(RuntimeError):
+    """Raised in a worker when the engine hit the job deadline"""
+
+# Seconds the parent waits beyond a job's own deadline, covering the time the
+# job spends queued for a worker and returning its result
+TIMEOUT_GRACE = 2.0
+
+# Per-process engine state, set up by _init_worker
+_worker_api = None
+_worker_lang = 'eng'
+
+def _init_worker(lang: str):
+    """Start the OCR engine once per worker process"""
+    global _worker_api, _worker_lang
+    _worker_lang = lang
+    try:
+        import tesserocr
+        _worker_api = tesserocr.PyTessBaseAPI(lang=lang)
+    except Exception:
+        # tesserocr not installed or failed to start: use pytesseract per job
+        _worker_api = None
+        import pytesseract  # noqa: F401 (fail early if missing)
+
+def _ocr_job(pixels: np.ndarray, timeout: float = 0) -> str:
+    """
+    Run OCR on a preprocessed image array inside a worker
+
+    Args:
+        pixels: Preprocessed image
+        timeout: Seconds the engine may spend on the image, 0 for no limit
+
+    Raises:
+        _WorkerTimeoutError: the engine ran out of time
+        RuntimeError: OCR failed
+    """
+    from PIL import Image
+
+    try:
+        img = Image.fromarray(pixels)
+        if _worker_api is not None:
+            _worker_api.SetImage(img)
+            started = time.monotonic()
+            if not _worker_api.Recognize(timeout=int(timeout * 1000)):
+                if timeout and time.monotonic() - started >= timeout:
+                    raise _WorkerTimeoutError('Tesseract recognition timed out')
+                raise RuntimeError('Tesseract recognition failed')
+            return _worker_api.GetUTF8Text()
+
+        import pytesseract
+        try:
+            return pytesseract.image_to_string(img, lang=_worker_lang, timeout=timeout)
+        except RuntimeError as e:
+            # pytesseract reports its deadline as a plain RuntimeError
+            if 'timeout' in str(e).lower():
+                raise _WorkerTimeoutError(str(e)) from None
+            raise
+    except _WorkerTimeoutError:
+        raise
+    except Exception as e:
+        # Some engine exceptions cannot be unpickled in the parent, which
+        # would mark the whole pool as broken; send a plain error instead
+        raise RuntimeError(f'{type(e).__name__}: {e}') from None
+
+def _noop() -> bool:
+    return True
+
+class OCRPool:
+    """
+    Bounded pool of long-lived OCR worker processes
+    """
+
+    def __init__(self, workers: int, max_pending: int, job_timeout: float, lang: str = 'eng'):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.job_timeout = job_timeout
+        # Spawned (not forked) workers: the Flask process is multi-threaded
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(lang,),
+        )
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def warm_up(self):
+        """Start every worker process and its OCR engine ahead of traffic"""
+        futures = [self._executor.submit(_noop) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def run(self, pixels: np.ndarray, timeout: Optional[float] = None) -> str:
+        """
+        Run OCR on a preprocessed image array
+
+        Raises:
+            OCRBusyError: the queue is full
+            OCRTimeoutError: the job did not finish in time
+        """
+        if not self._slots.acquire(blocking=False):
+            raise OCRBusyError('OCR queue is full')
+
+        timeout = timeout if timeout is not None else self.job_timeout
+        try:
+            # The worker stops the engine at the same deadline, freeing its slot
+            future = self._executor.submit(_ocr_job, pixels, timeout)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=timeout + TIMEOUT_GRACE if timeout else None)
+        except _WorkerTimeoutError:
+            raise OCRTimeoutError('OCR job timed out') from None
+        except FutureTimeoutError:
+            future.cancel()
+            raise OCRTimeoutError('OCR job timed out')
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+_pool: Optional[OCRPool] = None
+_pool_lock = threading.Lock()
+
+def get_ocr_pool() -> Optional[OCRPool]:
+    """
+    Get the process-wide OCR pool configured from the environment
+
+    Returns:
+        OCRPool instance, or None when OCR runs in the calling thread
+    """
+    global _pool
+
+    workers = int(os.environ.get('ML_OCR_WORKERS', '0'))
+    if workers <= 0:
+        return None
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = OCRPool(
+                    workers=workers,
+                    max_pending=int(os.environ.get('ML_OCR_MAX_PENDING', str(2 * workers))),
+                    job_timeout=float(os.environ.get('ML_OCR_JOB_TIMEOUT', '10')),
+                    lang=os.environ.get('ML_OCR_LANG', 'eng'),
+                )
+    return _pool
@@ -7,40 +7,135 @@ In production, ensure Tesseract is installed:
 - Ubuntu/Debian: sudo apt-get install tesseract-ocr
 - macOS: brew install tesseract
 - Windows: Download from https://github.com/UB-Mannheim/tesseract/wiki
+
+With ML_OCR_WORKERS > 0, OCR runs on a pool of warm worker processes
+(see utils/ocr_pool.py) instead of the calling thread.
+
+extract_text_with_gate first runs a cheap text-presence check (see
+utils/text_detect.py): images without likely text skip Tesseract, and
+images with a few small text regions are read from those crops only,
+stacked into one strip so they still take a single OCR call.
+
+Preprocessing (environment variables):
+- ML_OCR_GRAYSCALE: convert to grayscale before OCR; off keeps the colour
+  input OCR has always received (default: false)
+- ML_OCR_MAX_SIDE: downscale images with a longer side, 0 to disable (default: 0)
+- ML_OCR_BINARIZE: apply Otsu binarisation (default: false)
+
+Text-presence gate (environment variables):
+- ML_OCR_GATE: skip or crop OCR based on the text-presence check (default: true)
+- ML_OCR_GATE_MAX_SIDE: longest side of the copy the check runs on (default: 640)
+- ML_OCR_CROP_MAX_COVERAGE: text regions covering more of the image than
+  this fraction are read with one full-image pass instead (default: 0.5)
+- ML_OCR_MAX_REGIONS: more text regions than this are read with one
+  full-image pass instead (default: 8)
 """
 
+from __future__ import annotations
+
 import os
-from typing import Optional
+from typing import Optional, Tuple, Union
+
+from utils.image_io import DecodedImage, load_image
+from utils.lazy_import import lazy_import
+from utils.ocr_pool import OCRPoolError, get_ocr_pool
+from utils.text_detect import find_text_regions
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() == 'true'
+
+OCR_GRAYSCALE = _env_flag('ML_OCR_GRAYSCALE', 'false')
+OCR_MAX_SIDE = int(os.environ.get('ML_OCR_MAX_SIDE', '0'))
+OCR_BINARIZE = _env_flag('ML_OCR_BINARIZE', 'false')
+
+OCR_GATE = _env_flag('ML_OCR_GATE', 'true')
+OCR_GATE_MAX_SIDE = int(os.environ.get('ML_OCR_GATE_MAX_SIDE', '640'))
+OCR_CROP_MAX_COVERAGE = float(os.environ.get('ML_OCR_CROP_MAX_COVERAGE', '0.5'))
+OCR_MAX_REGIONS = int(os.environ.get('ML_OCR_MAX_REGIONS', '8'))
+
+# Rows of background between stacked text crops, so Tesseract keeps them apart
+CROP_GAP = 16
 
-def extract_text_from_image(image_path: str) -> str:
+def preprocess_for_ocr(image: DecodedImage, grayscale: bool = False,
+                       max_side: int = 0, binarize: bool = False) -> np.ndarray:
+    """
+    Prepare image pixels for Tesseract
+    
+    Args:
+        image: Decoded image
+        grayscale: Convert to a single channel
+        max_side: Downscale so the longest side is at most this (0 = keep size)
+        binarize: Apply Otsu thresholding (implies grayscale)
+        
+    Returns:
+        Grayscale/binary (H x W) or RGB (H x W x 3) uint8 array
+    """
+    pixels = image.bgr
+    height, width = pixels.shape[:2]
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        pixels = cv2.resize(pixels, (max(1, round(width * scale)), max(1, round(height * scale))),
+                            interpolation=cv2.INTER_AREA)
+    
+    if not (grayscale or binarize):
+        return cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB)
+    
+    gray = cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+    if binarize:
+        _, gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return gray
+
+def extract_text_from_image(image: Union[str, DecodedImage, None],
+                            grayscale: Optional[bool] = None,
+                            max_side: Optional[int] = None,
+                            binarize: Optional[bool] = None) -> str:
     """
     Extract text from image using OCR
     
     Args:
-        image_path: Path to image file
+        image: Path to image file, or an image already decoded by the caller
+        grayscale, max_side, binarize: Preprocessing overrides
+            (defaults: ML_OCR_GRAYSCALE, ML_OCR_MAX_SIDE, ML_OCR_BINARIZE)
         
     Returns:
         Extracted text string (empty if OCR fails or unavailable)
+    
+    Raises:
+        OCRPoolError: the OCR worker pool is saturated or the job timed out
     """
     try:
-        import pytesseract
-        from PIL import Image
-        
-        # Check if image exists
-        if not os.path.exists(image_path):
+        # Check if image exists / can be decoded
+        decoded = load_image(image)
+        if decoded is None:
             return ''
         
-        # Open image
-        img = Image.open(image_path)
+        pixels = preprocess_for_ocr(
+            decoded,
+            grayscale=OCR_GRAYSCALE if grayscale is None else grayscale,
+            max_side=OCR_MAX_SIDE if max_side is None else max_side,
+            binarize=OCR_BINARIZE if binarize is None else binarize,
+        )
         
-        # Extract text using Tesseract
-        text = pytesseract.image_to_string(img)
+        # Extract text using Tesseract (on a warm worker when pooled)
+        pool = get_ocr_pool()
+        if pool is not None:
+            text = pool.run(pixels)
+        else:
+            import pytesseract
+            from PIL import Image
+            text = pytesseract.image_to_string(Image.fromarray(pixels))
         
         # Clean up text
         text = text.strip()
         
         return text
         
+    except OCRPoolError:
+        # Backpressure and timeouts are surfaced to the caller
+        raise
     except ImportError:
         # pytesseract not installed
         print('Warning: pytesseract not available. OCR functionality disabled.')
@@ -50,3 +145,66 @@ def extract_text_from_image(image_path: str) -> str:
         print(f'Warning: OCR extraction failed: {str(e)}')
         return ''
 
+def extract_text_with_gate(image: Union[str, DecodedImage, None]) -> Tuple[str, str]:
+    """
+    Extract text, running OCR only where text is likely
+    
+    Args:
+        image: Path to image file, or an image already decoded by the caller
+        
+    Returns:
+        (text, ocr_mode), where ocr_mode is 'skipped' (no text found, OCR
+        not run), 'cropped' (OCR on the text regions only) or 'full'
+    
+    Raises:
+        OCRPoolError: the OCR worker pool is saturated or the job timed out
+    """
+    decoded = load_image(image)
+    if decoded is None:
+        return '', 'skipped'
+    if not OCR_GATE:
+        return extract_text_from_image(decoded), 'full'
+    
+    regions = find_text_regions(decoded, OCR_GATE_MAX_SIDE)
+    if not regions:
+        return '', 'skipped'
+    
+    height, width = decoded.bgr.shape[:2]
+    coverage = sum(w * h for _, _, w, h in regions) / float(width * height)
+    if len(regions) > OCR_MAX_REGIONS or coverage > OCR_CROP_MAX_COVERAGE:
+        return extract_text_from_image(decoded), 'full'
+    
+    return extract_text_from_image(DecodedImage(stack_regions(decoded.bgr, regions))), 'cropped'
+
+def stack_regions(pixels: np.ndarray, regions) -> np.ndarray:
+    """
+    Stack text regions into one image for a single OCR call
+    
+    Regions are in reading order, so reading the strip top to bottom
+    gives the texts in the order a full-page read would. Each crop is
+    padded with the median colour of its own border, so no artificial
+    edges are added next to its text.
+    
+    Args:
+        pixels: BGR image
+        regions: (x, y, width, height) boxes
+        
+    Returns:
+        BGR image of the crops, left-aligned, CROP_GAP rows apart
+    """
+    if len(regions) == 1:
+        x, y, w, h = regions[0]
+        return pixels[y:y + h, x:x + w]
+    
+    width = max(w for _, _, w, _ in regions)
+    height = sum(h for _, _, _, h in regions) + CROP_GAP * (len(regions) - 1)
+    strip = np.empty((height, width, 3), dtype=np.uint8)
+    top = 0
+    for x, y, w, h in regions:
+        crop = pixels[y:y + h, x:x + w]
+        border = np.concatenate([crop[0], crop[-1], crop[:, 0], crop[:, -1]])
+        bottom = min(height, top + h + CROP_GAP)
+        strip[top:bottom] = np.median(border, axis=0).astype(np.uint8)
+        strip[top:top + h, :w] = crop
+        top = bottom
+    return strip
@@ -0,0 +1,273 @@
+"""
+Result Cache
+Content-hash keyed cache for analysis results
+
+Results are keyed by a SHA-256 of the analysed content (normalised text or
+raw image bytes) together with the model/ruleset version that produced
+them, so a rules change never serves stale verdicts. Two backends are
+available:
+- memory: in-process LRU bounded by entry count and encoded size
+- disk: local SQLite file, shared by every worker on the host
+
+Configuration (environment variables):
+- ML_CACHE_BACKEND: memory | disk | off (default: memory)
+- ML_CACHE_MAX_ENTRIES: maximum cached results (default: 10000)
+- ML_CACHE_MAX_BYTES: maximum encoded size of cached results (default: 64 MB)
+- ML_CACHE_TTL: seconds before an entry expires, 0 to disable (default: 3600)
+- ML_CACHE_PATH: SQLite file for the disk backend (default: cache/result_cache.sqlite3)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+def text_cache_key(kind: str, version: str, text: str) -> str:
+    """
+    Build a cache key for text content
+
+    Text is stripped and lowercased before hashing; the text rules only
+    ever look at the lowercased content, so this does not change results.
+    """
+    return content_cache_key(kind, version, text.strip().lower().encode('utf-8'))
+
+def content_cache_key(kind: str, version: str, content: bytes) -> str:
+    """Build a cache key for raw content bytes (e.g. an uploaded image)"""
+    digest = hashlib.sha256(content).hexdigest()
+    return f'{kind}:{version}:{digest}'
+
+def file_cache_key(kind: str, version: str, path: str) -> str:
+    """Build a cache key for a file's content, hashed in chunks (e.g. an uploaded video)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f'{kind}:{version}:{digest.hexdigest()}'
+
+class MemoryCacheBackend:
+    """In-process LRU store bounded by entry count and total encoded size"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at and expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, expires_at: float):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+class DiskCacheBackend:
+    """Local SQLite store with LRU eviction by last access time"""
+
+    name = 'disk'
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            ' key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,'
+            ' expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)')
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM results WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at and expires_at < now:
+                self._conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                return None
+            self._conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+            return value
+
+    def set(self, key: str, value: str, expires_at: float):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (key, value, size, expires_at, time.time()),
+            )
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM results')
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results'
+            ).fetchone()
+        return {
+            'entries': entries,
+            'bytes': total,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+            'path': self.path,
+        }
+
+    def _evict(self):
+        entries, total = self._conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results'
+        ).fetchone()
+        while entries > self.max_entries or total > self.max_bytes:
+            row = self._conn.execute(
+                'SELECT key, size FROM results ORDER BY accessed_at LIMIT 1'
+            ).fetchone()
+            if row is None:
+                break
+            self._conn.execute('DELETE FROM results WHERE key = ?', (row[0],))
+            entries -= 1
+            total -= row[1]
+            self.evictions += 1
+
+class ResultCache:
+    """
+    Analysis result cache with hit/miss accounting
+
+    Values are stored JSON-encoded, so every hit returns a fresh copy that
+    callers may mutate freely.
+    """
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, result: Dict):
+        expires_at = time.time() + self.ttl if self.ttl > 0 else 0.0
+        self.backend.set(key, json.dumps(result, separators=(',', ':')), expires_at)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'enabled': True,
+            'backend': self.backend.name,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'ttl': self.ttl,
+            **self.backend.stats(),
+        }
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+def get_result_cache() -> Optional[ResultCache]:
+    """
+    Get the process-wide result cache configured from the environment
+
+    Returns:
+        ResultCache instance, or None when caching is disabled
+    """
+    global _cache
+
+    backend_name = os.environ.get('ML_CACHE_BACKEND', 'memory').lower()
+    if backend_name in ('off', 'none', 'false', '0'):
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                max_entries = int(os.environ.get('ML_CACHE_MAX_ENTRIES', '10000'))
+                max_bytes = int(os.environ.get('ML_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+                ttl = float(os.environ.get('ML_CACHE_TTL', '3600'))
+
+                if backend_name == 'disk':
+                    path = os.environ.get(
+                        'ML_CACHE_PATH',
+                        os.path.join(os.path.dirname(__file__), '..', 'cache', 'result_cache.sqlite3'),
+                    )
+                    backend = DiskCacheBackend(path, max_entries, max_bytes)
+                else:
+                    backend = MemoryCacheBackend(max_entries, max_bytes)
+
+                _cache = ResultCache(backend, ttl)
+
+    return _cache
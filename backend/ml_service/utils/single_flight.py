@@ -0,0 +1,120 @@
+"""
+Single-Flight Utility
+Coalesces identical analyses that are running at the same time
+
+When the same content arrives many times within a second (a viral post),
+the first request computes the result and every concurrent duplicate waits
+for it instead of starting its own OpenCV/Tesseract run. Keys are the
+content-hash cache keys, so only identical content under the same model and
+ruleset versions is coalesced. Unlike the result cache this keeps nothing:
+a key is forgotten as soon as its computation finishes.
+
+Waiters receive a copy of the result, or the exception the computation
+raised. A waiter that gives up after ML_COALESCE_TIMEOUT gets a
+CoalescingTimeoutError; the computation itself carries on for the others.
+
+Configuration (environment variables):
+- ML_COALESCE: coalesce identical in-flight analyses (default: true)
+- ML_COALESCE_TIMEOUT: seconds a duplicate waits for the shared result (default: 30)
+"""
+
+import copy
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from utils.metrics import COALESCED_REQUESTS
+
+class CoalescingTimeoutError(Exception):
+    """A duplicate request gave up waiting for the shared computation"""
+    status_code = 504
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time
+    """
+
+    def __init__(self, timeout: float = 30.0, enabled: bool = True):
+        self.timeout = timeout
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable, *args, kind: str = 'analysis'):
+        """
+        Call fn(*args), or wait for the identical call already in flight
+
+        Args:
+            key: Content key; calls with equal keys must be interchangeable
+            fn: Computation to run
+            kind: Label for the coalesced-requests metric
+
+        Returns:
+            fn's result (a deep copy for waiters, so callers may mutate it)
+
+        Raises:
+            Whatever fn raised, in the caller and in every waiter
+            CoalescingTimeoutError: a waiter timed out
+        """
+        if not self.enabled:
+            return fn(*args)
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if leader:
+            result = None
+            try:
+                result = fn(*args)
+                return result
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                # Forget the key before waking waiters, so later requests start afresh
+                with self._lock:
+                    del self._calls[key]
+                    waiters = call.waiters
+                if waiters and call.error is None:
+                    # The caller may mutate its result; waiters copy this one
+                    call.result = copy.deepcopy(result)
+                call.done.set()
+
+        COALESCED_REQUESTS.inc(kind=kind)
+        if not call.done.wait(self.timeout):
+            raise CoalescingTimeoutError(f'Timed out after {self.timeout}s waiting for an identical request')
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+def get_single_flight() -> SingleFlight:
+    """Get the process-wide coalescer configured from the environment"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(
+                    timeout=float(os.environ.get('ML_COALESCE_TIMEOUT', '30')),
+                    enabled=os.environ.get('ML_COALESCE', 'true').lower() == 'true',
+                )
+    return _single_flight
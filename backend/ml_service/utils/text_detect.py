@@ -0,0 +1,115 @@
+"""
+Text Presence Detection
+Cheap check for text in an image, run before OCR
+
+Characters are short, high-contrast strokes packed side by side. On a
+downscaled grayscale copy, the morphological gradient picks up stroke edges,
+a horizontal closing joins the characters of a line into one blob, and each
+blob is kept as a candidate text line when its size, edge fill and number of
+stroke crossings look like text rather than a photographic texture or a
+solid shape. The candidate lines are padded, merged and mapped back to
+full-resolution boxes, so OCR can skip images without text and read only
+the regions that have it.
+
+This costs a few milliseconds per image, against hundreds for Tesseract.
+"""
+
+from __future__ import annotations
+
+from typing import List, Tuple
+
+from utils.image_io import DecodedImage
+from utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+Box = Tuple[int, int, int, int]
+
+# Gradients below this are shading or sensor noise, not strokes, even when
+# Otsu picks a lower threshold (e.g. on smooth images)
+MIN_STROKE_CONTRAST = 24
+MIN_LINE_HEIGHT = 6
+MAX_LINE_HEIGHT_FRACTION = 0.3
+MIN_EDGE_FILL = 0.2
+MAX_EDGE_FILL = 0.8
+# Vertical stroke edges crossed per line height along the middle row
+MIN_CROSSINGS_PER_HEIGHT = 0.8
+
+def find_text_regions(image: DecodedImage, max_side: int = 640) -> List[Box]:
+    """
+    Find regions of an image that probably contain text
+
+    Args:
+        image: Decoded image
+        max_side: Longest side of the copy the check runs on
+
+    Returns:
+        (x, y, width, height) boxes in full-resolution pixels, in reading
+        order; empty when no text is likely
+    """
+    pixels = image.bgr
+    height, width = pixels.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    small_width, small_height = max(1, round(width * scale)), max(1, round(height * scale))
+    if scale < 0.5:
+        # Nearest-neighbour to twice the target first, so large images are
+        # never converted or area-averaged at full size
+        pixels = cv2.resize(pixels, (small_width * 2, small_height * 2), interpolation=cv2.INTER_NEAREST)
+    gray = cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (small_width, small_height), interpolation=cv2.INTER_AREA)
+    scale_x, scale_y = small_width / width, small_height / height
+
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT,
+                                cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    threshold, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    if threshold < MIN_STROKE_CONTRAST:
+        _, edges = cv2.threshold(gradient, MIN_STROKE_CONTRAST, 255, cv2.THRESH_BINARY)
+
+    joined = cv2.morphologyEx(edges, cv2.MORPH_CLOSE,
+                              cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    contours, _ = cv2.findContours(joined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    lines = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < MIN_LINE_HEIGHT or h > small_height * MAX_LINE_HEIGHT_FRACTION or 2 * w < h:
+            continue
+        box_edges = edges[y:y + h, x:x + w]
+        fill = cv2.countNonZero(box_edges) / float(w * h)
+        if not MIN_EDGE_FILL <= fill <= MAX_EDGE_FILL:
+            continue
+        middle = box_edges[h // 2] > 0
+        crossings = int(np.count_nonzero(middle[1:] & ~middle[:-1]))
+        if crossings < MIN_CROSSINGS_PER_HEIGHT * w / h:
+            continue
+        # Wide horizontal padding merges the words of a line into one region
+        lines.append([max(0, x - h), max(0, y - max(2, h // 3)),
+                      min(small_width, x + w + h), min(small_height, y + h + max(2, h // 3))])
+
+    merged = _merge_overlapping(lines)
+    boxes = []
+    for left, top, right, bottom in merged:
+        left, top = int(left / scale_x), int(top / scale_y)
+        right, bottom = min(width, int(np.ceil(right / scale_x))), min(height, int(np.ceil(bottom / scale_y)))
+        boxes.append((left, top, right - left, bottom - top))
+    return sorted(boxes, key=lambda box: (box[1], box[0]))
+
+def _merge_overlapping(boxes: List[List[int]]) -> List[List[int]]:
+    """Union (left, top, right, bottom) boxes until none overlap"""
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for other in result:
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    other[0], other[1] = min(other[0], box[0]), min(other[1], box[1])
+                    other[2], other[3] = max(other[2], box[2]), max(other[3], box[3])
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes